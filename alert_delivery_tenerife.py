@@ -0,0 +1,114 @@
+import logging
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.constants import ParseMode
+from telegram.error import Forbidden
+from constants_tenerife import FUEL_TYPES, INICI, ALERTS
+from alerts_tenerife import group_by_user
+from async_db_tenerife import async_data_manager
+from telegram_sender_tenerife import telegram_sender
+
+logger = logging.getLogger(__name__)
+
+# Most alerts combined into one digest message (Telegram messages are capped at 4096 characters)
+ALERT_DIGEST_SIZE = 10
+
+def create_alert_keyboard():
+    """Navigation keyboard attached to alert messages."""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🏠 Menú Principal", callback_data=str(INICI))],
+        [InlineKeyboardButton("📋 Mis Alertas", callback_data=str(ALERTS))]
+    ])
+
+def build_alert_message(notification):
+    """Return the send_message arguments of a price alert notification."""
+    fuel_display = FUEL_TYPES.get(notification['fuel_type'], {}).get('display', notification['fuel_type'])
+
+    alert_message = "🚨 **¡ALERTA DE PRECIO!**\n\n"
+    alert_message += f"⛽ **{fuel_display}:** {notification['current_price']}€\n"
+    alert_message += f"💰 **Tu límite:** ≤ {notification['threshold']}€\n"
+    alert_message += f"📍 **Ubicación:** {notification['municipality']}\n\n"
+    alert_message += f"🏪 **Estación:** {notification['station_name']}\n"
+    if notification['station_address']:
+        alert_message += f"📍 {notification['station_address']}\n\n"
+    alert_message += "💡 ¡Precio por debajo de tu alerta!"
+
+    return {
+        'chat_id': notification['user_id'],
+        'text': alert_message,
+        'parse_mode': ParseMode.MARKDOWN,
+        'reply_markup': create_alert_keyboard()
+    }
+
+def build_alert_digest(notifications):
+    """Return the send_message arguments of one message carrying a user's triggered alerts."""
+    if len(notifications) == 1:
+        return build_alert_message(notifications[0])
+
+    alert_message = f"🚨 **¡{len(notifications)} ALERTAS DE PRECIO!**\n\n"
+    for notification in notifications:
+        fuel_display = FUEL_TYPES.get(notification['fuel_type'], {}).get('display', notification['fuel_type'])
+        alert_message += f"⛽ **{fuel_display}:** {notification['current_price']}€ (límite ≤ {notification['threshold']}€)\n"
+        alert_message += f"📍 {notification['municipality']}\n"
+        alert_message += f"🏪 {notification['station_name']}"
+        if notification['station_address']:
+            alert_message += f" - {notification['station_address']}"
+        alert_message += "\n\n"
+    alert_message += "💡 ¡Precios por debajo de tus alertas!"
+
+    return {
+        'chat_id': notifications[0]['user_id'],
+        'text': alert_message,
+        'parse_mode': ParseMode.MARKDOWN,
+        'reply_markup': create_alert_keyboard()
+    }
+
+async def deliver_alert_outbox(bot, batch_size=50):
+    """Send the alert notifications queued in the outbox, one digest message per user.
+
+    Used by the bot and by notification_sender.py. Batches are claimed under
+    row locks, so several senders can drain the outbox at once; a row is
+    marked delivered (and its alert deactivated, or disarmed if it is
+    persistent) only after Telegram accepted the message. A user's
+    notifications in a batch are combined into one message, sends go through
+    the shared rate-limited sender and every database call runs in the
+    async_data_manager thread pool. Returns {'messages', 'alerts', 'failed'}.
+    """
+    delivered = 0
+
+    async def on_sent(notifications, message):
+        nonlocal delivered
+        # Delivered - mark them in the outbox and deactivate (or disarm) the alerts to prevent spam
+        for notification in notifications:
+            if await async_data_manager.complete_alert_notification(notification):
+                logger.info(f"   ✅ Sent alert to user {notification['user_id']} - {notification['fuel_type']}: {notification['current_price']}€")
+            else:
+                logger.warning(f"   ⚠️ Alert sent but its outbox claim on row {notification['outbox_id']} was lost")
+        delivered += len(notifications)
+
+    async def on_failed(notifications, error):
+        user_id = notifications[0]['user_id']
+        logger.error(f"Failed to send {len(notifications)} alerts to user {user_id}: {error}")
+        # A user who blocked the bot will never receive them
+        blocked = isinstance(error, Forbidden)
+        for notification in notifications:
+            await async_data_manager.fail_alert_notification(notification, error, retry=not blocked)
+        if blocked:
+            await async_data_manager.deactivate_users([user_id])
+
+    sent_count = 0
+    error_count = 0
+
+    while True:
+        notifications = await async_data_manager.claim_alert_notifications(batch_size)
+        if not notifications:
+            break
+        digests = group_by_user(notifications, ALERT_DIGEST_SIZE)
+        run = await telegram_sender.send_many(bot, digests, build_alert_digest, on_sent, on_failed)
+        sent_count += run['sent']
+        error_count += run['failed']
+
+    if delivered:
+        await async_data_manager.record_alert_digests(delivered, sent_count)
+    if sent_count or error_count:
+        logger.info(f"📊 Alert Summary - Messages sent: {sent_count} ({delivered} alerts, {delivered - sent_count} messages saved), Failed: {error_count}")
+    return {'messages': sent_count, 'alerts': delivered, 'failed': error_count}
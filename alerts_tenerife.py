@@ -0,0 +1,383 @@
+import bisect
+import math
+import threading
+import logging
+from constants_tenerife import FUEL_TYPES, MUNICIPALITIES
+
+logger = logging.getLogger(__name__)
+
+# Municipality display name (stored on alerts) -> id_municipio (stored on stations)
+MUNICIPALITY_IDS = {info['display']: info['id'] for info in MUNICIPALITIES.values()}
+
+# estaciones_servicio price column of every fuel type, and back
+FUEL_COLUMNS = {fuel_type: info['column'].lower() for fuel_type, info in FUEL_TYPES.items()}
+FUEL_TYPE_BY_COLUMN = {column: fuel_type for fuel_type, column in FUEL_COLUMNS.items()}
+
+# user_subscriptions.alert_state bit flags. A persistent alert is not deleted
+# once sent: it is disarmed until the price rises back above its threshold
+# plus the re-arm margin, and fires again no sooner than its cooldown allows.
+ALERT_PERSISTENT = 1
+ALERT_DISARMED = 2
+
+# Per-alert state columns, selected with every alert row
+ALERT_STATE_COLUMNS = ['alert_state', 'last_notified_at']
+
+# Columns of the active alert rows passed to the evaluator, in select order
+ALERT_COLUMNS = ['id', 'user_id', 'username', 'fuel_type', 'price_threshold', 'municipio'] + ALERT_STATE_COLUMNS
+
+ACTIVE_ALERTS_QUERY = f"""
+    SELECT {', '.join(ALERT_COLUMNS)}
+    FROM user_subscriptions
+    WHERE is_active = TRUE AND latitude IS NULL
+"""
+
+# Columns of the active location (radius) alert rows, in select order
+LOCATION_ALERT_COLUMNS = [
+    'id', 'user_id', 'username', 'fuel_type', 'price_threshold', 'latitude', 'longitude', 'radius_km'
+] + ALERT_STATE_COLUMNS
+
+# Columns of any alert row, municipality or location
+ALERT_ROW_COLUMNS = ALERT_COLUMNS + ['latitude', 'longitude', 'radius_km']
+
+LOCATION_ALERTS_QUERY = f"""
+    SELECT {', '.join(LOCATION_ALERT_COLUMNS)}
+    FROM user_subscriptions
+    WHERE is_active = TRUE AND latitude IS NOT NULL
+"""
+
+STATION_PRICES_QUERY = f"""
+    SELECT id_municipio, rotulo, direccion, IDEESS, {', '.join(FUEL_COLUMNS.values())}
+    FROM estaciones_servicio
+"""
+
+def alert_ready(alert, now, cooldown):
+    """Return True when an alert may fire: armed and out of its cooldown."""
+    if (alert.get('alert_state') or 0) & ALERT_DISARMED:
+        return False
+    notified_at = alert.get('last_notified_at')
+    return notified_at is None or now - notified_at >= cooldown
+
+def alert_disarmed(alert):
+    """Return True for a persistent alert waiting for the price to rise again."""
+    return bool((alert.get('alert_state') or 0) & ALERT_DISARMED)
+
+def cheapest_by_pair(rows):
+    """Return {(id_municipio, fuel_type): (price, rotulo, direccion, ideess)} in one pass.
+
+    ``rows`` are STATION_PRICES_QUERY rows: the cheapest station of every
+    (municipality, fuel) pair is found without a query per pair.
+    """
+    fuel_types = list(FUEL_COLUMNS)
+    cheapest = {}
+    for row in rows:
+        municipality_id, rotulo, direccion, ideess = row[0], row[1], row[2], row[3]
+        for fuel_type, value in zip(fuel_types, row[4:]):
+            if value is None:
+                continue
+            price = float(value)
+            if price <= 0:
+                continue
+            key = (municipality_id, fuel_type)
+            best = cheapest.get(key)
+            if best is None or price < best[0]:
+                cheapest[key] = (price, rotulo, direccion, ideess)
+    return cheapest
+
+STATION_LOCATIONS_QUERY = f"""
+    SELECT IDEESS, rotulo, direccion, latitud, longitud_wgs84, {', '.join(FUEL_COLUMNS.values())}
+    FROM estaciones_servicio
+    WHERE latitud IS NOT NULL AND longitud_wgs84 IS NOT NULL
+"""
+
+# Kilometres per degree of latitude; grid cells use a flat projection around Tenerife
+KM_PER_DEGREE = 111.32
+GRID_REFERENCE_LATITUDE = 28.3
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle (haversine) distance in kilometres."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+def station_prices_query(municipality_count):
+    """STATION_PRICES_QUERY restricted to some municipalities."""
+    placeholders = ", ".join(["%s"] * municipality_count)
+    return f"{STATION_PRICES_QUERY.rstrip()}\n    WHERE id_municipio IN ({placeholders})"
+
+def station_locations_query(station_count):
+    """STATION_LOCATIONS_QUERY restricted to some stations (IDEESS)."""
+    placeholders = ", ".join(["%s"] * station_count)
+    return f"{STATION_LOCATIONS_QUERY.rstrip()}\n      AND IDEESS IN ({placeholders})"
+
+def cheapest_by_location_alert(rows, index, changed=None, margin=0.0):
+    """Return {alert id: (alert, (price, rotulo, direccion, ideess))} for triggered location alerts.
+
+    ``rows`` are STATION_LOCATIONS_QUERY rows; each station price is only
+    checked against the alerts bucketed in the station's grid cell. With
+    ``changed`` (a set of (IDEESS, fuel_type)) only those prices are checked.
+    With ``margin`` an alert also matches prices up to threshold + margin.
+    """
+    fuel_types = list(FUEL_COLUMNS)
+    triggered = {}
+    for row in rows:
+        ideess, rotulo, direccion = row[0], row[1], row[2]
+        lat, lon = float(row[3]), float(row[4])
+        for fuel_type, value in zip(fuel_types, row[5:]):
+            if value is None or (changed is not None and (ideess, fuel_type) not in changed):
+                continue
+            price = float(value)
+            if price <= 0:
+                continue
+            for alert in index.matches(fuel_type, lat, lon, price - margin):
+                best = triggered.get(alert['id'])
+                if best is None or price < best[1][0]:
+                    triggered[alert['id']] = (alert, (price, rotulo, direccion, ideess))
+    return triggered
+
+def make_notification(alert, best):
+    """Build the notification dict sent for a triggered alert.
+
+    ``event_key`` names the price that triggered it (station and price), so
+    re-evaluating an unchanged price yields the same key (see the outbox).
+    A persistent alert that already fired adds the time of its last
+    notification, so the same price can notify again in a later cycle.
+    """
+    price, rotulo, direccion, ideess = best
+    municipality = alert.get('municipio')
+    if municipality is None:
+        municipality = f"{float(alert['radius_km']):g} km de tu ubicación"
+    event_key = f"{ideess}:{price:.3f}"
+    if alert.get('last_notified_at') is not None:
+        event_key += f"@{alert['last_notified_at']:%Y%m%d%H%M%S}"
+    return {
+        'user_id': alert['user_id'],
+        'alert_id': alert['id'],
+        'fuel_type': alert['fuel_type'],
+        'current_price': price,
+        'threshold': alert['price_threshold'],
+        'municipality': municipality,
+        'station_name': rotulo,
+        'station_address': direccion,
+        'event_key': event_key
+    }
+
+def group_by_user(notifications, size=None):
+    """Return the notifications as lists per user, in first-seen order.
+
+    With ``size`` a user's notifications are split into lists of at most
+    that many (one message must stay under Telegram's length limit).
+    """
+    by_user = {}
+    for notification in notifications:
+        by_user.setdefault(notification['user_id'], []).append(notification)
+    if size is None:
+        return list(by_user.values())
+    return [group[start:start + size] for group in by_user.values() for start in range(0, len(group), size)]
+
+class AlertIndex:
+    """Active alerts grouped by (id_municipio, fuel_type), thresholds sorted.
+
+    An alert fires when its pair's cheapest price is <= its threshold, so
+    with thresholds kept ascending every triggered alert of a pair is the
+    slice starting at bisect_left(thresholds, price). The index is loaded
+    once and then kept up to date with add() and remove().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thresholds = {}  # pair -> ascending thresholds
+        self._alerts = {}      # pair -> alerts, aligned with _thresholds
+        self._by_id = {}       # alert id -> (pair, threshold)
+        self.loaded = False
+
+    @staticmethod
+    def pair_of(alert):
+        """Return the (id_municipio, fuel_type) pair an alert watches."""
+        return (MUNICIPALITY_IDS.get(alert['municipio']), alert['fuel_type'])
+
+    def load(self, alert_rows):
+        """Replace the index with ACTIVE_ALERTS_QUERY rows."""
+        grouped = {}
+        by_id = {}
+        for row in alert_rows:
+            alert = dict(zip(ALERT_COLUMNS, row))
+            pair = self.pair_of(alert)
+            threshold = float(alert['price_threshold'])
+            grouped.setdefault(pair, []).append((threshold, alert['id'], alert))
+            by_id[alert['id']] = (pair, threshold)
+
+        thresholds = {}
+        alerts = {}
+        for pair, entries in grouped.items():
+            entries.sort(key=lambda entry: (entry[0], entry[1]))
+            thresholds[pair] = [entry[0] for entry in entries]
+            alerts[pair] = [entry[2] for entry in entries]
+
+        with self._lock:
+            self._thresholds = thresholds
+            self._alerts = alerts
+            self._by_id = by_id
+            self.loaded = True
+
+    def add(self, alert):
+        """Insert or update one alert (a dict with ALERT_COLUMNS keys)."""
+        pair = self.pair_of(alert)
+        threshold = float(alert['price_threshold'])
+        with self._lock:
+            self._remove(alert['id'])
+            thresholds = self._thresholds.setdefault(pair, [])
+            position = bisect.bisect_right(thresholds, threshold)
+            thresholds.insert(position, threshold)
+            self._alerts.setdefault(pair, []).insert(position, alert)
+            self._by_id[alert['id']] = (pair, threshold)
+
+    def remove(self, alert_id):
+        """Drop one alert; returns False when it was not indexed."""
+        with self._lock:
+            return self._remove(alert_id)
+
+    def _remove(self, alert_id):
+        entry = self._by_id.pop(alert_id, None)
+        if entry is None:
+            return False
+        pair, threshold = entry
+        thresholds = self._thresholds[pair]
+        alerts = self._alerts[pair]
+        # Only the alerts sharing this threshold need to be scanned
+        position = bisect.bisect_left(thresholds, threshold)
+        while alerts[position]['id'] != alert_id:
+            position += 1
+        del thresholds[position]
+        del alerts[position]
+        if not thresholds:
+            del self._thresholds[pair]
+            del self._alerts[pair]
+        return True
+
+    def triggered(self, pair, price):
+        """Return the alerts of a pair whose threshold is >= price."""
+        with self._lock:
+            thresholds = self._thresholds.get(pair)
+            if not thresholds:
+                return []
+            return self._alerts[pair][bisect.bisect_left(thresholds, price):]
+
+    def below(self, pair, price):
+        """Return the alerts of a pair whose threshold is < price."""
+        with self._lock:
+            thresholds = self._thresholds.get(pair)
+            if not thresholds:
+                return []
+            return self._alerts[pair][:bisect.bisect_left(thresholds, price)]
+
+    def pairs(self):
+        """Return every (id_municipio, fuel_type) pair with active alerts."""
+        with self._lock:
+            return list(self._thresholds)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_id)
+
+class LocationAlertIndex:
+    """Active location alerts (centre, radius) bucketed on a square km grid.
+
+    Every alert is stored in each cell its circle overlaps, per fuel type,
+    with thresholds kept ascending as in AlertIndex. A station price is then
+    checked against its own cell only: the threshold bisect drops alerts the
+    price does not satisfy and a distance is computed for the rest, so no
+    alert x station distance matrix is ever built.
+    """
+
+    def __init__(self, cell_km=5.0):
+        self.cell_km = cell_km
+        self._lon_scale = KM_PER_DEGREE * math.cos(math.radians(GRID_REFERENCE_LATITUDE))
+        self._lock = threading.Lock()
+        self._thresholds = {}  # (fuel_type, cell) -> ascending thresholds
+        self._alerts = {}      # (fuel_type, cell) -> alerts, aligned with _thresholds
+        self._by_id = {}       # alert id -> (keys, threshold, alert)
+        self.loaded = False
+
+    def _cell(self, lat, lon):
+        return (math.floor(lon * self._lon_scale / self.cell_km), math.floor(lat * KM_PER_DEGREE / self.cell_km))
+
+    def _cells(self, alert):
+        # Every cell overlapped by the alert circle's bounding box
+        lat, lon, radius = float(alert['latitude']), float(alert['longitude']), float(alert['radius_km'])
+        x, y = lon * self._lon_scale, lat * KM_PER_DEGREE
+        return [
+            (cx, cy)
+            for cx in range(math.floor((x - radius) / self.cell_km), math.floor((x + radius) / self.cell_km) + 1)
+            for cy in range(math.floor((y - radius) / self.cell_km), math.floor((y + radius) / self.cell_km) + 1)
+        ]
+
+    def _insert(self, alert):
+        threshold = float(alert['price_threshold'])
+        keys = [(alert['fuel_type'], cell) for cell in self._cells(alert)]
+        for key in keys:
+            thresholds = self._thresholds.setdefault(key, [])
+            position = bisect.bisect_right(thresholds, threshold)
+            thresholds.insert(position, threshold)
+            self._alerts.setdefault(key, []).insert(position, alert)
+        self._by_id[alert['id']] = (keys, threshold, alert)
+
+    def load(self, alert_rows):
+        """Replace the index with LOCATION_ALERTS_QUERY rows."""
+        with self._lock:
+            self._thresholds = {}
+            self._alerts = {}
+            self._by_id = {}
+            for row in alert_rows:
+                self._insert(dict(zip(LOCATION_ALERT_COLUMNS, row)))
+            self.loaded = True
+
+    def add(self, alert):
+        """Insert or update one alert (a dict with LOCATION_ALERT_COLUMNS keys)."""
+        with self._lock:
+            self._remove(alert['id'])
+            self._insert(alert)
+
+    def remove(self, alert_id):
+        """Drop one alert; returns False when it was not indexed."""
+        with self._lock:
+            return self._remove(alert_id)
+
+    def _remove(self, alert_id):
+        entry = self._by_id.pop(alert_id, None)
+        if entry is None:
+            return False
+        keys, threshold, _ = entry
+        for key in keys:
+            thresholds = self._thresholds[key]
+            alerts = self._alerts[key]
+            position = bisect.bisect_left(thresholds, threshold)
+            while alerts[position]['id'] != alert_id:
+                position += 1
+            del thresholds[position]
+            del alerts[position]
+            if not thresholds:
+                del self._thresholds[key]
+                del self._alerts[key]
+        return True
+
+    def matches(self, fuel_type, lat, lon, price):
+        """Return the alerts for a fuel whose circle contains (lat, lon) and whose threshold is >= price."""
+        with self._lock:
+            key = (fuel_type, self._cell(lat, lon))
+            thresholds = self._thresholds.get(key)
+            if not thresholds:
+                return []
+            candidates = self._alerts[key][bisect.bisect_left(thresholds, price):]
+        return [
+            alert for alert in candidates
+            if distance_km(lat, lon, float(alert['latitude']), float(alert['longitude'])) <= float(alert['radius_km'])
+        ]
+
+    def alerts(self):
+        """Return every indexed location alert."""
+        with self._lock:
+            return [entry[2] for entry in self._by_id.values()]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_id)
@@ -0,0 +1,116 @@
+import asyncio
+import functools
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from data_manager_tenerife import tenerife_data_manager
+
+logger = logging.getLogger(__name__)
+
+class AsyncDataManager:
+    """Awaitable facade over TenerifeDataManager backed by a bounded thread pool.
+
+    Every database call runs in a dedicated worker thread so a slow MySQL
+    round trip never blocks the asyncio event loop. The number of workers
+    matches the connection pool size, so queued calls wait for a thread
+    instead of piling up on the pool. Chart calls wait on the chart
+    renderer's process pool, so they run in their own threads (one per
+    render queue slot) and pending renders never hold up database work.
+    """
+
+    # Calls that wait for a chart render; they release their connection before it
+    CHART_CALLS = frozenset({
+        'get_price_chart', 'get_comparison_chart',
+        'render_price_chart', 'render_comparison_chart', 'render_price_map',
+    })
+
+    def __init__(self, data_manager, max_workers=None):
+        self._data_manager = data_manager
+        if max_workers is None:
+            max_workers = data_manager.backend.pool_size
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tenerife-db')
+        self._chart_executor = ThreadPoolExecutor(
+            max_workers=data_manager.chart_renderer.max_pending, thread_name_prefix='tenerife-chart'
+        )
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking callable in the database thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def run_chart(self, func, *args, **kwargs):
+        """Run a blocking callable that waits for a chart render in the chart thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._chart_executor, functools.partial(func, *args, **kwargs))
+
+    def __getattr__(self, name):
+        attr = getattr(self._data_manager, name)
+        if not callable(attr):
+            return attr
+
+        run = self.run_chart if name in self.CHART_CALLS else self.run
+
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await run(attr, *args, **kwargs)
+        return wrapper
+
+    def shutdown(self, wait=True):
+        """Stop accepting work and wait for running calls to finish."""
+        self._executor.shutdown(wait=wait)
+        self._chart_executor.shutdown(wait=wait)
+
+class EventLoopLagMonitor:
+    """Measure how late the event loop wakes up from a fixed-interval sleep."""
+
+    def __init__(self, interval=0.5, window=600, warn_threshold=0.25):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self._samples = deque(maxlen=window)
+        self._max_lag = 0.0
+        self._task = None
+
+    def start(self):
+        """Start sampling on the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop sampling."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self._samples.append(lag)
+            self._max_lag = max(self._max_lag, lag)
+            if lag > self.warn_threshold:
+                logger.warning(f"Event loop lag of {lag * 1000:.0f} ms detected")
+
+    def get_statistics(self):
+        """Return lag statistics (milliseconds) over the recent sampling window."""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return {
+            'samples': len(ordered),
+            'avg_ms': sum(ordered) / len(ordered) * 1000,
+            'p95_ms': p95 * 1000,
+            'max_window_ms': ordered[-1] * 1000,
+            'max_ms': self._max_lag * 1000
+        }
+
+# Create global instances
+async_data_manager = AsyncDataManager(tenerife_data_manager)
+event_loop_monitor = EventLoopLagMonitor()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Daily Price Statistics Backfill for Tenerife Bot
+Rebuilds the daily_price_stats rollups (count/avg/min/max/p10/p50/p90 per
+date, fuel and municipality) from the price_history fact table.
+
+Usage:
+    python backfill_stats_tenerife.py          # whole history
+    python backfill_stats_tenerife.py 90       # last 90 days only
+"""
+
+import sys
+import time
+from data_manager_tenerife import tenerife_data_manager
+
+def main():
+    days = None
+    if len(sys.argv) > 1:
+        try:
+            days = int(sys.argv[1])
+        except ValueError:
+            print("Usage: python backfill_stats_tenerife.py [days]")
+            sys.exit(1)
+
+    tenerife_data_manager.create_database_and_tables()
+
+    start = time.perf_counter()
+    rows = tenerife_data_manager.rebuild_daily_stats(days=days)
+    print(f"Done in {time.perf_counter() - start:.1f}s ({rows} rows)")
+
+if __name__ == "__main__":
+    main()
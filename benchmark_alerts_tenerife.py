@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Alert Evaluation Benchmark for Tenerife Bot
+Fills user_subscriptions with synthetic alerts spread over every municipality
+and fuel type, then measures evaluation time, database round trips and memory
+for each evaluator:
+
+    legacy   the original check_price_alerts: one price query per alert
+    batch    check_price_alerts with the alert indexes reloaded (cold)
+    indexed  check_price_alerts with the alert indexes already loaded (warm)
+    events   check_alerts_for_events on one batch of simulated price drops
+
+Usage:
+    python benchmark_alerts_tenerife.py                    # 1k, 10k and 100k alerts on SQLite
+    python benchmark_alerts_tenerife.py 1000 5000          # custom sizes
+    python benchmark_alerts_tenerife.py 1000 10000 mysql   # on MySQL instead
+
+The price snapshot is loaded from municipis_original/ into a scratch database
+(a temporary SQLite file or a "<db_name>_benchmark" MySQL database), and the
+price changes are simulated by lowering some station prices, so production
+data is untouched.
+"""
+
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import secret
+from constants_tenerife import FUEL_TYPES, MUNICIPALITIES
+from alerts_tenerife import FUEL_COLUMNS
+from storage_tenerife import create_backend
+from data_manager_tenerife import TenerifeDataManager
+
+ALERT_COUNTS = [1000, 10000, 100000]
+REPEAT = 3
+# The legacy evaluator is timed once above this many alerts
+LEGACY_REPEAT_LIMIT = 10000
+# Share of the synthetic alerts that watch a radius around a point
+LOCATION_SHARE = 0.1
+# Stations whose prices drop in the simulated change batch
+CHANGED_STATIONS = 50
+PRICE_DROP = 0.05
+INSERT_CHUNK = 5000
+
+class _CountingCursor:
+    """Cursor proxy that counts statements sent to the database."""
+
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, *args, **kwargs):
+        self._counter.round_trips += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._counter.round_trips += 1
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class _CountingConnection:
+    def __init__(self, connection, counter):
+        self._connection = connection
+        self._counter = counter
+
+    def cursor(self, *args, **kwargs):
+        return _CountingCursor(self._connection.cursor(*args, **kwargs), self._counter)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+class RoundTripCounter:
+    """Counts the statements a data manager sends, by wrapping its connections."""
+
+    def __init__(self, manager):
+        self.round_trips = 0
+        backend = manager.backend
+
+        @contextlib.contextmanager
+        def counted_connection():
+            with backend.connection() as connection:
+                yield _CountingConnection(connection, self)
+
+        manager._connection = counted_connection
+
+def legacy_check_price_alerts(manager):
+    """The check_price_alerts evaluator before set-based evaluation: one price query per alert."""
+    with manager._connection() as connection:
+        cursor = connection.cursor(dictionary=True)
+        notifications = []
+        try:
+            cursor.execute("""
+            SELECT s.id, s.user_id, s.username, s.fuel_type, s.price_threshold, s.municipio
+            FROM user_subscriptions s
+            WHERE s.is_active = TRUE
+            """)
+            alerts = cursor.fetchall()
+
+            for alert in alerts:
+                fuel_column = None
+                for fuel_key, fuel_info in FUEL_TYPES.items():
+                    if fuel_key == alert['fuel_type']:
+                        fuel_column = fuel_info['column'].lower()
+                        break
+                if not fuel_column:
+                    continue
+
+                municipality_id = None
+                for muni_key, muni_info in MUNICIPALITIES.items():
+                    if muni_info['display'] == alert['municipio']:
+                        municipality_id = muni_info['id']
+                        break
+                if not municipality_id:
+                    continue
+
+                cursor.execute(f"""
+                SELECT MIN({fuel_column}) as min_price, rotulo, direccion
+                FROM estaciones_servicio
+                WHERE id_municipio = %s AND {fuel_column} IS NOT NULL AND {fuel_column} > 0
+                GROUP BY rotulo, direccion
+                ORDER BY min_price ASC
+                LIMIT 1
+                """, (municipality_id,))
+                result = cursor.fetchone()
+
+                if result and result['min_price'] <= alert['price_threshold']:
+                    notifications.append({
+                        'user_id': alert['user_id'],
+                        'alert_id': alert['id'],
+                        'fuel_type': alert['fuel_type'],
+                        'current_price': result['min_price'],
+                        'threshold': alert['price_threshold'],
+                        'municipality': alert['municipio'],
+                        'station_name': result['rotulo'],
+                        'station_address': result['direccion']
+                    })
+            return notifications
+        finally:
+            cursor.close()
+
+def _station_locations(manager):
+    with manager._connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT latitud, longitud_wgs84 FROM estaciones_servicio WHERE latitud IS NOT NULL")
+        rows = [(float(lat), float(lon)) for lat, lon in cursor.fetchall()]
+        cursor.close()
+    return rows
+
+def fill_alerts(manager, count, seed=0):
+    """Replace user_subscriptions with ``count`` synthetic alerts (about three per user)."""
+    rng = random.Random(seed)
+    municipalities = [info['display'] for info in MUNICIPALITIES.values()]
+    fuel_types = list(FUEL_TYPES)
+    locations = _station_locations(manager)
+
+    rows = []
+    for i in range(count):
+        user_id = 3000000 + i // 3
+        fuel_type = fuel_types[i % len(fuel_types)]
+        threshold = round(rng.uniform(0.90, 1.60), 3)
+        if rng.random() < LOCATION_SHARE:
+            lat, lon = rng.choice(locations)
+            lat, lon = lat + rng.uniform(-0.05, 0.05), lon + rng.uniform(-0.05, 0.05)
+            rows.append((user_id, f"user{user_id}", fuel_type, threshold, None, lat, lon, rng.choice([2, 5, 10])))
+        else:
+            rows.append((user_id, f"user{user_id}", fuel_type, threshold, rng.choice(municipalities), None, None, None))
+
+    with manager._connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM user_subscriptions")
+        for start in range(0, len(rows), INSERT_CHUNK):
+            cursor.executemany("""
+                INSERT INTO user_subscriptions
+                (user_id, username, fuel_type, price_threshold, municipio, latitude, longitude, radius_km, is_active)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, TRUE)
+            """, rows[start:start + INSERT_CHUNK])
+        connection.commit()
+        cursor.close()
+
+def simulate_price_drops(manager, seed=0):
+    """Lower some station prices, record the change and return its price-change events."""
+    rng = random.Random(seed)
+    events = []
+    manager.subscribe_price_changes(events.extend)
+
+    with manager._connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT IDEESS FROM estaciones_servicio")
+        stations = [row[0] for row in cursor.fetchall()]
+        changed = rng.sample(stations, min(CHANGED_STATIONS, len(stations)))
+        for column in (FUEL_COLUMNS['GASOLINA_95_E5'], FUEL_COLUMNS['GASOLEO_A']):
+            cursor.executemany(
+                f"UPDATE estaciones_servicio SET {column} = {column} - %s WHERE IDEESS = %s AND {column} > 0",
+                [(PRICE_DROP, ideess) for ideess in changed]
+            )
+        connection.commit()
+        cursor.close()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        manager.record_price_changes()
+    return events
+
+def measure(counter, func, repeat):
+    """Time ``func`` ``repeat`` times, then run it once more under tracemalloc.
+
+    Returns (timings in ms, round trips per run, peak MB, result).
+    """
+    timings = []
+    trips = 0
+    for _ in range(repeat):
+        start_trips = counter.round_trips
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+        trips = counter.round_trips - start_trips
+
+    # Memory in a separate run: tracemalloc slows allocation-heavy code down
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return timings, trips, peak / 1024 / 1024, result
+
+def index_memory(manager):
+    """Return the MB retained by the loaded alert indexes."""
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        manager.refresh_alert_index()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (after - before) / 1024 / 1024
+
+def run_size(manager, counter, count, events):
+    """Benchmark every evaluator on ``count`` alerts; returns result rows."""
+    fill_alerts(manager, count)
+    results = []
+
+    def cold():
+        manager.refresh_alert_index()
+        return manager.check_price_alerts()
+
+    legacy_repeat = REPEAT if count <= LEGACY_REPEAT_LIMIT else 1
+    evaluators = [
+        ('legacy', lambda: legacy_check_price_alerts(manager), legacy_repeat),
+        ('batch', cold, REPEAT),
+        ('indexed', manager.check_price_alerts, REPEAT),
+        ('events', lambda: manager.check_alerts_for_events(events), REPEAT),
+    ]
+    triggered = {}
+    for name, func, repeat in evaluators:
+        with contextlib.redirect_stdout(io.StringIO()):
+            timings, trips, peak, notifications = measure(counter, func, repeat)
+        triggered[name] = {notification['alert_id'] for notification in notifications}
+        results.append({
+            'alerts': count,
+            'evaluator': name,
+            'p50': statistics.median(timings),
+            'round_trips': trips,
+            'peak_mb': peak,
+            'triggered': len(notifications),
+        })
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        retained = index_memory(manager)
+    # The legacy evaluator only knows municipality alerts
+    municipality_triggered = triggered['batch'] - {
+        alert['id'] for alert in manager.location_alert_index.alerts()
+    }
+    print(f"   {count} alerts: indexes hold {retained:.1f} MB, "
+          f"legacy and batch agree: {'yes' if municipality_triggered == triggered['legacy'] else 'NO'}")
+    return results
+
+def print_results(rows):
+    header = f"{'alerts':>8} {'evaluator':<10}{'p50':>12}{'round trips':>13}{'peak MB':>10}{'triggered':>11}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['alerts']:>8} {row['evaluator']:<10}{row['p50']:>10.1f}ms{row['round_trips']:>13}"
+              f"{row['peak_mb']:>10.1f}{row['triggered']:>11}")
+
+def main():
+    args = sys.argv[1:]
+    backend_name = 'mysql' if 'mysql' in args else 'sqlite'
+    counts = [int(arg) for arg in args if arg.isdigit()] or ALERT_COUNTS
+
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Work in a scratch directory that still sees the JSON source files
+        os.symlink(os.path.join(repo_dir, 'municipis_original'), os.path.join(work_dir, 'municipis_original'))
+        previous_dir = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            config = dict(secret.secret)
+            config['db_backend'] = backend_name
+            config['sqlite_path'] = os.path.join(work_dir, 'benchmark.db')
+            config['db_name'] = f"{config.get('db_name', 'tenerife')}_benchmark"
+
+            backend = create_backend(config)
+            manager = TenerifeDataManager(backend=backend)
+            counter = RoundTripCounter(manager)
+            print(f"⏱️ Loading the price snapshot into {backend_name}...")
+            with contextlib.redirect_stdout(io.StringIO()):
+                manager.load_json_data()
+            events = simulate_price_drops(manager)
+            print(f"   {len(events)} simulated price changes")
+
+            for count in counts:
+                print(f"⏱️ Evaluating {count} alerts...")
+                rows.extend(run_size(manager, counter, count, events))
+
+            manager.chart_renderer.shutdown()
+            backend.dispose()
+        finally:
+            os.chdir(previous_dir)
+
+    print()
+    print_results(rows)
+
+if __name__ == "__main__":
+    main()
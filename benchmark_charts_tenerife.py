@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Chart Output Benchmark for Tenerife Bot
+Compares the old chart output (12x8 in at 300 dpi, written to charts/ and read
+back) with the in-memory Telegram-sized formats, reporting image size, byte
+size and encode time.
+
+Usage:
+    python benchmark_charts_tenerife.py              # 30-day GASOLINA_95_E5 chart
+    python benchmark_charts_tenerife.py 90 GASOLEO_A
+
+Uses the daily statistics in the configured database when there are at least
+two days of history, and a synthetic series otherwise.
+"""
+
+import datetime
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from PIL import Image
+from constants_tenerife import FUEL_TYPES
+from chart_renderer_tenerife import build_price_figure, encode_figure, CHART_SIZE, CHART_DPI
+
+REPEAT = 10
+
+def _series_from_db(fuel_type, days):
+    from data_manager_tenerife import tenerife_data_manager
+    history = tenerife_data_manager.history
+    end_date = datetime.date.today()
+    start_date = end_date - datetime.timedelta(days=days)
+    try:
+        with tenerife_data_manager._connection() as connection:
+            cursor = connection.cursor()
+            data = history.daily_series(cursor, history.fuel_id_for(FUEL_TYPES[fuel_type]), start_date, end_date)
+            cursor.close()
+    except Exception as e:
+        print(f"⚠️ Could not read history ({e}), using a synthetic series")
+        return None
+    if len(data) < 2:
+        return None
+    return {
+        'dates': [row[0] for row in data],
+        'avg': [float(row[1]) for row in data],
+        'min': [float(row[2]) for row in data],
+        'max': [float(row[3]) for row in data],
+    }
+
+def _synthetic_series(days):
+    random.seed(days)
+    today = datetime.date.today()
+    dates = [today - datetime.timedelta(days=days - i) for i in range(days + 1)]
+    avg = [1.45 + 0.03 * random.uniform(-1, 1) for _ in dates]
+    return {
+        'dates': dates,
+        'avg': avg,
+        'min': [price - random.uniform(0.05, 0.10) for price in avg],
+        'max': [price + random.uniform(0.05, 0.10) for price in avg],
+    }
+
+def _legacy_output(fig):
+    # What the old path did: 300 dpi PNG on disk, read back, then deleted
+    with tempfile.TemporaryDirectory() as charts_dir:
+        chart_filename = os.path.join(charts_dir, 'chart.png')
+        fig.savefig(chart_filename, format='png', dpi=300, bbox_inches='tight')
+        with open(chart_filename, 'rb') as f:
+            data = f.read()
+        os.remove(chart_filename)
+    return data
+
+def _image_size(data):
+    with Image.open(io.BytesIO(data)) as image:
+        return f"{image.width}x{image.height}"
+
+def measure(series, size, encode):
+    """Return (median encode ms, image bytes); the figure is rebuilt for each run."""
+    timings = []
+    data = None
+    for _ in range(REPEAT):
+        fig = build_price_figure(series, size)
+        start = time.perf_counter()
+        data = encode(fig)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), data
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    fuel_type = sys.argv[2] if len(sys.argv) > 2 else 'GASOLINA_95_E5'
+    if fuel_type not in FUEL_TYPES:
+        print(f"Unknown fuel type: {fuel_type}")
+        return
+
+    series = _series_from_db(fuel_type, days) or _synthetic_series(days)
+    series.update({'title': FUEL_TYPES[fuel_type]['display'], 'days': days})
+
+    outputs = [
+        ('before: png 300dpi + disk', (12, 8), _legacy_output),
+        ('after: png', CHART_SIZE, lambda fig: encode_figure(fig, 'png', CHART_DPI)),
+        ('after: png-palette', CHART_SIZE, lambda fig: encode_figure(fig, 'png-palette', CHART_DPI)),
+        ('after: webp', CHART_SIZE, lambda fig: encode_figure(fig, 'webp', CHART_DPI)),
+    ]
+
+    print(f"📊 {fuel_type}, {days} days, {len(series['dates'])} points (median of {REPEAT} runs)")
+    print(f"  {'output':<28} {'pixels':>10} {'bytes':>10} {'encode':>10}")
+    baseline = None
+    for name, size, encode in outputs:
+        encode_ms, data = measure(series, size, encode)
+        baseline = baseline or len(data)
+        print(f"  {name:<28} {_image_size(data):>10} {len(data):>10} {encode_ms:>8.1f}ms  ({len(data) / baseline:.0%})")
+
+if __name__ == "__main__":
+    main()
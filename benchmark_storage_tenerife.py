@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Storage Backend Benchmark for Tenerife Bot
+Runs the same query suite against the embedded SQLite backend and, optionally,
+MySQL, and prints per-operation latency so the backend can be chosen per deployment.
+
+Usage:
+    python benchmark_storage_tenerife.py          # SQLite only
+    python benchmark_storage_tenerife.py mysql    # SQLite and MySQL
+
+The MySQL run uses a separate "<db_name>_benchmark" database and every run
+works inside a temporary directory, so production data and files are untouched.
+"""
+
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+import datetime
+import secret
+from storage_tenerife import create_backend
+from data_manager_tenerife import TenerifeDataManager
+
+REPEAT = 20
+SYNTHETIC_USERS = 1000
+SYNTHETIC_ALERTS = 200
+
+def _time_call(func, repeat):
+    """Run func `repeat` times (stdout silenced) and return latencies in ms."""
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def _synthetic_interactions():
+    now = datetime.datetime.now()
+    return [
+        {
+            'user_id': 1000000 + i,
+            'username': f"user{i}",
+            'first_name': f"User {i}",
+            'last_name': None,
+            'language_code': 'es',
+            'count': 1 + i % 5,
+            'last_seen': now
+        }
+        for i in range(SYNTHETIC_USERS)
+    ]
+
+def _create_alerts(manager):
+    municipalities = ['Adeje', 'Arona', 'Santa Cruz de Tenerife', 'San Cristóbal de La Laguna']
+    fuels = ['GASOLINA_95_E5', 'GASOLEO_A']
+    for i in range(SYNTHETIC_ALERTS):
+        manager.create_price_alert(
+            2000000 + i, f"alert{i}", fuels[i % len(fuels)], 1.20 + (i % 40) / 100,
+            municipalities[i % len(municipalities)]
+        )
+
+def run_suite(manager, repeat=REPEAT):
+    """Run the query suite on one data manager and return {operation: timings}."""
+    results = {}
+
+    # One-off setup operations (timed once)
+    results['load_json_data'] = _time_call(manager.load_json_data, 1)
+    results['create_historical_backfill(30d)'] = _time_call(lambda: manager.create_historical_backfill(days_back=30), 1)
+    results[f'create_price_alert x{SYNTHETIC_ALERTS}'] = _time_call(lambda: _create_alerts(manager), 1)
+
+    interactions = _synthetic_interactions()
+    suite = [
+        ('load_data_from_db', manager.load_data_from_db),
+        (f'track_user_interactions_batch({SYNTHETIC_USERS})', lambda: manager.track_user_interactions_batch(interactions)),
+        ('track_user_interaction', lambda: manager.track_user_interaction(1000001, 'user1', 'User 1', None, 'es')),
+        ('get_admin_statistics', manager.get_admin_statistics),
+        ('get_recent_users(20)', lambda: manager.get_recent_users(limit=20)),
+        ('get_all_active_users', manager.get_all_active_users),
+        ('get_user_alerts', lambda: manager.get_user_alerts(2000001)),
+        ('check_price_alerts', manager.check_price_alerts),
+        ('get_alert_statistics', manager.get_alert_statistics),
+        ('check_historical_data_status', manager.check_historical_data_status),
+        ('render_price_chart(30d)', lambda: manager.render_price_chart('GASOLINA_95_E5', 30, block=True)),
+    ]
+
+    for name, func in suite:
+        results[name] = _time_call(func, repeat)
+
+    return results
+
+def print_results(all_results):
+    backends = list(all_results.keys())
+    operations = list(next(iter(all_results.values())).keys())
+
+    header = f"{'operation':<42}" + "".join(f"{name + ' p50':>14}{name + ' p95':>14}" for name in backends)
+    print(header)
+    print("-" * len(header))
+    for operation in operations:
+        row = f"{operation:<42}"
+        for name in backends:
+            timings = sorted(all_results[name][operation])
+            p50 = statistics.median(timings)
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            row += f"{p50:>12.2f}ms{p95:>12.2f}ms"
+        print(row)
+
+def main():
+    backends = ['sqlite']
+    if len(sys.argv) > 1 and sys.argv[1] == 'mysql':
+        backends.append('mysql')
+
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    all_results = {}
+
+    for backend_name in backends:
+        with tempfile.TemporaryDirectory() as work_dir:
+            # Work in a scratch directory that still sees the JSON source files
+            os.symlink(os.path.join(repo_dir, 'municipis_original'), os.path.join(work_dir, 'municipis_original'))
+            previous_dir = os.getcwd()
+            os.chdir(work_dir)
+            try:
+                config = dict(secret.secret)
+                config['db_backend'] = backend_name
+                config['sqlite_path'] = os.path.join(work_dir, 'benchmark.db')
+                config['db_name'] = f"{config.get('db_name', 'tenerife')}_benchmark"
+
+                backend = create_backend(config)
+                print(f"⏱️ Running query suite on {backend_name}...")
+                manager = TenerifeDataManager(backend=backend)
+                all_results[backend_name] = run_suite(manager)
+                print(f"   pool: {backend.get_statistics()}")
+                manager.chart_renderer.shutdown()
+                backend.dispose()
+            finally:
+                os.chdir(previous_dir)
+
+    print()
+    print_results(all_results)
+
+if __name__ == "__main__":
+    main()
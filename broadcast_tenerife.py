@@ -0,0 +1,101 @@
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Recipient states; 'pending' rows are the ones still to be sent
+RECIPIENT_STATUSES = ['pending', 'sent', 'failed', 'blocked']
+
+JOB_COLUMNS = [
+    'id', 'admin_id', 'message', 'status', 'total', 'sent', 'failed', 'blocked',
+    'progress_message_id', 'created_at', 'finished_at'
+]
+
+class BroadcastJobs:
+    """Admin broadcasts stored as jobs with one row per recipient.
+
+    The recipient list is fixed when the job is created, and every result is
+    written back per recipient, so a job interrupted by a restart resumes with
+    only the recipients still pending. Every method works on a cursor; the
+    caller owns the transaction.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def create(self, cursor, admin_id, message):
+        """Create a running job addressed to every active user; returns its id."""
+        cursor.execute(
+            "INSERT INTO broadcast_jobs (admin_id, message, status) VALUES (%s, %s, 'running')",
+            (admin_id, message)
+        )
+        job_id = cursor.lastrowid
+        cursor.execute("""
+            INSERT INTO broadcast_recipients (job_id, user_id)
+            SELECT %s, user_id FROM bot_users WHERE is_active = TRUE
+        """, (job_id,))
+        cursor.execute(
+            "UPDATE broadcast_jobs SET total = (SELECT COUNT(*) FROM broadcast_recipients WHERE job_id = %s) WHERE id = %s",
+            (job_id, job_id)
+        )
+        return job_id
+
+    def pending_recipients(self, cursor, job_id, limit=100):
+        """Return up to ``limit`` user ids the job has not sent to yet."""
+        cursor.execute("""
+            SELECT user_id FROM broadcast_recipients
+            WHERE job_id = %s AND status = 'pending'
+            ORDER BY user_id
+            LIMIT %s
+        """, (job_id, limit))
+        return [row[0] for row in cursor.fetchall()]
+
+    def record(self, cursor, job_id, results, now=None):
+        """Store per-recipient results [(user_id, status, error)] and update the job counters."""
+        now = now or datetime.datetime.now()
+        cursor.executemany("""
+            UPDATE broadcast_recipients SET status = %s, error = %s, sent_at = %s
+            WHERE job_id = %s AND user_id = %s AND status = 'pending'
+        """, [
+            (status, str(error)[:255] if error else None, now if status == 'sent' else None, job_id, user_id)
+            for user_id, status, error in results
+        ])
+
+        counts = {status: 0 for status in RECIPIENT_STATUSES[1:]}
+        for _, status, _ in results:
+            counts[status] += 1
+        cursor.execute("""
+            UPDATE broadcast_jobs SET sent = sent + %s, failed = failed + %s, blocked = blocked + %s
+            WHERE id = %s
+        """, (counts['sent'], counts['failed'], counts['blocked'], job_id))
+        return counts
+
+    def set_progress_message(self, cursor, job_id, message_id):
+        """Remember the admin message that shows the job's progress."""
+        cursor.execute("UPDATE broadcast_jobs SET progress_message_id = %s WHERE id = %s", (message_id, job_id))
+
+    def finish(self, cursor, job_id, status='completed'):
+        """Close a running job as completed or cancelled; returns False if it was not running."""
+        cursor.execute(
+            "UPDATE broadcast_jobs SET status = %s, finished_at = %s WHERE id = %s AND status = 'running'",
+            (status, datetime.datetime.now(), job_id)
+        )
+        return cursor.rowcount > 0
+
+    def get(self, cursor, job_id):
+        """Return one job as a dict, or None."""
+        cursor.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM broadcast_jobs WHERE id = %s", (job_id,))
+        row = cursor.fetchone()
+        return dict(zip(JOB_COLUMNS, row)) if row else None
+
+    def recent(self, cursor, status=None, limit=10):
+        """Return the newest jobs as dicts, optionally only those in one state."""
+        where = "WHERE status = %s" if status else ""
+        params = (status, limit) if status else (limit,)
+        cursor.execute(f"""
+            SELECT {', '.join(JOB_COLUMNS)} FROM broadcast_jobs
+            {where}
+            ORDER BY id DESC
+            LIMIT %s
+        """, params)
+        return [dict(zip(JOB_COLUMNS, row)) for row in cursor.fetchall()]
@@ -0,0 +1,99 @@
+import os
+import re
+import glob
+import threading
+import logging
+from cachetools import LRUCache
+
+logger = logging.getLogger(__name__)
+
+class ChartCache:
+    """Rendered chart images keyed by (fuel type, days, history version).
+
+    Recent charts are held in a small in-memory LRU; every chart is also
+    written to a disk directory, so charts survive evictions and restarts
+    and charts pre-rendered by the ingest process are served by the bot.
+    A new history version simply produces new keys; old files are pruned.
+    """
+
+    def __init__(self, directory=os.path.join('data', 'chart_cache'), max_memory_items=48, extension='png'):
+        self.directory = directory
+        self.extension = extension
+        self._memory = LRUCache(maxsize=max_memory_items)
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+
+    @staticmethod
+    def _safe(value):
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', str(value))
+
+    def _path(self, key):
+        fuel_type, days, version = key
+        return os.path.join(self.directory, f"{self._safe(version)}__{self._safe(fuel_type)}_{int(days)}d.{self.extension}")
+
+    def get(self, fuel_type, days, version):
+        """Return the cached image bytes, or None."""
+        key = (fuel_type, int(days), version)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self.stats['memory_hits'] += 1
+                return data
+
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+
+        with self._lock:
+            self._memory[key] = data
+            self.stats['disk_hits'] += 1
+        return data
+
+    def put(self, fuel_type, days, version, data):
+        """Store image bytes in memory and on disk."""
+        key = (fuel_type, int(days), version)
+        with self._lock:
+            self._memory[key] = data
+            self.stats['stores'] += 1
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write then rename so readers in other processes never see a partial file
+            path = self._path(key)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.error(f"Could not write chart cache file: {e}")
+
+    def prune(self, keep_version):
+        """Drop every cached chart that belongs to another history version."""
+        with self._lock:
+            for key in [key for key in self._memory.keys() if key[2] != keep_version]:
+                del self._memory[key]
+
+        prefix = f"{self._safe(keep_version)}__"
+        removed = 0
+        for path in glob.glob(os.path.join(self.directory, '*.*')):
+            name = os.path.basename(path)
+            if name.endswith('.tmp'):
+                continue  # Being written by another process
+            if not name.startswith(prefix) or not name.endswith(f".{self.extension}"):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def get_statistics(self):
+        """Return hit/miss counters and the number of charts held in memory."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['memory_items'] = len(self._memory)
+        return stats
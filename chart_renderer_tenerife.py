@@ -0,0 +1,268 @@
+import io
+import math
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.dates as mdates
+
+logger = logging.getLogger(__name__)
+
+# Telegram shows photos at most 1280px on the long side, so draw at that size
+CHART_SIZE = (10, 6.25)
+CHART_DPI = 128
+# Output format -> file extension
+CHART_FORMATS = {'png': 'png', 'png-palette': 'png', 'webp': 'webp'}
+
+class ChartRendererBusy(Exception):
+    """Raised when the render queue is full."""
+
+def encode_figure(fig, output_format='png', dpi=CHART_DPI, bbox_inches=None):
+    """Encode a figure into image bytes in memory.
+
+    'png' is matplotlib's own PNG, 'png-palette' quantizes it to a 256 colour
+    palette and 'webp' is lossless WebP; the last two are encoded with Pillow.
+    """
+    buffer = io.BytesIO()
+    if output_format == 'png':
+        fig.savefig(buffer, format='png', dpi=dpi, bbox_inches=bbox_inches)
+        return buffer.getvalue()
+
+    # Pillow ships with matplotlib, so it is always available here
+    from PIL import Image
+    fig.set_dpi(dpi)
+    canvas = fig.canvas
+    canvas.draw()
+    image = Image.frombuffer('RGBA', canvas.get_width_height(), canvas.buffer_rgba()).convert('RGB')
+    if output_format == 'png-palette':
+        image.quantize(colors=256).save(buffer, format='PNG', optimize=True)
+    elif output_format == 'webp':
+        image.save(buffer, format='WEBP', lossless=True, method=4)
+    else:
+        raise ValueError(f"Unknown chart format: {output_format}")
+    return buffer.getvalue()
+
+def build_price_figure(series, size=CHART_SIZE):
+    """Build a price evolution chart figure from plain series data.
+
+    `series` is a dict with title, days and the dates/avg/min/max lists. Only
+    the object-oriented Agg API is used, so no pyplot global state is touched
+    and charts can be drawn concurrently in separate processes.
+    """
+    dates = series['dates']
+    avg_prices = series['avg']
+    min_prices = series['min']
+    max_prices = series['max']
+    days = series['days']
+
+    fig = Figure(figsize=size)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    # Plot data
+    ax.plot(dates, avg_prices, 'b-', linewidth=2, label='Precio promedio', marker='o')
+    ax.fill_between(dates, min_prices, max_prices, alpha=0.3, color='blue', label='Rango de precios')
+
+    # Customize chart
+    ax.set_title(f"Evolución de precios - {series['title']}\n({days} días)", fontsize=16, fontweight='bold')
+    ax.set_xlabel('Fecha', fontsize=12)
+    ax.set_ylabel('Precio (€)', fontsize=12)
+    ax.legend()
+    ax.grid(True, alpha=0.3)
+
+    # Format and rotate dates on x-axis
+    if days <= 7:
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%m'))
+    else:
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%m/%y'))
+    ax.tick_params(axis='x', labelrotation=45)
+
+    # Add statistics text
+    stats_text = f'Actual: {avg_prices[-1]:.3f}€\nMín: {min(min_prices):.3f}€\nMáx: {max(max_prices):.3f}€'
+    ax.text(0.02, 0.98, stats_text, transform=ax.transAxes,
+            verticalalignment='top', bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.8))
+
+    fig.tight_layout()
+    return fig
+
+def build_comparison_figure(series, size=CHART_SIZE):
+    """Build a chart overlaying several daily average price series.
+
+    `series` is a dict with title, days, dates, labels and values: one list
+    per label, aligned with dates, with NaN where a series has no data.
+    """
+    dates = series['dates']
+    days = series['days']
+
+    fig = Figure(figsize=size)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    for label, values in zip(series['labels'], series['values']):
+        ax.plot(dates, values, linewidth=2, marker='o', markersize=3, label=label)
+
+    ax.set_title(f"{series['title']}\n({days} días)", fontsize=16, fontweight='bold')
+    ax.set_xlabel('Fecha', fontsize=12)
+    ax.set_ylabel('Precio medio (€)', fontsize=12)
+    ax.legend(fontsize=9)
+    ax.grid(True, alpha=0.3)
+
+    if days <= 7:
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%m'))
+    else:
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%m/%y'))
+    ax.tick_params(axis='x', labelrotation=45)
+
+    fig.tight_layout()
+    return fig
+
+def build_price_map_figure(series, size=CHART_SIZE):
+    """Build a map of the island with stations coloured by price.
+
+    `series` is a dict with title, date, the lats/lons/prices lists and the
+    coastline as a list of [lon, lat] points; no tile server is involved.
+    """
+    lats = series['lats']
+    lons = series['lons']
+    prices = series['prices']
+
+    fig = Figure(figsize=size)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    # Sea, island and stations
+    ax.set_facecolor('#d6e9f5')
+    coast_lons = [point[0] for point in series['coastline']]
+    coast_lats = [point[1] for point in series['coastline']]
+    ax.fill(coast_lons, coast_lats, facecolor='#f4f1e8', edgecolor='#8a8a8a', linewidth=1, zorder=1)
+    points = ax.scatter(lons, lats, c=prices, cmap='RdYlGn_r', s=45,
+                        edgecolors='black', linewidths=0.4, zorder=2)
+    fig.colorbar(points, ax=ax, label='Precio (€)', shrink=0.85)
+
+    # Highlight the cheapest station
+    cheapest = min(range(len(prices)), key=prices.__getitem__)
+    ax.scatter([lons[cheapest]], [lats[cheapest]], marker='*', s=320, color='gold',
+               edgecolors='black', linewidths=0.8, zorder=3, label=f'Más barata: {prices[cheapest]:.3f}€')
+    ax.legend(loc='lower left', fontsize=9)
+
+    ax.set_title(f"Mapa de precios - {series['title']}\n({series['date']})", fontsize=16, fontweight='bold')
+    stats_text = f'Estaciones: {len(prices)}\nMín: {min(prices):.3f}€\nMedia: {sum(prices) / len(prices):.3f}€\nMáx: {max(prices):.3f}€'
+    ax.text(0.02, 0.98, stats_text, transform=ax.transAxes, horizontalalignment='left',
+            verticalalignment='top', bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.8))
+
+    # Degrees of longitude are shorter than degrees of latitude at this latitude
+    ax.set_aspect(1 / math.cos(math.radians(sum(coast_lats) / len(coast_lats))))
+    ax.set_xticks([])
+    ax.set_yticks([])
+
+    fig.tight_layout()
+    return fig
+
+def render_price_chart_image(series, output_format='png'):
+    """Draw a price evolution chart at Telegram size and return image bytes."""
+    return encode_figure(build_price_figure(series), output_format)
+
+def render_comparison_chart_image(series, output_format='png'):
+    """Draw a comparison chart at Telegram size and return image bytes."""
+    return encode_figure(build_comparison_figure(series), output_format)
+
+def render_price_map_image(series, output_format='png'):
+    """Draw a price map at Telegram size and return image bytes."""
+    return encode_figure(build_price_map_figure(series), output_format)
+
+# Chart kind -> function run in the worker process
+CHART_KINDS = {
+    'price': render_price_chart_image,
+    'comparison': render_comparison_chart_image,
+    'map': render_price_map_image,
+}
+
+class ChartRenderer:
+    """Render charts in a small process pool with a bounded queue.
+
+    Callers hand over plain series data and get image bytes back in
+    `output_format` (see CHART_FORMATS). At most `max_pending` charts may be
+    queued or rendering at once; interactive requests beyond that fail fast
+    with ChartRendererBusy instead of piling up, while background callers
+    can choose to wait for a slot.
+    """
+
+    def __init__(self, max_workers=2, max_pending=8, timeout=60, output_format='png'):
+        if output_format not in CHART_FORMATS:
+            raise ValueError(f"Unknown chart format: {output_format}")
+        self.output_format = output_format
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self.stats = {'rendered': 0, 'rejected': 0, 'failed': 0}
+
+    @property
+    def extension(self):
+        """File extension of the images this renderer produces."""
+        return CHART_FORMATS[self.output_format]
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawn so workers don't inherit database connections and threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def render(self, series, block=False, kind='price'):
+        """Render a chart and return its image bytes, or None if rendering failed.
+
+        `kind` selects the drawing function from CHART_KINDS. Raises
+        ChartRendererBusy when the queue is full and `block` is False.
+        """
+        render_function = CHART_KINDS[kind]
+        if not self._slots.acquire(blocking=block):
+            with self._lock:
+                self.stats['rejected'] += 1
+            raise ChartRendererBusy(f"{self.max_pending} charts already pending")
+
+        try:
+            future = self._get_executor().submit(render_function, series, self.output_format)
+            image = future.result(timeout=self.timeout)
+            with self._lock:
+                self.stats['rendered'] += 1
+            return image
+        except FutureTimeoutError:
+            logger.error(f"Chart render timed out after {self.timeout}s")
+        except BrokenProcessPool as e:
+            logger.error(f"Chart render pool broke, restarting it: {e}")
+            self._reset_executor()
+        except Exception as e:
+            logger.error(f"Chart render failed: {e}")
+        finally:
+            self._slots.release()
+
+        with self._lock:
+            self.stats['failed'] += 1
+        return None
+
+    def get_statistics(self):
+        """Return render counters."""
+        with self._lock:
+            return dict(self.stats)
+
+    def shutdown(self, wait=True):
+        """Stop the worker processes."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
@@ -66,6 +66,8 @@ B_MUN_6 = 'Puerto de la Cruz'
 TOWN_PREFIX = 'town_'
 FUEL_PREFIX = 'fuel_'
 CHART_PREFIX = 'chart_'
+COMPARE_PREFIX = 'cmp_'
+MAP_PREFIX = 'map_'
 CHART_FUEL_PREFIX = 'chartfuel_'
 LOCATION_PREFIX = 'location_'
 ALERT_PREFIX = 'alert_'
@@ -75,6 +77,10 @@ RESULT_PREFIX = 'result_'
 # Messages
 M_INSTRUCT = "▪️*Selecciona una opción:*"
 M_CHART_SELECT = "📊 *Selecciona el combustible para ver la evolución de precios:*"
+M_CHART_NO_HISTORY = "📭 Todavía no hay suficiente histórico para mostrar gráficos."
+M_CHART_NO_COMPARISON = "❌ No hay suficientes datos históricos para comparar."
+M_MAP_NOT_READY = "🗺️ El mapa de precios se está preparando. Inténtalo de nuevo en un minuto."
+M_CHART_BUSY = "⏳ Se están generando muchos gráficos ahora mismo. Inténtalo de nuevo en unos segundos."
 M_LOCATION_REQUEST = "📍 *Comparte tu ubicación para encontrar estaciones cerca*"
 M_ALERT_SELECT = "🔔 *Gestiona tus alertas de precio:*"
 M_MUNICIPALITY_SELECT = "🏘 *Selecciona un municipio* (orden alfabético):"
@@ -447,11 +453,16 @@ NIVELL0, NIVELL1, NIVELL2, NIVELL3, SEARCH_STATE, ALERT_FUEL_SELECT, ALERT_PRICE
 B_ALERT_CREATE = '🔔 Crear alerta de precio'
 B_ALERT_LIST = '📋 Ver mis alertas'
 B_ALERT_DELETE = '🗑️ Eliminar alerta'
+B_ALERT_LOCATION = '🔔 Crear alerta en esta zona'
+B_ALERT_REPEAT_ON = '🔁 Repetir #{number}'
+B_ALERT_REPEAT_OFF = '1️⃣ Solo una vez #{number}'
 
 # Alert messages
 M_ALERT_CREATE_START = "🔔 *Crear alerta de precio*\n\nSelecciona el combustible para crear la alerta:"
 M_ALERT_PRICE_INPUT = "💰 *Precio de alerta*\n\nEscribe el precio máximo (ej: 1.50) para recibir notificaciones cuando esté por debajo:"
-M_ALERT_CREATED = "✅ *Alerta creada correctamente*\n\nTe notificaremos cuando el precio baje de {price}€ en {municipality}.\n\n💡 *Nota:* La alerta se eliminará automáticamente después de enviarte la notificación."
+M_ALERT_CREATED = "✅ *Alerta creada correctamente*\n\nTe notificaremos cuando el precio baje de {price}€ en {municipality}.\n\n💡 *Nota:* La alerta se eliminará automáticamente después de enviarte la notificación. Desde 📋 *Ver mis alertas* puedes hacer que se repita."
+M_ALERT_LOCATION_RADIUS = "📍 *Alerta por ubicación*\n\nElige el radio alrededor de la ubicación compartida en el que vigilar los precios:"
+M_ALERT_LOCATION_CREATED = "✅ *Alerta creada correctamente*\n\nTe notificaremos cuando el precio baje de {price}€ en cualquier estación a menos de {radius} km de la ubicación compartida.\n\n💡 *Nota:* La alerta se eliminará automáticamente después de enviarte la notificación. Desde 📋 *Ver mis alertas* puedes hacer que se repita."
 M_ALERT_LIST_EMPTY = "📋 *No tienes alertas activas*\n\nPuedes crear una nueva alerta desde cualquier municipio."
 
 # Alert callback data  
@@ -460,6 +471,12 @@ ALERT_REMOVE = f'{ALERT_PREFIX}REMOVE'
 ALERT_LIST = f'{ALERT_PREFIX}LIST'
 ALERT_DELETE = f'{ALERT_PREFIX}DELETE'
 ALERT_FUEL_SELECT = f'{ALERT_PREFIX}FUEL'
+ALERT_LOCATION = f'{ALERT_PREFIX}LOC'
+ALERT_RADIUS = f'{ALERT_PREFIX}RADIUS'
+ALERT_REPEAT = f'{ALERT_PREFIX}REPEAT'
+
+# Radius choices (km) for location alerts
+ALERT_RADII_KM = [2, 5, 10]
 
 # Location callback data
 LOCATION_5KM = f'{LOCATION_PREFIX}5KM'
@@ -1,210 +1,111 @@
+import numpy as np
 import pandas as pd
-import mysql.connector as msql
-from mysql.connector import Error
 import secret
 import datetime
+import time
+import threading
 from geopy.distance import geodesic
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-import io
 import os
 import json
 import glob
 from constants_tenerife import FUEL_TYPES, MUNICIPALITIES
-from sqlalchemy import create_engine
+from storage_tenerife import create_backend, DatabaseError, FUEL_PRICE_COLUMNS
+from history_tenerife import PriceHistory, add_months, month_start, ISLAND_WIDE
+from chart_cache_tenerife import ChartCache
+from chart_renderer_tenerife import ChartRenderer
+from outbox_tenerife import AlertOutbox
+from broadcast_tenerife import BroadcastJobs
+from alerts_tenerife import (AlertIndex, LocationAlertIndex, STATION_PRICES_QUERY, STATION_LOCATIONS_QUERY,
+                             ACTIVE_ALERTS_QUERY, LOCATION_ALERTS_QUERY, FUEL_TYPE_BY_COLUMN, ALERT_ROW_COLUMNS,
+                             ALERT_PERSISTENT, ALERT_DISARMED, cheapest_by_pair, cheapest_by_location_alert,
+                             make_notification, station_prices_query, station_locations_query, alert_ready,
+                             alert_disarmed)
 import pytz
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Series drawn in one comparison chart
+COMPARISON_SERIES = 5
+
+# Offline island outline for the price map
+COASTLINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'tenerife_coastline.geojson')
+
+# history_meta counter holding the last price-change event this process consumed
+PRICE_EVENT_CURSOR = 'alert_event_cursor'
+
+# history_meta counters of alert notifications delivered and of the digest messages that carried them
+ALERT_DIGEST_NOTIFICATIONS = 'alert_digest_notifications'
+ALERT_DIGEST_MESSAGES = 'alert_digest_messages'
+
+# Alert ids read back per query when refreshing triggered alerts
+ALERT_RELOAD_CHUNK = 500
+
+# Price maps show one snapshot, so their cache entries have no day range
+MAP_DAYS = 0
+
 class TenerifeDataManager:
-    def __init__(self):
-        self.db_config = {
-            'host': secret.secret['db_host'],
-            'user': secret.secret['db_user'],
-            'password': secret.secret['db_password'],
-            'database': 'tenerife'  # New database for Tenerife
-        }
-        self.connection = None
-        self.sqlalchemy_engine = None
+    def __init__(self, backend=None):
+        # Storage engine (MySQL or embedded SQLite) selected in secret.py
+        self.backend = backend if backend is not None else create_backend(secret.secret)
+        self.history = PriceHistory(self.backend)
+        self.last_maintenance = None
+        self.chart_renderer = ChartRenderer(
+            max_workers=secret.secret.get('chart_render_workers', 2),
+            max_pending=secret.secret.get('chart_render_queue', 8),
+            output_format=secret.secret.get('chart_format', 'png')
+        )
+        self.chart_cache = ChartCache(extension=self.chart_renderer.extension)
+        self._prewarm_lock = threading.Lock()
+        self.alert_index = AlertIndex()
+        self.location_alert_index = LocationAlertIndex()
+        self._alert_index_lock = threading.Lock()
+        # Persistent alerts: minimum time between notifications and the rise that re-arms them
+        self.alert_cooldown = datetime.timedelta(hours=secret.secret.get('alert_cooldown_hours', 12))
+        self.alert_rearm_margin = secret.secret.get('alert_rearm_margin', 0.02)
+        self.outbox = AlertOutbox(self.backend)
+        self.broadcasts = BroadcastJobs(self.backend)
+        self._price_change_listeners = []
+        # Alert evaluation runs on every batch of price-change events
+        self.subscribe_price_changes(self._queue_alerts_for_events)
+        self._coastline = None
         self.data = None
         self.last_update_time = None
 
     def connect(self):
+        """Open the storage backend's connection pool."""
         try:
-            self.connection = msql.connect(**self.db_config)
-            print("Connected to Tenerife MySQL database")
-            
-            # Also create SQLAlchemy engine for pandas (eliminates warning)
-            connection_string = f"mysql+mysqlconnector://{self.db_config['user']}:{self.db_config['password']}@{self.db_config['host']}/{self.db_config['database']}"
-            self.sqlalchemy_engine = create_engine(connection_string)
-            
-        except Error as e:
-            print(f"Error connecting to MySQL: {e}")
+            with self._connection():
+                pass
+        except Exception as e:
+            print(f"Error connecting to {self.backend.name} database: {e}")
             raise
 
+    def _connection(self):
+        """Check out a pooled connection for a single operation."""
+        return self.backend.connection()
+
+    def get_pool_statistics(self):
+        """Get connection pool occupancy and wait-time metrics."""
+        return self.backend.get_statistics()
+
     def create_database_and_tables(self):
         """Create the Tenerife database and all necessary tables."""
         try:
-            # First connect without specifying database
-            temp_config = self.db_config.copy()
-            temp_config.pop('database')
-            temp_conn = msql.connect(**temp_config)
-            cursor = temp_conn.cursor()
-            
-            # Create database if it doesn't exist
-            cursor.execute("CREATE DATABASE IF NOT EXISTS tenerife")
-            print("Tenerife database created/verified")
-            
-            cursor.close()
-            temp_conn.close()
-            
-            # Now connect to the tenerife database
-            self.connect()
-            cursor = self.connection.cursor()
-            
-            # Create main fuel stations table with all Tenerife fuel types
-            stations_table = """
-            CREATE TABLE IF NOT EXISTS estaciones_servicio (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                IDEESS VARCHAR(20) UNIQUE,
-                cp VARCHAR(10),
-                direccion TEXT,
-                horario TEXT,
-                latitud DECIMAL(10, 8),
-                localidad VARCHAR(100),
-                longitud_wgs84 DECIMAL(11, 8),
-                margen VARCHAR(5),
-                municipio VARCHAR(100),
-                provincia VARCHAR(100),
-                remision VARCHAR(10),
-                rotulo VARCHAR(100),
-                tipo_venta VARCHAR(5),
-                bio_etanol VARCHAR(10),
-                ester_metilico VARCHAR(10),
-                id_municipio VARCHAR(10),
-                id_provincia VARCHAR(10),
-                id_ccaa VARCHAR(10),
-                
-                -- All fuel types from Tenerife data
-                precio_adblue DECIMAL(5, 3),
-                precio_amoniaco DECIMAL(5, 3),
-                precio_biodiesel DECIMAL(5, 3),
-                precio_bioetanol DECIMAL(5, 3),
-                precio_biogas_natural_comprimido DECIMAL(5, 3),
-                precio_biogas_natural_licuado DECIMAL(5, 3),
-                precio_diesel_renovable DECIMAL(5, 3),
-                precio_gas_natural_comprimido DECIMAL(5, 3),
-                precio_gas_natural_licuado DECIMAL(5, 3),
-                precio_gases_licuados_del_petroleo DECIMAL(5, 3),
-                precio_gasoleo_a DECIMAL(5, 3),
-                precio_gasoleo_b DECIMAL(5, 3),
-                precio_gasoleo_premium DECIMAL(5, 3),
-                precio_gasolina_95_e10 DECIMAL(5, 3),
-                precio_gasolina_95_e25 DECIMAL(5, 3),
-                precio_gasolina_95_e5 DECIMAL(5, 3),
-                precio_gasolina_95_e5_premium DECIMAL(5, 3),
-                precio_gasolina_95_e85 DECIMAL(5, 3),
-                precio_gasolina_98_e10 DECIMAL(5, 3),
-                precio_gasolina_98_e5 DECIMAL(5, 3),
-                precio_gasolina_renovable DECIMAL(5, 3),
-                precio_hidrogeno DECIMAL(5, 3),
-                precio_metanol DECIMAL(5, 3),
-                
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                
-                INDEX idx_municipio (municipio),
-                INDEX idx_localidad (localidad),
-                INDEX idx_rotulo (rotulo),
-                INDEX idx_gasolina_95_e5 (precio_gasolina_95_e5),
-                INDEX idx_gasoleo_a (precio_gasoleo_a),
-                INDEX idx_ideess (IDEESS),
-                INDEX idx_location (latitud, longitud_wgs84)
-            )
-            """
-            
-            # Create historical prices table for Tenerife
-            historical_table = """
-            CREATE TABLE IF NOT EXISTS historical_prices (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                date DATE NOT NULL,
-                ideess VARCHAR(20),
-                rotulo VARCHAR(100),
-                localidad VARCHAR(100),
-                municipio VARCHAR(100),
-                direccion TEXT,
-                latitud DECIMAL(10, 8),
-                longitud_wgs84 DECIMAL(11, 8),
-                
-                -- Key fuel prices for historical tracking
-                precio_gasolina_95_e5 DECIMAL(5, 3),
-                precio_gasoleo_a DECIMAL(5, 3),
-                precio_gasolina_98_e5 DECIMAL(5, 3),
-                precio_gasoleo_premium DECIMAL(5, 3),
-                precio_gases_licuados_del_petroleo DECIMAL(5, 3),
-                precio_gasoleo_b DECIMAL(5, 3),
-                precio_adblue DECIMAL(5, 3),
-                
-                INDEX idx_date (date),
-                INDEX idx_municipio (municipio),
-                INDEX idx_ideess (ideess),
-                INDEX idx_date_municipio (date, municipio)
-            )
-            """
-            
-            # Create user subscriptions table
-            subscriptions_table = """
-            CREATE TABLE IF NOT EXISTS user_subscriptions (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id BIGINT NOT NULL,
-                username VARCHAR(255),
-                fuel_type VARCHAR(50) NOT NULL,
-                price_threshold DECIMAL(5, 3) NOT NULL,
-                municipio VARCHAR(100),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_active BOOLEAN DEFAULT TRUE,
-                INDEX idx_user_id (user_id),
-                INDEX idx_fuel_type (fuel_type),
-                INDEX idx_active (is_active),
-                INDEX idx_municipio (municipio)
-            )
-            """
-            
-            # Create users table for analytics
-            users_table = """
-            CREATE TABLE IF NOT EXISTS bot_users (
-                user_id BIGINT PRIMARY KEY,
-                username VARCHAR(255),
-                first_name VARCHAR(255),
-                last_name VARCHAR(255),
-                language_code VARCHAR(10),
-                first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                interaction_count INT DEFAULT 1,
-                is_active BOOLEAN DEFAULT TRUE,
-                INDEX idx_username (username),
-                INDEX idx_last_seen (last_seen),
-                INDEX idx_is_active (is_active)
-            )
-            """
-            
-            cursor.execute(stations_table)
-            cursor.execute(historical_table)
-            cursor.execute(subscriptions_table)
-            cursor.execute(users_table)
-            
-            self.connection.commit()
+            self.backend.create_schema()
+            with self._connection() as connection:
+                cursor = connection.cursor()
+                self.history.seed_fuels(cursor)
+                connection.commit()
+                cursor.close()
             print("All Tenerife database tables created successfully")
             
-        except Error as e:
+        except DatabaseError as e:
             print(f"Error creating Tenerife database/tables: {e}")
             raise
-        finally:
-            if cursor:
-                cursor.close()
 
     def _convert_decimal(self, value):
-        """Convert comma-decimal to dot-decimal for MySQL, handle empty strings."""
+        """Convert comma-decimal to dot-decimal for the database, handle empty strings."""
         if value is None or value == "" or pd.isna(value):
             return None
         try:
@@ -218,150 +119,107 @@ class TenerifeDataManager:
 
     def load_json_data(self):
         """Load all JSON files from municipis_original directory and process them."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
-        
         # Create tables if they don't exist
         self.create_database_and_tables()
         
-        # Clear existing data for fresh load
-        cursor = self.connection.cursor()
-        cursor.execute("DELETE FROM estaciones_servicio")
-        print("Cleared existing station data")
-        
-        # Get all JSON files from municipis_original directory
-        json_files = glob.glob("municipis_original/*.json")
-        
-        if not json_files:
-            print("No JSON files found in municipis_original directory")
-            return
-        
-        total_stations = 0
-        
-        for json_file in json_files:
-            try:
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+        with self._connection() as connection:
+            # Clear existing data for fresh load
+            cursor = connection.cursor()
+            cursor.execute("DELETE FROM estaciones_servicio")
+            print("Cleared existing station data")
+        
+            # Get all JSON files from municipis_original directory
+            json_files = glob.glob("municipis_original/*.json")
+        
+            if not json_files:
+                print("No JSON files found in municipis_original directory")
+                return
+        
+            total_stations = 0
+            
+            # Insert station data (re-loading a station updates it in place)
+            station_columns = [
+                'IDEESS', 'cp', 'direccion', 'horario', 'latitud', 'localidad', 'longitud_wgs84',
+                'margen', 'municipio', 'provincia', 'remision', 'rotulo', 'tipo_venta',
+                'bio_etanol', 'ester_metilico', 'id_municipio', 'id_provincia', 'id_ccaa'
+            ] + FUEL_PRICE_COLUMNS
+            insert_query = self.backend.upsert_query('estaciones_servicio', station_columns, ['IDEESS'])
+        
+            for json_file in json_files:
+                try:
+                    with open(json_file, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
                 
-                # Extract municipality name from filename
-                municipio_file = os.path.basename(json_file).replace('.json', '')
-                print(f"Processing {municipio_file}...")
+                    # Extract municipality name from filename
+                    municipio_file = os.path.basename(json_file).replace('.json', '')
+                    print(f"Processing {municipio_file}...")
                 
-                if 'ListaEESSPrecio' not in data:
-                    print(f"No fuel station data in {json_file}")
-                    continue
+                    if 'ListaEESSPrecio' not in data:
+                        print(f"No fuel station data in {json_file}")
+                        continue
                 
-                stations = data['ListaEESSPrecio']
+                    stations = data['ListaEESSPrecio']
                 
-                for station in stations:
-                    try:
-                        # Insert station data
-                        insert_query = """
-                        INSERT INTO estaciones_servicio (
-                            IDEESS, cp, direccion, horario, latitud, localidad, longitud_wgs84,
-                            margen, municipio, provincia, remision, rotulo, tipo_venta,
-                            bio_etanol, ester_metilico, id_municipio, id_provincia, id_ccaa,
-                            precio_adblue, precio_amoniaco, precio_biodiesel, precio_bioetanol,
-                            precio_biogas_natural_comprimido, precio_biogas_natural_licuado,
-                            precio_diesel_renovable, precio_gas_natural_comprimido,
-                            precio_gas_natural_licuado, precio_gases_licuados_del_petroleo,
-                            precio_gasoleo_a, precio_gasoleo_b, precio_gasoleo_premium,
-                            precio_gasolina_95_e10, precio_gasolina_95_e25, precio_gasolina_95_e5,
-                            precio_gasolina_95_e5_premium, precio_gasolina_95_e85,
-                            precio_gasolina_98_e10, precio_gasolina_98_e5, precio_gasolina_renovable,
-                            precio_hidrogeno, precio_metanol
-                        ) VALUES (
-                            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                            %s, %s, %s, %s, %s
-                        ) ON DUPLICATE KEY UPDATE
-                            cp = VALUES(cp), direccion = VALUES(direccion), horario = VALUES(horario),
-                            latitud = VALUES(latitud), localidad = VALUES(localidad),
-                            longitud_wgs84 = VALUES(longitud_wgs84), margen = VALUES(margen),
-                            municipio = VALUES(municipio), provincia = VALUES(provincia),
-                            remision = VALUES(remision), rotulo = VALUES(rotulo),
-                            tipo_venta = VALUES(tipo_venta), bio_etanol = VALUES(bio_etanol),
-                            ester_metilico = VALUES(ester_metilico), id_municipio = VALUES(id_municipio),
-                            id_provincia = VALUES(id_provincia), id_ccaa = VALUES(id_ccaa),
-                            precio_adblue = VALUES(precio_adblue), precio_amoniaco = VALUES(precio_amoniaco),
-                            precio_biodiesel = VALUES(precio_biodiesel), precio_bioetanol = VALUES(precio_bioetanol),
-                            precio_biogas_natural_comprimido = VALUES(precio_biogas_natural_comprimido),
-                            precio_biogas_natural_licuado = VALUES(precio_biogas_natural_licuado),
-                            precio_diesel_renovable = VALUES(precio_diesel_renovable),
-                            precio_gas_natural_comprimido = VALUES(precio_gas_natural_comprimido),
-                            precio_gas_natural_licuado = VALUES(precio_gas_natural_licuado),
-                            precio_gases_licuados_del_petroleo = VALUES(precio_gases_licuados_del_petroleo),
-                            precio_gasoleo_a = VALUES(precio_gasoleo_a), precio_gasoleo_b = VALUES(precio_gasoleo_b),
-                            precio_gasoleo_premium = VALUES(precio_gasoleo_premium),
-                            precio_gasolina_95_e10 = VALUES(precio_gasolina_95_e10),
-                            precio_gasolina_95_e25 = VALUES(precio_gasolina_95_e25),
-                            precio_gasolina_95_e5 = VALUES(precio_gasolina_95_e5),
-                            precio_gasolina_95_e5_premium = VALUES(precio_gasolina_95_e5_premium),
-                            precio_gasolina_95_e85 = VALUES(precio_gasolina_95_e85),
-                            precio_gasolina_98_e10 = VALUES(precio_gasolina_98_e10),
-                            precio_gasolina_98_e5 = VALUES(precio_gasolina_98_e5),
-                            precio_gasolina_renovable = VALUES(precio_gasolina_renovable),
-                            precio_hidrogeno = VALUES(precio_hidrogeno), precio_metanol = VALUES(precio_metanol)
-                        """
-                        
-                        cursor.execute(insert_query, (
-                            station.get('IDEESS'),
-                            station.get('C.P.'),
-                            station.get('Dirección'),
-                            station.get('Horario'),
-                            self._convert_decimal(station.get('Latitud')),
-                            station.get('Localidad'),
-                            self._convert_decimal(station.get('Longitud (WGS84)')),
-                            station.get('Margen'),
-                            station.get('Municipio'),
-                            station.get('Provincia'),
-                            station.get('Remisión'),
-                            station.get('Rótulo'),
-                            station.get('Tipo Venta'),
-                            station.get('% BioEtanol'),
-                            station.get('% Éster metílico'),
-                            station.get('IDMunicipio'),
-                            station.get('IDProvincia'),
-                            station.get('IDCCAA'),
+                    for station in stations:
+                        try:
+                            cursor.execute(insert_query, (
+                                station.get('IDEESS'),
+                                station.get('C.P.'),
+                                station.get('Dirección'),
+                                station.get('Horario'),
+                                self._convert_decimal(station.get('Latitud')),
+                                station.get('Localidad'),
+                                self._convert_decimal(station.get('Longitud (WGS84)')),
+                                station.get('Margen'),
+                                station.get('Municipio'),
+                                station.get('Provincia'),
+                                station.get('Remisión'),
+                                station.get('Rótulo'),
+                                station.get('Tipo Venta'),
+                                station.get('% BioEtanol'),
+                                station.get('% Éster metílico'),
+                                station.get('IDMunicipio'),
+                                station.get('IDProvincia'),
+                                station.get('IDCCAA'),
                             
-                            # All fuel prices
-                            self._convert_decimal(station.get('Precio Adblue')),
-                            self._convert_decimal(station.get('Precio Amoniaco')),
-                            self._convert_decimal(station.get('Precio Biodiesel')),
-                            self._convert_decimal(station.get('Precio Bioetanol')),
-                            self._convert_decimal(station.get('Precio Biogas Natural Comprimido')),
-                            self._convert_decimal(station.get('Precio Biogas Natural Licuado')),
-                            self._convert_decimal(station.get('Precio Diésel Renovable')),
-                            self._convert_decimal(station.get('Precio Gas Natural Comprimido')),
-                            self._convert_decimal(station.get('Precio Gas Natural Licuado')),
-                            self._convert_decimal(station.get('Precio Gases licuados del petróleo')),
-                            self._convert_decimal(station.get('Precio Gasoleo A')),
-                            self._convert_decimal(station.get('Precio Gasoleo B')),
-                            self._convert_decimal(station.get('Precio Gasoleo Premium')),
-                            self._convert_decimal(station.get('Precio Gasolina 95 E10')),
-                            self._convert_decimal(station.get('Precio Gasolina 95 E25')),
-                            self._convert_decimal(station.get('Precio Gasolina 95 E5')),
-                            self._convert_decimal(station.get('Precio Gasolina 95 E5 Premium')),
-                            self._convert_decimal(station.get('Precio Gasolina 95 E85')),
-                            self._convert_decimal(station.get('Precio Gasolina 98 E10')),
-                            self._convert_decimal(station.get('Precio Gasolina 98 E5')),
-                            self._convert_decimal(station.get('Precio Gasolina Renovable')),
-                            self._convert_decimal(station.get('Precio Hidrogeno')),
-                            self._convert_decimal(station.get('Precio Metanol'))
-                        ))
+                                # All fuel prices
+                                self._convert_decimal(station.get('Precio Adblue')),
+                                self._convert_decimal(station.get('Precio Amoniaco')),
+                                self._convert_decimal(station.get('Precio Biodiesel')),
+                                self._convert_decimal(station.get('Precio Bioetanol')),
+                                self._convert_decimal(station.get('Precio Biogas Natural Comprimido')),
+                                self._convert_decimal(station.get('Precio Biogas Natural Licuado')),
+                                self._convert_decimal(station.get('Precio Diésel Renovable')),
+                                self._convert_decimal(station.get('Precio Gas Natural Comprimido')),
+                                self._convert_decimal(station.get('Precio Gas Natural Licuado')),
+                                self._convert_decimal(station.get('Precio Gases licuados del petróleo')),
+                                self._convert_decimal(station.get('Precio Gasoleo A')),
+                                self._convert_decimal(station.get('Precio Gasoleo B')),
+                                self._convert_decimal(station.get('Precio Gasoleo Premium')),
+                                self._convert_decimal(station.get('Precio Gasolina 95 E10')),
+                                self._convert_decimal(station.get('Precio Gasolina 95 E25')),
+                                self._convert_decimal(station.get('Precio Gasolina 95 E5')),
+                                self._convert_decimal(station.get('Precio Gasolina 95 E5 Premium')),
+                                self._convert_decimal(station.get('Precio Gasolina 95 E85')),
+                                self._convert_decimal(station.get('Precio Gasolina 98 E10')),
+                                self._convert_decimal(station.get('Precio Gasolina 98 E5')),
+                                self._convert_decimal(station.get('Precio Gasolina Renovable')),
+                                self._convert_decimal(station.get('Precio Hidrogeno')),
+                                self._convert_decimal(station.get('Precio Metanol'))
+                            ))
                         
-                        total_stations += 1
+                            total_stations += 1
                         
-                    except Error as e:
-                        print(f"Error inserting station {station.get('IDEESS', 'unknown')}: {e}")
-                        continue
+                        except DatabaseError as e:
+                            print(f"Error inserting station {station.get('IDEESS', 'unknown')}: {e}")
+                            continue
                 
-            except Exception as e:
-                print(f"Error processing file {json_file}: {e}")
-                continue
+                except Exception as e:
+                    print(f"Error processing file {json_file}: {e}")
+                    continue
         
-        self.connection.commit()
-        cursor.close()
+            connection.commit()
+            cursor.close()
         
         print(f"✅ Loaded {total_stations} stations from {len(json_files)} municipalities")
         
@@ -369,6 +227,9 @@ class TenerifeDataManager:
         self.last_update_time = datetime.datetime.now()
         self._save_update_timestamp()
         
+        # Record intraday price changes from this ingest
+        self.record_price_changes(self.last_update_time)
+        
         # Store daily snapshot for historical data
         self.store_daily_snapshot()
 
@@ -383,13 +244,10 @@ class TenerifeDataManager:
 
     def load_data_from_db(self):
         """Load current station data from database into pandas DataFrame."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
-        
         query = "SELECT * FROM estaciones_servicio"
         try:
-            # Use SQLAlchemy engine to eliminate pandas warning
-            self.data = pd.read_sql(query, self.sqlalchemy_engine)
+            # pandas reads through the same connection pool as the raw queries
+            self.data = self.backend.read_dataframe(query)
             print(f"Loaded {len(self.data)} stations from database")
             
             # Load timestamp
@@ -416,67 +274,145 @@ class TenerifeDataManager:
 
     def store_daily_snapshot(self):
         """Store a daily snapshot of current prices for historical tracking."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            today = datetime.date.today()
         
-        cursor = self.connection.cursor()
-        today = datetime.date.today()
+            # Check if we already have data for today
+            if self.history.has_snapshot(cursor, today):
+                print(f"Historical data for {today} already exists")
+                cursor.close()
+                # Still check for alerts even if historical data exists
+                self._check_and_send_alerts()
+                return
         
-        # Check if we already have data for today
-        check_query = "SELECT COUNT(*) FROM historical_prices WHERE date = %s"
-        cursor.execute(check_query, (today,))
-        count = cursor.fetchone()[0]
+            try:
+                # Version changed station details, store one narrow row per station and fuel
+                # and refresh the day's chart rollups, all in one transaction
+                self.history.sync_stations(cursor, today)
+                self.history.insert_snapshot(cursor, today)
+                self.history.rollup_range(cursor, today, today)
+                connection.commit()
+                print(f"Daily snapshot stored for {today}")
+            
+                # New statistics change every chart: render the menu's charts in the background
+                self._start_chart_prewarm()
+            
+                # After storing new data, check for price alerts
+                self._check_and_send_alerts()
+            
+            except DatabaseError as e:
+                print(f"Error storing daily snapshot: {e}")
+                connection.rollback()
+            finally:
+                cursor.close()
+
+    def record_price_changes(self, observed_at=None):
+        """Record prices that changed since the last ingest as validity intervals.
+
+        The new intervals are published as price-change events to every
+        subscriber (see subscribe_price_changes).
+        """
+        observed_at = observed_at or datetime.datetime.now()
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                last_id = self.history.last_change_id(cursor)
+                changes = self.history.record_changes(cursor, observed_at)
+                connection.commit()
+                print(f"Recorded {len(changes)} price changes")
+                events = self.history.change_events(cursor, last_id, limit=max(len(changes), 1)) if changes else []
+            except DatabaseError as e:
+                print(f"Error recording price changes: {e}")
+                connection.rollback()
+                return []
+            finally:
+                cursor.close()
         
-        if count > 0:
-            print(f"Historical data for {today} already exists")
-            cursor.close()
-            # Still check for alerts even if historical data exists
-            self._check_and_send_alerts()
+        self._publish_price_changes(events)
+        return changes
+
+    def subscribe_price_changes(self, listener):
+        """Call ``listener(events)`` with every batch of price-change events (see PriceHistory.change_events)."""
+        self._price_change_listeners.append(listener)
+
+    def _publish_price_changes(self, events):
+        if not events:
             return
-        
-        # Insert today's data for key fuel types
-        insert_query = """
-        INSERT INTO historical_prices 
-        (date, ideess, rotulo, localidad, municipio, direccion, latitud, longitud_wgs84,
-         precio_gasolina_95_e5, precio_gasoleo_a, precio_gasolina_98_e5, 
-         precio_gasoleo_premium, precio_gases_licuados_del_petroleo, 
-         precio_gasoleo_b, precio_adblue)
-        SELECT %s, IDEESS, rotulo, localidad, municipio, direccion, latitud, longitud_wgs84,
-               precio_gasolina_95_e5, precio_gasoleo_a, precio_gasolina_98_e5,
-               precio_gasoleo_premium, precio_gases_licuados_del_petroleo,
-               precio_gasoleo_b, precio_adblue
-        FROM estaciones_servicio
-        WHERE precio_gasolina_95_e5 IS NOT NULL OR precio_gasoleo_a IS NOT NULL
+        for listener in list(self._price_change_listeners):
+            try:
+                listener(events)
+            except Exception as e:
+                logger.error(f"Price change listener failed: {e}")
+
+    def consume_price_events(self, batch_size=5000):
+        """Publish price-change events recorded by other processes since the last call.
+
+        Used by processes that do not ingest themselves (the bot). The position
+        is kept in history_meta so a restart resumes where it stopped; the very
+        first call starts from the newest event. Returns the number of events.
         """
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                after_id = self.history.meta_counter(cursor, PRICE_EVENT_CURSOR)
+                if after_id is None:
+                    self.history.set_meta_counter(cursor, PRICE_EVENT_CURSOR, self.history.last_change_id(cursor))
+                    connection.commit()
+                    return 0
+                
+                events = self.history.change_events(cursor, after_id, batch_size)
+                if events:
+                    self.history.set_meta_counter(cursor, PRICE_EVENT_CURSOR, events[-1]['id'])
+                    connection.commit()
+            except DatabaseError as e:
+                print(f"Error reading price change events: {e}")
+                connection.rollback()
+                return 0
+            finally:
+                cursor.close()
         
-        try:
-            cursor.execute(insert_query, (today,))
-            self.connection.commit()
-            print(f"Daily snapshot stored for {today}")
-            
-            # After storing new data, check for price alerts
-            self._check_and_send_alerts()
-            
-        except Error as e:
-            print(f"Error storing daily snapshot: {e}")
-            self.connection.rollback()
-        finally:
-            cursor.close()
+        self._publish_price_changes(events)
+        return len(events)
+
+    def get_prices_at(self, fuel_type, moment):
+        """Get {IDEESS: price} for a fuel type as it was at a given time."""
+        if fuel_type not in FUEL_TYPES:
+            return {}
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                return self.history.prices_at(cursor, self.history.fuel_id_for(FUEL_TYPES[fuel_type]), moment)
+            except DatabaseError as e:
+                print(f"Error getting prices at {moment}: {e}")
+                return {}
+            finally:
+                cursor.close()
+
+    def get_price_changes(self, start=None, end=None):
+        """Get every price change in [start, end), by default all changes today."""
+        if start is None:
+            start = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+        if end is None:
+            end = start + datetime.timedelta(days=1)
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                return self.history.changes_between(cursor, start, end)
+            except DatabaseError as e:
+                print(f"Error getting price changes: {e}")
+                return []
+            finally:
+                cursor.close()
 
     def _check_and_send_alerts(self):
-        """Check for price alerts and trigger notifications (internal helper)."""
-        try:
-            notifications = self.check_price_alerts()
-            if notifications:
-                print(f"🔔 Found {len(notifications)} price alerts to send")
-                # You can implement actual sending here or use the notification_sender.py
-                # For now, just log that alerts were found
-                for notification in notifications:
-                    print(f"   Alert: {notification['fuel_type']} at {notification['current_price']}€ for user {notification['user_id']}")
-            else:
-                print("✅ No price alerts triggered")
-        except Exception as e:
-            print(f"Error checking alerts: {e}")
+        """Report the alert notifications waiting in the outbox (internal helper)."""
+        pending = self.get_outbox_statistics().get('pending', 0)
+        if pending:
+            # Price-change events already queued them; the bot or notification_sender.py delivers them
+            print(f"🔔 {pending} price alerts waiting to be sent")
+        else:
+            print("✅ No price alerts triggered")
 
     def get_stations_by_fuel_ascending(self, fuel_type, limit=None):
         """Get stations ordered by fuel price (ascending) with pagination support."""
@@ -578,6 +514,33 @@ class TenerifeDataManager:
         
         return available_fuels
 
+    def get_chart_fuel_types(self, days=30, min_days=2):
+        """Get fuel types with enough recent history for a chart, ordered by priority."""
+        start_date = datetime.date.today() - datetime.timedelta(days=days)
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                days_by_fuel = self.history.days_with_data(cursor, start_date)
+            except DatabaseError as e:
+                print(f"Error getting chart fuel types: {e}")
+                return []
+            finally:
+                cursor.close()
+        
+        chart_fuels = []
+        for fuel_key, fuel_info in sorted(FUEL_TYPES.items(), key=lambda x: x[1]['priority']):
+            history_days = days_by_fuel.get(self.history.fuel_id_for(fuel_info), 0)
+            if history_days >= min_days:
+                chart_fuels.append({
+                    'key': fuel_key,
+                    'display': fuel_info['display'],
+                    'button': fuel_info['button'],
+                    'history_days': history_days,
+                    'priority': fuel_info['priority']
+                })
+        
+        return chart_fuels
+
     def find_stations_near_location(self, user_lat, user_lon, radius_km=10):
         """Find gas stations within radius, sorted by price and then distance."""
         if self.data is None:
@@ -644,671 +607,1472 @@ class TenerifeDataManager:
 
     def track_user_interaction(self, user_id, username=None, first_name=None, last_name=None, language_code=None):
         """Track user interactions for analytics."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
+        with self._connection() as connection:
+            cursor = connection.cursor()
         
-        cursor = self.connection.cursor()
+            try:
+                # Insert or update user information
+                new_value = self.backend.new_value
+                query = self.backend.upsert_query(
+                    'bot_users',
+                    ['user_id', 'username', 'first_name', 'last_name', 'language_code', 'interaction_count', 'last_seen'],
+                    ['user_id'],
+                    {
+                        'username': new_value('username'),
+                        'first_name': new_value('first_name'),
+                        'last_name': new_value('last_name'),
+                        'language_code': new_value('language_code'),
+                        'interaction_count': 'interaction_count + 1',
+                        'last_seen': new_value('last_seen'),
+                        # A user writing to the bot again has unblocked it
+                        'is_active': 'TRUE'
+                    }
+                )
+            
+                cursor.execute(query, (user_id, username, first_name, last_name, language_code, 1, datetime.datetime.now()))
+                connection.commit()
+            
+            except DatabaseError as e:
+                print(f"Error tracking user interaction: {e}")
+            finally:
+                cursor.close()
+
+    def track_user_interactions_batch(self, interactions, chunk_size=500):
+        """Upsert many coalesced user interactions with multi-row statements.
+
+        Each item is a dict with user_id, username, first_name, last_name,
+        language_code, count and last_seen. Raises on database errors so the
+        caller can retry the batch.
+        """
+        if not interactions:
+            return 0
+
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            columns = ['user_id', 'username', 'first_name', 'last_name', 'language_code', 'interaction_count', 'last_seen']
+            new_value = self.backend.new_value
+            updates = {
+                'username': new_value('username'),
+                'first_name': new_value('first_name'),
+                'last_name': new_value('last_name'),
+                'language_code': new_value('language_code'),
+                'interaction_count': f"interaction_count + {new_value('interaction_count')}",
+                'last_seen': self.backend.greatest('last_seen', new_value('last_seen')),
+                'is_active': 'TRUE'
+            }
+            try:
+                for start in range(0, len(interactions), chunk_size):
+                    chunk = interactions[start:start + chunk_size]
+                    query = self.backend.upsert_query('bot_users', columns, ['user_id'], updates, rows=len(chunk))
+                    params = []
+                    for item in chunk:
+                        params.extend((
+                            item['user_id'], item['username'], item['first_name'],
+                            item['last_name'], item['language_code'], item['count'], item['last_seen']
+                        ))
+                    cursor.execute(query, params)
+                connection.commit()
+                return len(interactions)
+            except DatabaseError:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def get_chart_version(self):
+        """Current chart version: today's date plus the history statistics version."""
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                return f"{datetime.date.today():%Y%m%d}-{self.history.version(cursor)}"
+            finally:
+                cursor.close()
+
+    def _cached_chart(self, chart_key, days, version, render):
+        # Serve a chart from the chart cache, rendering and storing it on a miss
+        if version is None:
+            try:
+                version = self.get_chart_version()
+            except DatabaseError as e:
+                print(f"Error getting chart version: {e}")
+                return None
         
+        image = self.chart_cache.get(chart_key, days, version)
+        if image is None:
+            image = render()
+            if image is not None:
+                self.chart_cache.put(chart_key, days, version, image)
+        return image
+
+    def get_price_chart(self, fuel_type, days=7, version=None):
+        """Get a price evolution chart as image bytes, from the chart cache when possible."""
+        return self._cached_chart(fuel_type, days, version, lambda: self.render_price_chart(fuel_type, days))
+
+    @staticmethod
+    def comparison_chart_key(dimension, fuel_type=None):
+        """Chart cache key of a comparison chart."""
+        return f"compare-{dimension}-{fuel_type or 'all'}"
+
+    def get_comparison_chart(self, dimension, fuel_type=None, days=30, version=None):
+        """Get a comparison chart as image bytes, from the chart cache when possible."""
+        return self._cached_chart(
+            self.comparison_chart_key(dimension, fuel_type), days, version,
+            lambda: self.render_comparison_chart(dimension, fuel_type, days)
+        )
+
+    @staticmethod
+    def map_chart_key(fuel_type):
+        """Chart cache key of a price map."""
+        return f"map-{fuel_type}"
+
+    def get_price_map(self, fuel_type, version=None):
+        """Get a price map from the chart cache, or None while it is not rendered yet.
+
+        Maps are only drawn by the pre-warm; a miss starts it in the background
+        instead of rendering on the caller's request.
+        """
+        if version is None:
+            try:
+                version = self.get_chart_version()
+            except DatabaseError as e:
+                print(f"Error getting chart version: {e}")
+                return None
+        
+        image = self.chart_cache.get(self.map_chart_key(fuel_type), MAP_DAYS, version)
+        if image is None:
+            self._start_chart_prewarm()
+        return image
+
+    def prewarm_charts(self, days_options=(7, 30)):
+        """Render the charts offered in the charts menu for the current history version."""
+        # One pre-warm at a time: a request for a missing map may start another
+        if not self._prewarm_lock.acquire(blocking=False):
+            return 0
+        return self._prewarm_charts_locked(days_options)
+
+    def _prewarm_charts_locked(self, days_options=(7, 30)):
+        # Body of prewarm_charts; runs with _prewarm_lock held and releases it
+        start = time.perf_counter()
         try:
-            # Insert or update user information
-            query = """
-            INSERT INTO bot_users (user_id, username, first_name, last_name, language_code, interaction_count)
-            VALUES (%s, %s, %s, %s, %s, 1)
-            ON DUPLICATE KEY UPDATE
-                username = VALUES(username),
-                first_name = VALUES(first_name),
-                last_name = VALUES(last_name),
-                language_code = VALUES(language_code),
-                interaction_count = interaction_count + 1,
-                last_seen = CURRENT_TIMESTAMP
-            """
-            
-            cursor.execute(query, (user_id, username, first_name, last_name, language_code))
-            self.connection.commit()
-            
-        except Error as e:
-            print(f"Error tracking user interaction: {e}")
+            version = self.get_chart_version()
+            self.chart_cache.prune(version)
+            
+            # Background work: renders wait for a free slot instead of failing
+            # (cache key, days, render function, render arguments)
+            charts = []
+            chart_fuels = self.get_chart_fuel_types()
+            for fuel in chart_fuels:
+                for days in days_options:
+                    charts.append((fuel['key'], days, self.render_price_chart, (fuel['key'], days)))
+            
+            # Comparison charts for the main fuel and across fuels
+            if chart_fuels:
+                main_fuel = chart_fuels[0]['key']
+                for dimension, fuel_type in (('municipio', main_fuel), ('rotulo', main_fuel), ('fuel', None)):
+                    for days in days_options:
+                        charts.append((
+                            self.comparison_chart_key(dimension, fuel_type), days,
+                            self.render_comparison_chart, (dimension, fuel_type, days)
+                        ))
+            
+            # Price maps of the latest snapshot
+            for fuel in chart_fuels:
+                charts.append((self.map_chart_key(fuel['key']), MAP_DAYS, self.render_price_map, (fuel['key'],)))
+            
+            rendered = 0
+            for chart_key, days, render, args in charts:
+                if self.chart_cache.get(chart_key, days, version) is None:
+                    image = render(*args, block=True)
+                    if image is not None:
+                        self.chart_cache.put(chart_key, days, version, image)
+                        rendered += 1
+            
+            print(f"🖼️ Pre-rendered {rendered} charts for version {version} in {time.perf_counter() - start:.1f}s")
+            return rendered
+        
+        except Exception as e:
+            print(f"Error pre-rendering charts: {e}")
+            logger.error(f"Chart pre-warm failed: {e}")
+            return 0
+        
         finally:
-            cursor.close()
+            self._prewarm_lock.release()
 
-    def generate_price_chart(self, fuel_type, days=7):
-        """Generate price evolution chart for a fuel type."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
-        
+    def _start_chart_prewarm(self):
+        # The lock is taken here and handed to the thread, so concurrent callers start one thread at most
+        if not self._prewarm_lock.acquire(blocking=False):
+            return
+        try:
+            # Not a daemon thread: a one-shot ingest run waits for the charts before exiting
+            threading.Thread(target=self._prewarm_charts_locked, name='tenerife-chart-prewarm').start()
+        except RuntimeError:
+            self._prewarm_lock.release()
+            raise
+
+    def render_price_chart(self, fuel_type, days=7, block=False):
+        """Render a price evolution chart for a fuel type as image bytes.
+
+        The series is read here and drawn in the chart renderer's process pool;
+        raises ChartRendererBusy when the render queue is full and `block` is False.
+        """
         if fuel_type not in FUEL_TYPES:
             return None
         
         fuel_config = FUEL_TYPES[fuel_type]
-        fuel_column = fuel_config['column'].lower()
-        fuel_display = fuel_config['display']
+        fuel_id = self.history.fuel_id_for(fuel_config)
         
         # Calculate date range
         end_date = datetime.date.today()
         start_date = end_date - datetime.timedelta(days=days)
         
-        # Query historical data
-        query = f"""
-        SELECT date, AVG({fuel_column}) as avg_price, MIN({fuel_column}) as min_price, MAX({fuel_column}) as max_price
-        FROM historical_prices 
-        WHERE date >= %s AND date <= %s 
-        AND {fuel_column} IS NOT NULL AND {fuel_column} > 0
-        GROUP BY date
-        ORDER BY date
+        try:
+            # Release the connection before rendering so the pool isn't held during plotting
+            with self._connection() as connection:
+                cursor = connection.cursor()
+                data = self.history.daily_series(cursor, fuel_id, start_date, end_date)
+                cursor.close()
+        except DatabaseError as e:
+            print(f"Error generating chart: {e}")
+            return None
+        
+        if not data or len(data) < 2:
+            return None  # Not enough data
+        
+        # Plain lists only: the series is pickled to a worker process
+        series = {
+            'title': fuel_config['display'],
+            'days': days,
+            'dates': [row[0] for row in data],
+            'avg': [float(row[1]) for row in data],
+            'min': [float(row[2]) for row in data],
+            'max': [float(row[3]) for row in data],
+        }
+        return self.chart_renderer.render(series, block=block)
+
+    def render_comparison_chart(self, dimension, fuel_type=None, days=30, block=False):
+        """Render a chart comparing municipalities, brands or fuels as image bytes.
+
+        Municipalities and brands are the ones with the most stations, for one
+        fuel type; a fuel comparison overlays the highest-priority fuels
+        island-wide. The whole chart comes from a single aggregated query.
         """
+        end_date = datetime.date.today()
+        start_date = end_date - datetime.timedelta(days=days)
+        
+        if dimension == 'fuel':
+            # Outside the connection below: it opens its own
+            fuels = self.get_chart_fuel_types(days)[:COMPARISON_SERIES]
+            members = [self.history.fuel_id_for(FUEL_TYPES[fuel['key']]) for fuel in fuels]
+            labels = [fuel['display'] for fuel in fuels]
+            title = 'Comparativa de combustibles'
+        elif fuel_type in FUEL_TYPES and dimension in ('municipio', 'rotulo'):
+            fuel_id = self.history.fuel_id_for(FUEL_TYPES[fuel_type])
+            by = 'municipio' if dimension == 'municipio' else 'marca'
+            title = f"{FUEL_TYPES[fuel_type]['display']} por {by}"
+        else:
+            return None
         
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, (start_date, end_date))
-            data = cursor.fetchall()
-            cursor.close()
-            
-            if not data or len(data) < 2:
-                return None  # Not enough data
-            
-            # Prepare data for plotting
-            dates = [row[0] for row in data]
-            avg_prices = [float(row[1]) for row in data]
-            min_prices = [float(row[2]) for row in data]
-            max_prices = [float(row[3]) for row in data]
-            
-            # Create matplotlib figure
-            plt.style.use('default')
-            fig, ax = plt.subplots(figsize=(12, 8))
-            
-            # Plot data
-            ax.plot(dates, avg_prices, 'b-', linewidth=2, label='Precio promedio', marker='o')
-            ax.fill_between(dates, min_prices, max_prices, alpha=0.3, color='blue', label='Rango de precios')
-            
-            # Customize chart
-            ax.set_title(f'Evolución de precios - {fuel_display}\n({days} días)', fontsize=16, fontweight='bold')
-            ax.set_xlabel('Fecha', fontsize=12)
-            ax.set_ylabel('Precio (€)', fontsize=12)
-            ax.legend()
-            ax.grid(True, alpha=0.3)
-            
-            # Format dates on x-axis
-            if days <= 7:
-                ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%m'))
-            else:
-                ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%m/%y'))
-            
-            # Rotate date labels
-            plt.xticks(rotation=45)
-            
-            # Add statistics text
-            current_avg = avg_prices[-1]
-            min_price_overall = min(min_prices)
-            max_price_overall = max(max_prices)
-            
-            stats_text = f'Actual: {current_avg:.3f}€\nMín: {min_price_overall:.3f}€\nMáx: {max_price_overall:.3f}€'
-            ax.text(0.02, 0.98, stats_text, transform=ax.transAxes, 
-                   verticalalignment='top', bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.8))
-            
-            # Tight layout and save
-            plt.tight_layout()
-            
-            # Create charts directory if it doesn't exist
-            os.makedirs('charts', exist_ok=True)
-            
-            # Generate unique filename
-            chart_filename = f'charts/chart_{fuel_type}_{days}d_{int(datetime.datetime.now().timestamp())}.png'
-            plt.savefig(chart_filename, dpi=300, bbox_inches='tight')
-            plt.close()
-            
-            return chart_filename
-            
-        except Error as e:
-            print(f"Error generating chart: {e}")
+            with self._connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    if dimension == 'fuel':
+                        dates, matrix = self.history.comparison_series(cursor, dimension, members, start_date, end_date)
+                    else:
+                        members = labels = self.history.top_members(cursor, dimension, COMPARISON_SERIES)
+                        dates, matrix = self.history.comparison_series(
+                            cursor, dimension, members, start_date, end_date, fuel_id=fuel_id
+                        )
+                finally:
+                    cursor.close()
+        except DatabaseError as e:
+            print(f"Error generating comparison chart: {e}")
             return None
+        
+        if len(dates) < 2:
+            return None  # Not enough data
+        
+        # Leave out series without any data in the range
+        has_data = ~np.isnan(matrix).all(axis=1)
+        
+        series = {
+            'title': title,
+            'days': days,
+            'dates': dates,
+            'labels': [label for label, keep in zip(labels, has_data) if keep],
+            'values': matrix[has_data].tolist(),
+        }
+        return self.chart_renderer.render(series, block=block, kind='comparison')
+
+    def _load_coastline(self):
+        # Bundled GeoJSON outline, read once
+        if self._coastline is None:
+            with open(COASTLINE_PATH, 'r', encoding='utf-8') as f:
+                self._coastline = json.load(f)['geometry']['coordinates'][0]
+        return self._coastline
+
+    def render_price_map(self, fuel_type, block=False):
+        """Render a map of the island with every station coloured by its latest price."""
+        if fuel_type not in FUEL_TYPES:
+            return None
+        
+        fuel_config = FUEL_TYPES[fuel_type]
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    date, stations = self.history.latest_station_prices(cursor, self.history.fuel_id_for(fuel_config))
+                finally:
+                    cursor.close()
+        except DatabaseError as e:
+            print(f"Error generating price map: {e}")
+            return None
+        
+        if not stations:
+            return None
+        
+        series = {
+            'title': fuel_config['display'],
+            'date': date.strftime('%d/%m/%Y'),
+            'lats': [station[0] for station in stations],
+            'lons': [station[1] for station in stations],
+            'prices': [station[2] for station in stations],
+            'coastline': self._load_coastline(),
+        }
+        return self.chart_renderer.render(series, block=block, kind='map')
 
     def create_historical_backfill(self, days_back=30):
         """Create historical data for testing charts (simulates past data)."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
+        with self._connection() as connection:
+            cursor = connection.cursor()
         
-        cursor = self.connection.cursor()
+            # Get current station data
+            cursor.execute("SELECT COUNT(*) FROM estaciones_servicio WHERE precio_gasolina_95_e5 IS NOT NULL")
+            station_count = cursor.fetchone()[0]
         
-        # Get current station data
-        cursor.execute("SELECT COUNT(*) FROM estaciones_servicio WHERE precio_gasolina_95_e5 IS NOT NULL")
-        station_count = cursor.fetchone()[0]
+            if station_count == 0:
+                print("No station data available for backfill")
+                cursor.close()
+                return
         
-        if station_count == 0:
-            print("No station data available for backfill")
-            cursor.close()
-            return
+            print(f"Creating {days_back} days of historical data...")
         
-        print(f"Creating {days_back} days of historical data...")
+            # Stations first seen now get a version covering the whole backfill range
+            first_date = datetime.date.today() - datetime.timedelta(days=days_back)
+            self.history.sync_stations(cursor, first_date)
+            connection.commit()
         
-        # Create data for each day going backwards
-        for i in range(days_back, 0, -1):
-            target_date = datetime.date.today() - datetime.timedelta(days=i)
+            # Create data for each day going backwards
+            for i in range(days_back, 0, -1):
+                target_date = datetime.date.today() - datetime.timedelta(days=i)
             
-            # Check if data already exists for this date
-            cursor.execute("SELECT COUNT(*) FROM historical_prices WHERE date = %s", (target_date,))
-            if cursor.fetchone()[0] > 0:
-                print(f"Data for {target_date} already exists, skipping...")
-                continue
+                # Check if data already exists for this date
+                if self.history.has_snapshot(cursor, target_date):
+                    print(f"Data for {target_date} already exists, skipping...")
+                    continue
             
-            # Create price variations (simulate market fluctuations)
-            import random
-            price_multiplier = 1.0 + random.uniform(-0.05, 0.05)  # ±5% variation
-            
-            # Insert historical data with slight price variations
-            insert_query = f"""
-            INSERT INTO historical_prices 
-            (date, ideess, rotulo, localidad, municipio, direccion, latitud, longitud_wgs84,
-             precio_gasolina_95_e5, precio_gasoleo_a, precio_gasolina_98_e5, 
-             precio_gasoleo_premium, precio_gases_licuados_del_petroleo, 
-             precio_gasoleo_b, precio_adblue)
-            SELECT 
-                %s, 
-                IDEESS, rotulo, localidad, municipio, direccion, latitud, longitud_wgs84,
-                CASE WHEN precio_gasolina_95_e5 IS NOT NULL THEN ROUND(precio_gasolina_95_e5 * %s, 3) END,
-                CASE WHEN precio_gasoleo_a IS NOT NULL THEN ROUND(precio_gasoleo_a * %s, 3) END,
-                CASE WHEN precio_gasolina_98_e5 IS NOT NULL THEN ROUND(precio_gasolina_98_e5 * %s, 3) END,
-                CASE WHEN precio_gasoleo_premium IS NOT NULL THEN ROUND(precio_gasoleo_premium * %s, 3) END,
-                CASE WHEN precio_gases_licuados_del_petroleo IS NOT NULL THEN ROUND(precio_gases_licuados_del_petroleo * %s, 3) END,
-                CASE WHEN precio_gasoleo_b IS NOT NULL THEN ROUND(precio_gasoleo_b * %s, 3) END,
-                CASE WHEN precio_adblue IS NOT NULL THEN ROUND(precio_adblue * %s, 3) END
-            FROM estaciones_servicio
-            WHERE precio_gasolina_95_e5 IS NOT NULL OR precio_gasoleo_a IS NOT NULL
-            """
+                # Create price variations (simulate market fluctuations)
+                import random
+                price_multiplier = 1.0 + random.uniform(-0.05, 0.05)  # ±5% variation
             
+                try:
+                    # Insert historical data with slight price variations
+                    self.history.insert_snapshot(cursor, target_date, multiplier=price_multiplier)
+                    self.history.rollup_range(cursor, target_date, target_date)
+                    connection.commit()
+                    print(f"✅ Created historical data for {target_date} (variation: {price_multiplier:.3f})")
+                
+                except DatabaseError as e:
+                    print(f"❌ Error creating data for {target_date}: {e}")
+                    connection.rollback()
+        
+            cursor.close()
+            print(f"🎯 Historical backfill completed! Charts should now work.")
+
+    def migrate_legacy_history(self, drop_legacy=False):
+        """Move the old wide historical_prices table into the normalized history tables."""
+        self.create_database_and_tables()
+        with self._connection() as connection:
+            stats = self.history.migrate_legacy(connection, drop_legacy=drop_legacy)
+        print(f"Migrated {stats['facts']} price rows over {stats['days']} days "
+              f"({stats['skipped_days']} days already present), {stats['versions']} station versions")
+        if stats['days']:
+            self.rebuild_daily_stats()
+        return stats
+
+    def rebuild_daily_stats(self, days=None, chunk_days=31):
+        """Rebuild the daily_price_stats rollups from price_history in bulk.
+
+        Covers the whole history, or only the last ``days`` days, one chunk of
+        ``chunk_days`` per transaction. Returns the number of rollup rows written.
+        """
+        with self._connection() as connection:
+            cursor = connection.cursor()
             try:
-                cursor.execute(insert_query, (
-                    target_date, 
-                    price_multiplier, price_multiplier, price_multiplier, price_multiplier,
-                    price_multiplier, price_multiplier, price_multiplier
-                ))
-                self.connection.commit()
-                print(f"✅ Created historical data for {target_date} (variation: {price_multiplier:.3f})")
+                first_date, last_date = self.history.history_date_range(cursor)
+                if first_date is None:
+                    print("No price history to aggregate")
+                    return 0
+            
+                if days is not None:
+                    first_date = max(first_date, last_date - datetime.timedelta(days=days - 1))
+            
+                print(f"Rebuilding daily price statistics from {first_date} to {last_date}...")
+                total_rows = 0
+                chunk_start = first_date
+                while chunk_start <= last_date:
+                    chunk_end = min(chunk_start + datetime.timedelta(days=chunk_days - 1), last_date)
+                    total_rows += self.history.rollup_range(cursor, chunk_start, chunk_end)
+                    connection.commit()
+                    chunk_start = chunk_end + datetime.timedelta(days=1)
+            
+                print(f"✅ Daily price statistics rebuilt: {total_rows} rows")
+                return total_rows
+            
+            except DatabaseError as e:
+                print(f"Error rebuilding daily price statistics: {e}")
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def run_history_maintenance(self, detail_months=None, interval_retention_days=None):
+        """Apply the history retention policy and keep monthly partitions ahead.
+
+        Daily facts older than ``detail_months`` are downsampled into monthly
+        aggregates and removed a month at a time (a partition drop on MySQL).
+        Closed price intervals older than ``interval_retention_days`` are
+        deleted. Returns timing and rows-affected metrics for every step; the
+        partition step reports partitions created instead of rows.
+        """
+        if detail_months is None:
+            detail_months = secret.secret.get('history_detail_months', 13)
+        if interval_retention_days is None:
+            interval_retention_days = secret.secret.get('price_interval_retention_days', 90)
+        
+        today = datetime.date.today()
+        cutoff_month = add_months(today, -detail_months)
+        metrics = {'started_at': datetime.datetime.now(), 'steps': []}
+        job_start = time.perf_counter()
+        
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            
+            def run_step(name, func, *args, unit='rows'):
+                step_start = time.perf_counter()
+                count = func(*args)
+                connection.commit()
+                metrics['steps'].append({'step': name, unit: count, 'seconds': time.perf_counter() - step_start})
+            
+            try:
+                oldest = self.history.oldest_fact_date(cursor)
+                month = month_start(oldest) if oldest else cutoff_month
+                
+                # Partitions from the oldest data month (so it can be dropped later) to two months ahead
+                run_step('add_partitions', self.backend.ensure_monthly_partitions,
+                         cursor, 'price_history', min(month, cutoff_month), add_months(today, 2), unit='partitions')
+                
+                while month < cutoff_month:
+                    run_step(f"retire_{month:%Y_%m}", self.history.retire_month, cursor, month)
+                    month = add_months(month, 1)
                 
-            except Error as e:
-                print(f"❌ Error creating data for {target_date}: {e}")
-                self.connection.rollback()
+                interval_cutoff = datetime.datetime.now() - datetime.timedelta(days=interval_retention_days)
+                run_step('prune_intervals', self.history.prune_intervals, cursor, interval_cutoff)
+                
+                outbox_cutoff = datetime.datetime.now() - datetime.timedelta(
+                    days=secret.secret.get('alert_outbox_retention_days', 30))
+                run_step('prune_alert_outbox', self.outbox.purge, cursor, outbox_cutoff)
+            
+            except DatabaseError as e:
+                print(f"Error during history maintenance: {e}")
+                logger.error(f"History maintenance failed: {e}")
+                connection.rollback()
+                metrics['error'] = str(e)
+            finally:
+                cursor.close()
         
-        cursor.close()
-        print(f"🎯 Historical backfill completed! Charts should now work.")
+        metrics['total_seconds'] = time.perf_counter() - job_start
+        metrics['total_rows'] = sum(step.get('rows', 0) for step in metrics['steps'])
+        self.last_maintenance = metrics
+        
+        print(f"🧹 History maintenance: {len(metrics['steps'])} steps, "
+              f"{metrics['total_rows']} rows in {metrics['total_seconds']:.2f}s")
+        for step in metrics['steps']:
+            unit = 'partitions' if 'partitions' in step else 'rows'
+            print(f"   {step['step']}: {step[unit]} {unit} in {step['seconds'] * 1000:.0f} ms")
+        return metrics
 
     def check_historical_data_status(self):
         """Check the status of historical data for debugging."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
-        
-        cursor = self.connection.cursor()
+        with self._connection() as connection:
+            cursor = connection.cursor()
         
-        # Check main table
-        cursor.execute("SELECT COUNT(*) FROM estaciones_servicio")
-        station_count = cursor.fetchone()[0]
-        
-        # Check historical table
-        cursor.execute("SELECT COUNT(*) FROM historical_prices")
-        historical_count = cursor.fetchone()[0]
+            # Check main table
+            cursor.execute("SELECT COUNT(*) FROM estaciones_servicio")
+            station_count = cursor.fetchone()[0]
         
-        # Check date range
-        cursor.execute("SELECT MIN(date), MAX(date) FROM historical_prices")
-        date_range = cursor.fetchone()
+            # Check historical table (estimated on engines that keep row statistics)
+            historical_count = self.backend.estimated_row_count(cursor, 'price_history')
         
-        # Check data by date
-        cursor.execute("SELECT date, COUNT(*) FROM historical_prices GROUP BY date ORDER BY date DESC LIMIT 10")
-        recent_data = cursor.fetchall()
+            # Date range and per-day counts come from the small daily rollup table
+            cursor.execute("SELECT MIN(date), MAX(date) FROM daily_price_stats WHERE municipio = %s", (ISLAND_WIDE,))
+            date_range = cursor.fetchone()
         
-        cursor.close()
+            # Check data by date
+            cursor.execute("""
+                SELECT date, SUM(station_count) FROM daily_price_stats
+                WHERE municipio = %s
+                GROUP BY date ORDER BY date DESC LIMIT 10
+            """, (ISLAND_WIDE,))
+            recent_data = cursor.fetchall()
         
-        print("📊 **Historical Data Status:**")
-        print(f"Main stations: {station_count}")
-        print(f"Historical records: {historical_count}")
-        print(f"Date range: {date_range[0]} to {date_range[1]}" if date_range[0] else "No historical data")
-        print("\n📅 **Recent historical data:**")
-        for date, count in recent_data:
-            print(f"  {date}: {count} records")
+            cursor.close()
         
-        if historical_count < 2:
-            print("\n⚠️ **Charts won't work** - need at least 2 days of data")
-            print("💡 Run: tenerife_data_manager.create_historical_backfill() to fix this")
-        else:
-            print(f"\n✅ **Charts should work** - {historical_count} historical records available")
+            print("📊 **Historical Data Status:**")
+            print(f"Main stations: {station_count}")
+            print(f"Historical records: {historical_count}")
+            print(f"Date range: {date_range[0]} to {date_range[1]}" if date_range[0] else "No historical data")
+            print("\n📅 **Recent historical data:**")
+            for date, count in recent_data:
+                print(f"  {date}: {count} records")
+        
+            if historical_count < 2:
+                print("\n⚠️ **Charts won't work** - need at least 2 days of data")
+                print("💡 Run: tenerife_data_manager.create_historical_backfill() to fix this")
+            else:
+                print(f"\n✅ **Charts should work** - {historical_count} historical records available")
         
-        return {
-            'station_count': station_count,
-            'historical_count': historical_count,
-            'date_range': date_range,
-            'recent_data': recent_data
-        }
+            return {
+                'station_count': station_count,
+                'historical_count': historical_count,
+                'date_range': date_range,
+                'recent_data': recent_data
+            }
 
     # Admin Analytics Functions
     def get_admin_statistics(self):
         """Get comprehensive bot statistics for admin dashboard."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
-        
-        cursor = self.connection.cursor()
-        stats = {}
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            stats = {}
         
-        try:
-            # User statistics
-            cursor.execute("SELECT COUNT(*) FROM bot_users")
-            stats['total_users'] = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM bot_users WHERE last_seen >= DATE_SUB(NOW(), INTERVAL 7 DAY)")
-            stats['active_users_7d'] = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM bot_users WHERE last_seen >= DATE_SUB(NOW(), INTERVAL 30 DAY)")
-            stats['active_users_30d'] = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM bot_users WHERE DATE(first_seen) = CURDATE()")
-            stats['new_users_today'] = cursor.fetchone()[0]
-            
-            # Interaction statistics
-            cursor.execute("SELECT SUM(interaction_count) FROM bot_users")
-            stats['total_interactions'] = cursor.fetchone()[0] or 0
-            
-            cursor.execute("""
-                SELECT COUNT(*) FROM bot_users 
-                WHERE last_seen >= CURDATE() AND last_seen < DATE_ADD(CURDATE(), INTERVAL 1 DAY)
-            """)
-            stats['interactions_today'] = cursor.fetchone()[0]
-            
-            if stats['total_users'] > 0:
-                stats['avg_interactions'] = stats['total_interactions'] / stats['total_users']
-            else:
-                stats['avg_interactions'] = 0
-            
-            # Database statistics
-            cursor.execute("SELECT COUNT(*) FROM estaciones_servicio")
-            stats['station_count'] = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM historical_prices")
-            stats['historical_count'] = cursor.fetchone()[0]
-            
-            # Last update time
-            stats['last_update'] = self.get_last_update_time()
-            
-            # Top municipalities by station count
-            cursor.execute("""
-                SELECT municipio, COUNT(*) as count 
-                FROM estaciones_servicio 
-                GROUP BY municipio 
-                ORDER BY count DESC 
-                LIMIT 10
-            """)
-            stats['top_municipalities'] = cursor.fetchall()
-            
-        except Error as e:
-            print(f"Error getting admin statistics: {e}")
-            stats = {'error': str(e)}
-        finally:
-            cursor.close()
+            try:
+                # User statistics
+                cursor.execute("SELECT COUNT(*) FROM bot_users")
+                stats['total_users'] = cursor.fetchone()[0]
+            
+                # Date boundaries are computed here so the SQL stays portable across backends
+                now = datetime.datetime.now()
+                today_start = datetime.datetime.combine(now.date(), datetime.time.min)
+                tomorrow_start = today_start + datetime.timedelta(days=1)
+            
+                cursor.execute("SELECT COUNT(*) FROM bot_users WHERE last_seen >= %s", (now - datetime.timedelta(days=7),))
+                stats['active_users_7d'] = cursor.fetchone()[0]
+            
+                cursor.execute("SELECT COUNT(*) FROM bot_users WHERE last_seen >= %s", (now - datetime.timedelta(days=30),))
+                stats['active_users_30d'] = cursor.fetchone()[0]
+            
+                cursor.execute(
+                    "SELECT COUNT(*) FROM bot_users WHERE first_seen >= %s AND first_seen < %s",
+                    (today_start, tomorrow_start)
+                )
+                stats['new_users_today'] = cursor.fetchone()[0]
+            
+                # Interaction statistics
+                cursor.execute("SELECT SUM(interaction_count) FROM bot_users")
+                stats['total_interactions'] = cursor.fetchone()[0] or 0
+            
+                cursor.execute("""
+                    SELECT COUNT(*) FROM bot_users 
+                    WHERE last_seen >= %s AND last_seen < %s
+                """, (today_start, tomorrow_start))
+                stats['interactions_today'] = cursor.fetchone()[0]
+            
+                if stats['total_users'] > 0:
+                    stats['avg_interactions'] = stats['total_interactions'] / stats['total_users']
+                else:
+                    stats['avg_interactions'] = 0
+            
+                # Database statistics
+                cursor.execute("SELECT COUNT(*) FROM estaciones_servicio")
+                stats['station_count'] = cursor.fetchone()[0]
+            
+                stats['historical_count'] = self.backend.estimated_row_count(cursor, 'price_history')
+            
+                # Last update time
+                stats['last_update'] = self.get_last_update_time()
+            
+                # Top municipalities by station count
+                cursor.execute("""
+                    SELECT municipio, COUNT(*) as count 
+                    FROM estaciones_servicio 
+                    GROUP BY municipio 
+                    ORDER BY count DESC 
+                    LIMIT 10
+                """)
+                stats['top_municipalities'] = cursor.fetchall()
+            
+            except DatabaseError as e:
+                print(f"Error getting admin statistics: {e}")
+                stats = {'error': str(e)}
+            finally:
+                cursor.close()
         
-        return stats
+            return stats
 
     def get_recent_users(self, limit=20):
         """Get recent users with their activity data."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
+        with self._connection() as connection:
+            cursor = connection.cursor(dictionary=True)
         
-        cursor = self.connection.cursor(dictionary=True)
-        
-        try:
-            query = """
-            SELECT user_id, username, first_name, last_name, language_code,
-                   interaction_count, first_seen, last_seen, is_active
-            FROM bot_users 
-            ORDER BY last_seen DESC 
-            LIMIT %s
-            """
-            cursor.execute(query, (limit,))
-            users = cursor.fetchall()
-            
-        except Error as e:
-            print(f"Error getting recent users: {e}")
-            users = []
-        finally:
-            cursor.close()
+            try:
+                query = """
+                SELECT user_id, username, first_name, last_name, language_code,
+                       interaction_count, first_seen, last_seen, is_active
+                FROM bot_users 
+                ORDER BY last_seen DESC 
+                LIMIT %s
+                """
+                cursor.execute(query, (limit,))
+                users = cursor.fetchall()
+            
+            except DatabaseError as e:
+                print(f"Error getting recent users: {e}")
+                users = []
+            finally:
+                cursor.close()
         
-        return users
+            return users
 
     def get_user_details(self, user_id):
         """Get detailed information about a specific user."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
-        
-        cursor = self.connection.cursor(dictionary=True)
+        with self._connection() as connection:
+            cursor = connection.cursor(dictionary=True)
         
-        try:
-            query = """
-            SELECT user_id, username, first_name, last_name, language_code,
-                   interaction_count, first_seen, last_seen, is_active
-            FROM bot_users 
-            WHERE user_id = %s
-            """
-            cursor.execute(query, (user_id,))
-            user = cursor.fetchone()
-            
-        except Error as e:
-            print(f"Error getting user details: {e}")
-            user = None
-        finally:
-            cursor.close()
+            try:
+                query = """
+                SELECT user_id, username, first_name, last_name, language_code,
+                       interaction_count, first_seen, last_seen, is_active
+                FROM bot_users 
+                WHERE user_id = %s
+                """
+                cursor.execute(query, (user_id,))
+                user = cursor.fetchone()
+            
+            except DatabaseError as e:
+                print(f"Error getting user details: {e}")
+                user = None
+            finally:
+                cursor.close()
         
-        return user
+            return user
 
     def get_all_active_users(self):
         """Get all active users for broadcasting."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
+        with self._connection() as connection:
+            cursor = connection.cursor(dictionary=True)
         
-        cursor = self.connection.cursor(dictionary=True)
-        
-        try:
-            query = """
-            SELECT user_id, first_name, username
-            FROM bot_users 
-            WHERE is_active = TRUE
-            ORDER BY last_seen DESC
-            """
-            cursor.execute(query)
-            users = cursor.fetchall()
-            
-        except Error as e:
-            print(f"Error getting active users: {e}")
-            users = []
-        finally:
-            cursor.close()
+            try:
+                query = """
+                SELECT user_id, first_name, username
+                FROM bot_users 
+                WHERE is_active = TRUE
+                ORDER BY last_seen DESC
+                """
+                cursor.execute(query)
+                users = cursor.fetchall()
+            
+            except DatabaseError as e:
+                print(f"Error getting active users: {e}")
+                users = []
+            finally:
+                cursor.close()
         
-        return users
+            return users
+
+    def _deactivate_users(self, cursor, user_ids):
+        if user_ids:
+            placeholders = ", ".join(["%s"] * len(user_ids))
+            cursor.execute(f"UPDATE bot_users SET is_active = FALSE WHERE user_id IN ({placeholders})", list(user_ids))
+
+    def deactivate_users(self, user_ids):
+        """Mark users unreachable (e.g. they blocked the bot) so broadcasts skip them."""
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                self._deactivate_users(cursor, user_ids)
+                connection.commit()
+                return True
+            except DatabaseError as e:
+                print(f"Error deactivating users: {e}")
+                connection.rollback()
+                return False
+            finally:
+                cursor.close()
+
+    def create_broadcast_job(self, admin_id, message):
+        """Create a broadcast job addressed to every active user; returns the job dict."""
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                job_id = self.broadcasts.create(cursor, admin_id, message)
+                connection.commit()
+                return self.broadcasts.get(cursor, job_id)
+            except DatabaseError as e:
+                print(f"Error creating broadcast job: {e}")
+                connection.rollback()
+                return None
+            finally:
+                cursor.close()
+
+    def get_broadcast_job(self, job_id):
+        """Return one broadcast job as a dict, or None."""
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                return self.broadcasts.get(cursor, job_id)
+            except DatabaseError as e:
+                print(f"Error getting broadcast job: {e}")
+                return None
+            finally:
+                cursor.close()
+
+    def get_broadcast_jobs(self, status=None, limit=10):
+        """Return the newest broadcast jobs, optionally only running/completed/cancelled ones."""
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                return self.broadcasts.recent(cursor, status, limit)
+            except DatabaseError as e:
+                print(f"Error getting broadcast jobs: {e}")
+                return []
+            finally:
+                cursor.close()
+
+    def next_broadcast_recipients(self, job_id, limit=100):
+        """Return user ids a broadcast job still has to send to."""
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                return self.broadcasts.pending_recipients(cursor, job_id, limit)
+            except DatabaseError as e:
+                print(f"Error getting broadcast recipients: {e}")
+                return []
+            finally:
+                cursor.close()
+
+    def record_broadcast_results(self, job_id, results):
+        """Store a batch of broadcast results [(user_id, status, error)].
+
+        Recipients with status 'blocked' are deactivated in the same
+        transaction, so later broadcasts skip them.
+        """
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                counts = self.broadcasts.record(cursor, job_id, results)
+                self._deactivate_users(cursor, [user_id for user_id, status, _ in results if status == 'blocked'])
+                connection.commit()
+                return counts
+            except DatabaseError as e:
+                print(f"Error recording broadcast results: {e}")
+                connection.rollback()
+                return None
+            finally:
+                cursor.close()
+
+    def set_broadcast_progress_message(self, job_id, message_id):
+        """Remember the admin message showing a broadcast's progress."""
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                self.broadcasts.set_progress_message(cursor, job_id, message_id)
+                connection.commit()
+            except DatabaseError as e:
+                print(f"Error saving broadcast progress message: {e}")
+                connection.rollback()
+            finally:
+                cursor.close()
+
+    def finish_broadcast_job(self, job_id, status='completed'):
+        """Close a running broadcast job as completed or cancelled."""
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                finished = self.broadcasts.finish(cursor, job_id, status)
+                connection.commit()
+                return finished
+            except DatabaseError as e:
+                print(f"Error finishing broadcast job: {e}")
+                connection.rollback()
+                return False
+            finally:
+                cursor.close()
 
     def get_user_activity_stats(self, days=30):
         """Get user activity statistics for the last N days."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
-        
-        cursor = self.connection.cursor()
+        with self._connection() as connection:
+            cursor = connection.cursor()
         
-        try:
-            # Daily new users
-            query = """
-            SELECT DATE(first_seen) as date, COUNT(*) as new_users
-            FROM bot_users 
-            WHERE first_seen >= DATE_SUB(CURDATE(), INTERVAL %s DAY)
-            GROUP BY DATE(first_seen)
-            ORDER BY date DESC
-            """
-            cursor.execute(query, (days,))
-            daily_new_users = cursor.fetchall()
-            
-            # Daily active users  
-            query = """
-            SELECT DATE(last_seen) as date, COUNT(*) as active_users
-            FROM bot_users 
-            WHERE last_seen >= DATE_SUB(CURDATE(), INTERVAL %s DAY)
-            GROUP BY DATE(last_seen)
-            ORDER BY date DESC
-            """
-            cursor.execute(query, (days,))
-            daily_active_users = cursor.fetchall()
-            
-            return {
-                'daily_new_users': daily_new_users,
-                'daily_active_users': daily_active_users
-            }
-            
-        except Error as e:
-            print(f"Error getting activity stats: {e}")
-            return {'error': str(e)}
-        finally:
-            cursor.close()
+            try:
+                # Daily new users
+                query = """
+                SELECT DATE(first_seen) as date, COUNT(*) as new_users
+                FROM bot_users 
+                WHERE first_seen >= %s
+                GROUP BY DATE(first_seen)
+                ORDER BY date DESC
+                """
+                since = datetime.datetime.combine(datetime.date.today(), datetime.time.min) - datetime.timedelta(days=days)
+                cursor.execute(query, (since,))
+                daily_new_users = cursor.fetchall()
+            
+                # Daily active users  
+                query = """
+                SELECT DATE(last_seen) as date, COUNT(*) as active_users
+                FROM bot_users 
+                WHERE last_seen >= %s
+                GROUP BY DATE(last_seen)
+                ORDER BY date DESC
+                """
+                cursor.execute(query, (since,))
+                daily_active_users = cursor.fetchall()
+            
+                return {
+                    'daily_new_users': daily_new_users,
+                    'daily_active_users': daily_active_users
+                }
+            
+            except DatabaseError as e:
+                print(f"Error getting activity stats: {e}")
+                return {'error': str(e)}
+            finally:
+                cursor.close()
 
     def get_popular_features(self):
         """Get statistics about which features are most used (would need tracking)."""
         # This would require implementing feature tracking in the bot
         # For now, return basic data we have
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
-        
-        cursor = self.connection.cursor()
+        with self._connection() as connection:
+            cursor = connection.cursor()
         
-        try:
-            # Most popular fuel types (from available data)
-            available_fuels = self.get_available_fuel_types()
-            fuel_popularity = [(fuel['display'], fuel['stations_count']) for fuel in available_fuels]
-            
-            # Most popular municipalities (by station count)
-            cursor.execute("""
-                SELECT municipio, COUNT(*) as station_count
-                FROM estaciones_servicio 
-                GROUP BY municipio 
-                ORDER BY station_count DESC 
-                LIMIT 10
-            """)
-            popular_municipalities = cursor.fetchall()
-            
-            return {
-                'fuel_popularity': fuel_popularity,
-                'popular_municipalities': popular_municipalities
-            }
-            
-        except Error as e:
-            print(f"Error getting feature popularity: {e}")
-            return {'error': str(e)}
-        finally:
-            cursor.close()
+            try:
+                # Most popular fuel types (from available data)
+                available_fuels = self.get_available_fuel_types()
+                fuel_popularity = [(fuel['display'], fuel['stations_count']) for fuel in available_fuels]
+            
+                # Most popular municipalities (by station count)
+                cursor.execute("""
+                    SELECT municipio, COUNT(*) as station_count
+                    FROM estaciones_servicio 
+                    GROUP BY municipio 
+                    ORDER BY station_count DESC 
+                    LIMIT 10
+                """)
+                popular_municipalities = cursor.fetchall()
+            
+                return {
+                    'fuel_popularity': fuel_popularity,
+                    'popular_municipalities': popular_municipalities
+                }
+            
+            except DatabaseError as e:
+                print(f"Error getting feature popularity: {e}")
+                return {'error': str(e)}
+            finally:
+                cursor.close()
 
     # Alert Management Functions
-    def create_price_alert(self, user_id, username, fuel_type, price_threshold, municipality):
-        """Create a new price alert for a user."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
+    def create_price_alert(self, user_id, username, fuel_type, price_threshold, municipality, persistent=False):
+        """Create a new price alert for a user; a persistent one re-arms instead of being deleted once sent."""
+        alert_state = ALERT_PERSISTENT if persistent else 0
+        with self._connection() as connection:
+            cursor = connection.cursor()
         
-        cursor = self.connection.cursor()
-        
-        try:
-            # Check if user already has an alert for this fuel type and municipality
-            check_query = """
-            SELECT id FROM user_subscriptions 
-            WHERE user_id = %s AND fuel_type = %s AND municipio = %s AND is_active = TRUE
-            """
-            cursor.execute(check_query, (user_id, fuel_type, municipality))
-            existing_alert = cursor.fetchone()
-            
-            if existing_alert:
-                # Update existing alert
-                update_query = """
-                UPDATE user_subscriptions 
-                SET price_threshold = %s, created_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-                """
-                cursor.execute(update_query, (price_threshold, existing_alert[0]))
-                self.connection.commit()
-                return True, "updated"
-            else:
-                # Create new alert
-                insert_query = """
-                INSERT INTO user_subscriptions 
-                (user_id, username, fuel_type, price_threshold, municipio, is_active)
-                VALUES (%s, %s, %s, %s, %s, TRUE)
+            try:
+                # Check if user already has an alert for this fuel type and municipality
+                check_query = """
+                SELECT id FROM user_subscriptions 
+                WHERE user_id = %s AND fuel_type = %s AND municipio = %s AND is_active = TRUE
                 """
-                cursor.execute(insert_query, (user_id, username, fuel_type, price_threshold, municipality))
-                self.connection.commit()
-                return True, "created"
+                cursor.execute(check_query, (user_id, fuel_type, municipality))
+                existing_alert = cursor.fetchone()
+            
+                if existing_alert:
+                    # Update existing alert
+                    update_query = """
+                    UPDATE user_subscriptions 
+                    SET price_threshold = %s, created_at = %s, alert_state = %s, last_notified_at = NULL
+                    WHERE id = %s
+                    """
+                    cursor.execute(update_query, (price_threshold, datetime.datetime.now(), alert_state, existing_alert[0]))
+                    connection.commit()
+                    alert_id = existing_alert[0]
+                    status = "updated"
+                else:
+                    # Create new alert
+                    insert_query = """
+                    INSERT INTO user_subscriptions 
+                    (user_id, username, fuel_type, price_threshold, municipio, is_active, alert_state)
+                    VALUES (%s, %s, %s, %s, %s, TRUE, %s)
+                    """
+                    cursor.execute(insert_query, (user_id, username, fuel_type, price_threshold, municipality, alert_state))
+                    connection.commit()
+                    alert_id = cursor.lastrowid
+                    status = "created"
                 
-        except Error as e:
-            print(f"Error creating price alert: {e}")
-            self.connection.rollback()
-            return False, str(e)
-        finally:
-            cursor.close()
+                self._update_alert_index(add={
+                    'id': alert_id, 'user_id': user_id, 'username': username, 'fuel_type': fuel_type,
+                    'price_threshold': price_threshold, 'municipio': municipality,
+                    'alert_state': alert_state, 'last_notified_at': None
+                })
+                return True, status
+                
+            except DatabaseError as e:
+                print(f"Error creating price alert: {e}")
+                connection.rollback()
+                return False, str(e)
+            finally:
+                cursor.close()
+
+    def create_location_alert(self, user_id, username, fuel_type, price_threshold, latitude, longitude, radius_km,
+                              persistent=False):
+        """Create or update an alert for any station within ``radius_km`` of a point."""
+        alert_state = ALERT_PERSISTENT if persistent else 0
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            
+            try:
+                # One alert per user, fuel and (rounded) centre
+                latitude = round(float(latitude), 5)
+                longitude = round(float(longitude), 5)
+                cursor.execute("""
+                SELECT id FROM user_subscriptions
+                WHERE user_id = %s AND fuel_type = %s AND is_active = TRUE
+                  AND latitude = %s AND longitude = %s
+                """, (user_id, fuel_type, latitude, longitude))
+                existing_alert = cursor.fetchone()
+                
+                if existing_alert:
+                    cursor.execute("""
+                    UPDATE user_subscriptions
+                    SET price_threshold = %s, radius_km = %s, created_at = %s, alert_state = %s, last_notified_at = NULL
+                    WHERE id = %s
+                    """, (price_threshold, radius_km, datetime.datetime.now(), alert_state, existing_alert[0]))
+                    connection.commit()
+                    alert_id = existing_alert[0]
+                    status = "updated"
+                else:
+                    cursor.execute("""
+                    INSERT INTO user_subscriptions
+                    (user_id, username, fuel_type, price_threshold, latitude, longitude, radius_km, is_active, alert_state)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, TRUE, %s)
+                    """, (user_id, username, fuel_type, price_threshold, latitude, longitude, radius_km, alert_state))
+                    connection.commit()
+                    alert_id = cursor.lastrowid
+                    status = "created"
+                
+                self._update_alert_index(add={
+                    'id': alert_id, 'user_id': user_id, 'username': username, 'fuel_type': fuel_type,
+                    'price_threshold': price_threshold, 'latitude': latitude, 'longitude': longitude,
+                    'radius_km': radius_km, 'alert_state': alert_state, 'last_notified_at': None
+                })
+                return True, status
+                
+            except DatabaseError as e:
+                print(f"Error creating location alert: {e}")
+                connection.rollback()
+                return False, str(e)
+            finally:
+                cursor.close()
 
     def get_user_alerts(self, user_id):
         """Get all active alerts for a user."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
+        with self._connection() as connection:
+            cursor = connection.cursor(dictionary=True)
         
-        cursor = self.connection.cursor(dictionary=True)
-        
-        try:
-            query = """
-            SELECT id, fuel_type, price_threshold, municipio, created_at
-            FROM user_subscriptions 
-            WHERE user_id = %s AND is_active = TRUE
-            ORDER BY created_at DESC
-            """
-            cursor.execute(query, (user_id,))
-            alerts = cursor.fetchall()
-            return alerts
-            
-        except Error as e:
-            print(f"Error getting user alerts: {e}")
-            return []
-        finally:
-            cursor.close()
+            try:
+                query = """
+                SELECT id, fuel_type, price_threshold, municipio, created_at, latitude, longitude, radius_km,
+                       alert_state, last_notified_at
+                FROM user_subscriptions 
+                WHERE user_id = %s AND is_active = TRUE
+                ORDER BY created_at DESC
+                """
+                cursor.execute(query, (user_id,))
+                alerts = cursor.fetchall()
+                return alerts
+            
+            except DatabaseError as e:
+                print(f"Error getting user alerts: {e}")
+                return []
+            finally:
+                cursor.close()
 
     def delete_alert(self, user_id, alert_id):
         """Delete a specific alert for a user."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
+        with self._connection() as connection:
+            cursor = connection.cursor()
         
-        cursor = self.connection.cursor()
+            try:
+                # Verify the alert belongs to the user before deleting
+                delete_query = """
+                UPDATE user_subscriptions 
+                SET is_active = FALSE 
+                WHERE id = %s AND user_id = %s AND is_active = TRUE
+                """
+                cursor.execute(delete_query, (alert_id, user_id))
+            
+                if cursor.rowcount > 0:
+                    connection.commit()
+                    self._update_alert_index(remove=alert_id)
+                    return True
+                else:
+                    return False
+                
+            except DatabaseError as e:
+                print(f"Error deleting alert: {e}")
+                connection.rollback()
+                return False
+            finally:
+                cursor.close()
+
+    def set_alert_persistent(self, user_id, alert_id, persistent):
+        """Switch one of a user's alerts between one-shot and persistent; it is re-armed either way."""
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            
+            try:
+                cursor.execute("""
+                UPDATE user_subscriptions
+                SET alert_state = %s
+                WHERE id = %s AND user_id = %s AND is_active = TRUE
+                """, (ALERT_PERSISTENT if persistent else 0, alert_id, user_id))
+                if cursor.rowcount <= 0:
+                    return False
+                alert = self._read_alert(cursor, alert_id)
+                connection.commit()
+            
+            except DatabaseError as e:
+                print(f"Error updating alert mode: {e}")
+                connection.rollback()
+                return False
+            finally:
+                cursor.close()
         
-        try:
-            # Verify the alert belongs to the user before deleting
-            delete_query = """
-            UPDATE user_subscriptions 
-            SET is_active = FALSE 
-            WHERE id = %s AND user_id = %s AND is_active = TRUE
-            """
-            cursor.execute(delete_query, (alert_id, user_id))
-            
-            if cursor.rowcount > 0:
-                self.connection.commit()
-                return True
+        self._update_alert_index(add=alert)
+        return True
+
+    def _read_alert(self, cursor, alert_id):
+        # Current row of an active alert as an index entry, or None
+        cursor.execute(
+            f"SELECT {', '.join(ALERT_ROW_COLUMNS)} FROM user_subscriptions WHERE id = %s AND is_active = TRUE",
+            (alert_id,)
+        )
+        row = cursor.fetchone()
+        return dict(zip(ALERT_ROW_COLUMNS, row)) if row else None
+
+    def _load_alert_index(self, cursor):
+        # Loaded once per process; create/delete keep both indexes current
+        with self._alert_index_lock:
+            if not self.alert_index.loaded:
+                cursor.execute(ACTIVE_ALERTS_QUERY)
+                self.alert_index.load(cursor.fetchall())
+            if not self.location_alert_index.loaded:
+                cursor.execute(LOCATION_ALERTS_QUERY)
+                self.location_alert_index.load(cursor.fetchall())
+
+    def _update_alert_index(self, add=None, remove=None):
+        # Before the first load there is nothing to maintain: loading reads the table
+        with self._alert_index_lock:
+            if not self.alert_index.loaded:
+                return
+            if remove is not None:
+                if not self.alert_index.remove(remove):
+                    self.location_alert_index.remove(remove)
+            if add is not None:
+                if add.get('latitude') is not None:
+                    self.location_alert_index.add(add)
+                else:
+                    self.alert_index.add(add)
+
+    def _triggered_alerts(self, cheapest, pairs):
+        # (alert, best) pairs: all triggered alerts of a pair are one bisect slice of the alert index
+        triggered = []
+        for pair in pairs:
+            best = cheapest.get(pair)
+            if best is not None:
+                triggered.extend((alert, best) for alert in self.alert_index.triggered(pair, best[0]))
+        return triggered
+
+    def _triggered_location_alerts(self, station_rows, changed=None):
+        # Each station price only meets the location alerts bucketed in its grid cell
+        return list(cheapest_by_location_alert(station_rows, self.location_alert_index, changed).values())
+
+    def _ready_notifications(self, triggered):
+        # Notifications of the triggered alerts that are armed and out of their cooldown
+        now = datetime.datetime.now()
+        return [
+            make_notification(alert, best) for alert, best in triggered
+            if alert_ready(alert, now, self.alert_cooldown)
+        ]
+
+    def _reload_persistent_alerts(self, triggered):
+        # Another process (notification_sender.py) may have notified, disarmed or
+        # re-armed a persistent alert since it was indexed. Its state and
+        # last_notified_at, which goes into the event key, are read back from
+        # the table and the index updated before the alert is notified.
+        ids = sorted({alert['id'] for alert, _ in triggered if (alert.get('alert_state') or 0) & ALERT_PERSISTENT})
+        if not ids:
+            return triggered
+        
+        current = {}
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                for start in range(0, len(ids), ALERT_RELOAD_CHUNK):
+                    chunk = ids[start:start + ALERT_RELOAD_CHUNK]
+                    placeholders = ", ".join(["%s"] * len(chunk))
+                    cursor.execute(f"""
+                        SELECT {', '.join(ALERT_ROW_COLUMNS)} FROM user_subscriptions
+                        WHERE id IN ({placeholders}) AND is_active = TRUE
+                    """, chunk)
+                    for row in cursor.fetchall():
+                        alert = dict(zip(ALERT_ROW_COLUMNS, row))
+                        current[alert['id']] = alert
+            except DatabaseError as e:
+                print(f"Error reloading triggered alerts: {e}")
+                return triggered
+            finally:
+                cursor.close()
+        
+        for alert_id in ids:
+            if alert_id in current:
+                self._update_alert_index(add=current[alert_id])
             else:
-                return False
+                self._update_alert_index(remove=alert_id)
+        return [
+            (current.get(alert['id'], alert), best) for alert, best in triggered
+            if alert['id'] in current or not (alert.get('alert_state') or 0) & ALERT_PERSISTENT
+        ]
+
+    def _alerts_to_rearm(self, cheapest, station_rows, pairs=None):
+        # Disarmed alerts whose cheapest price is now above threshold + margin.
+        # Only ``pairs`` are checked when given; location alerts only with station_rows.
+        margin = self.alert_rearm_margin
+        rearm = []
+        for pair in (self.alert_index.pairs() if pairs is None else pairs):
+            best = cheapest.get(pair)
+            if best is not None:
+                rearm.extend(alert for alert in self.alert_index.below(pair, best[0] - margin) if alert_disarmed(alert))
+        
+        if station_rows is None:
+            return rearm
+        disarmed = {alert['id']: alert for alert in self.location_alert_index.alerts() if alert_disarmed(alert)}
+        if disarmed:
+            still_low = cheapest_by_location_alert(station_rows, self.location_alert_index, margin=margin)
+            rearm.extend(alert for alert_id, alert in disarmed.items() if alert_id not in still_low)
+        return rearm
+
+    def rearm_alerts(self, alerts):
+        """Clear the disarmed flag of persistent alerts; returns how many were re-armed."""
+        if not alerts:
+            return 0
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                ids = [alert['id'] for alert in alerts]
+                placeholders = ", ".join(["%s"] * len(ids))
+                cursor.execute(f"""
+                    UPDATE user_subscriptions SET alert_state = alert_state - %s
+                    WHERE id IN ({placeholders}) AND is_active = TRUE AND (alert_state & %s) = %s
+                """, [ALERT_DISARMED] + ids + [ALERT_DISARMED, ALERT_DISARMED])
+                connection.commit()
+            except DatabaseError as e:
+                print(f"Error re-arming alerts: {e}")
+                connection.rollback()
+                return 0
+            finally:
+                cursor.close()
+        
+        for alert in alerts:
+            self._update_alert_index(add=dict(alert, alert_state=alert['alert_state'] & ~ALERT_DISARMED))
+        return len(alerts)
+
+    def check_alerts_for_events(self, events):
+        """Return notifications for the alerts affected by price-change events.
+
+        Only price drops can trigger an alert, and only alerts on the
+        (municipality, fuel) pairs of those drops are checked: the cheapest
+        prices are read for the affected municipalities alone. Price rises
+        re-arm the disarmed persistent alerts of their pairs (and disarmed
+        location alerts) whose price is back above threshold + margin.
+        Triggered persistent alerts are read back from the table first, since
+        another process may have notified or re-armed them.
+        """
+        pairs = set()
+        changed = set()
+        rising = set()
+        for event in events:
+            fuel_type = FUEL_TYPE_BY_COLUMN.get(self.history.column_for(event['fuel_id']))
+            if event['old_price'] is None or event['new_price'] < event['old_price']:
+                pairs.add((event['id_municipio'], fuel_type))
+                changed.add((event['ideess'], fuel_type))
+            elif event['new_price'] > event['old_price']:
+                rising.add((event['id_municipio'], fuel_type))
+        
+        cheapest = {}
+        station_rows = []
+        rearm_rows = None
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                self._load_alert_index(cursor)
+                indexed_pairs = set(self.alert_index.pairs())
+                rearm_locations = bool(rising) and any(alert_disarmed(alert) for alert in self.location_alert_index.alerts())
+                pairs &= indexed_pairs
+                rising &= indexed_pairs
+                if pairs or rising:
+                    municipality_ids = sorted({pair[0] for pair in pairs | rising})
+                    cursor.execute(station_prices_query(len(municipality_ids)), municipality_ids)
+                    cheapest = cheapest_by_pair(cursor.fetchall())
                 
-        except Error as e:
-            print(f"Error deleting alert: {e}")
-            self.connection.rollback()
-            return False
-        finally:
-            cursor.close()
+                if rearm_locations:
+                    # Re-arming needs every station in an alert's circle, not just the changed ones
+                    cursor.execute(STATION_LOCATIONS_QUERY)
+                    station_rows = rearm_rows = cursor.fetchall()
+                elif changed and len(self.location_alert_index):
+                    # Location alerts: only the stations whose price dropped
+                    station_ids = sorted({ideess for ideess, _ in changed})
+                    cursor.execute(station_locations_query(len(station_ids)), station_ids)
+                    station_rows = cursor.fetchall()
+            except DatabaseError as e:
+                print(f"Error checking alerts for price changes: {e}")
+                return []
+            finally:
+                cursor.close()
+        
+        if rising or rearm_locations:
+            self.rearm_alerts(self._alerts_to_rearm(cheapest, rearm_rows, rising))
+        triggered = self._triggered_alerts(cheapest, pairs) + self._triggered_location_alerts(station_rows, changed)
+        return self._ready_notifications(self._reload_persistent_alerts(triggered))
+
+    def _queue_alerts_for_events(self, events):
+        # Subscribed to price-change events; senders drain the outbox
+        notifications = self.check_alerts_for_events(events)
+        if notifications:
+            self.enqueue_alert_notifications(notifications)
+
+    def enqueue_alert_notifications(self, notifications):
+        """Queue triggered alerts in the outbox; returns how many were new."""
+        if not notifications:
+            return 0
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                added = self.outbox.enqueue(cursor, notifications)
+                connection.commit()
+                return added
+            except DatabaseError as e:
+                print(f"Error queueing alert notifications: {e}")
+                connection.rollback()
+                return 0
+            finally:
+                cursor.close()
+
+    def claim_alert_notifications(self, limit=50):
+        """Claim a batch of queued alert notifications for sending (see AlertOutbox.claim)."""
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                claimed = self.outbox.claim(cursor, limit)
+                connection.commit()
+                return claimed
+            except DatabaseError as e:
+                print(f"Error claiming alert notifications: {e}")
+                connection.rollback()
+                return []
+            finally:
+                cursor.close()
+
+    def complete_alert_notification(self, notification):
+        """Mark a claimed notification delivered and deactivate (or disarm) its alert, in one transaction."""
+        alert = None
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                completed = self.outbox.mark_delivered(cursor, notification)
+                if completed:
+                    alert = self._read_alert(cursor, notification['alert_id'])
+                connection.commit()
+            except DatabaseError as e:
+                print(f"Error completing alert notification: {e}")
+                connection.rollback()
+                return False
+            finally:
+                cursor.close()
+        
+        if alert is not None:
+            # Persistent alert: keep it indexed, disarmed and cooling down
+            self._update_alert_index(add=alert)
+        elif completed:
+            self._update_alert_index(remove=notification['alert_id'])
+        return completed
+
+    def fail_alert_notification(self, notification, error, retry=True):
+        """Release a claimed notification whose send failed."""
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                released = self.outbox.mark_failed(cursor, notification, error, retry)
+                connection.commit()
+                return released
+            except DatabaseError as e:
+                print(f"Error releasing alert notification: {e}")
+                connection.rollback()
+                return False
+            finally:
+                cursor.close()
+
+    def record_alert_digests(self, notification_count, message_count):
+        """Count notifications delivered and the digest messages that carried them."""
+        if not notification_count:
+            return
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                self.history.add_meta_counter(cursor, ALERT_DIGEST_NOTIFICATIONS, notification_count)
+                self.history.add_meta_counter(cursor, ALERT_DIGEST_MESSAGES, message_count)
+                connection.commit()
+            except DatabaseError as e:
+                print(f"Error recording alert digests: {e}")
+                connection.rollback()
+            finally:
+                cursor.close()
+
+    def get_outbox_statistics(self):
+        """Return {status: count} for the alert outbox."""
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                return self.outbox.statistics(cursor)
+            except DatabaseError as e:
+                print(f"Error getting outbox statistics: {e}")
+                return {}
+            finally:
+                cursor.close()
+
+    def refresh_alert_index(self):
+        """Reload the alert index, picking up alerts changed by other processes."""
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                with self._alert_index_lock:
+                    cursor.execute(ACTIVE_ALERTS_QUERY)
+                    self.alert_index.load(cursor.fetchall())
+                    cursor.execute(LOCATION_ALERTS_QUERY)
+                    self.location_alert_index.load(cursor.fetchall())
+                return len(self.alert_index) + len(self.location_alert_index)
+            except DatabaseError as e:
+                print(f"Error reloading alert index: {e}")
+                return None
+            finally:
+                cursor.close()
 
     def check_price_alerts(self):
-        """Check all active alerts and return notifications to send."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
+        """Check all active alerts and return notifications to send.
+
+        The cheapest station of every (municipality, fuel) pair is computed in
+        one pass over the stations; the alerts each price triggers come from
+        the in-memory alert indexes, so the alerts table is not read again.
+        The same pass re-arms the persistent alerts whose price has risen
+        back above their threshold plus the re-arm margin.
+        """
+        station_rows = []
+        with self._connection() as connection:
+            cursor = connection.cursor()
         
-        cursor = self.connection.cursor(dictionary=True)
-        notifications = []
+            try:
+                self._load_alert_index(cursor)
+                cursor.execute(STATION_PRICES_QUERY)
+                cheapest = cheapest_by_pair(cursor.fetchall())
+                if len(self.location_alert_index):
+                    cursor.execute(STATION_LOCATIONS_QUERY)
+                    station_rows = cursor.fetchall()
+            
+            except DatabaseError as e:
+                print(f"Error checking price alerts: {e}")
+                return []
+            finally:
+                cursor.close()
         
-        try:
-            # Get all active alerts
-            alerts_query = """
-            SELECT s.id, s.user_id, s.username, s.fuel_type, s.price_threshold, s.municipio
-            FROM user_subscriptions s
-            WHERE s.is_active = TRUE
-            """
-            cursor.execute(alerts_query)
-            alerts = cursor.fetchall()
-            
-            for alert in alerts:
-                # Get current minimum price for this fuel type in this municipality
-                fuel_column = None
-                for fuel_key, fuel_info in FUEL_TYPES.items():
-                    if fuel_key == alert['fuel_type']:
-                        fuel_column = fuel_info['column'].lower()
-                        break
-                
-                if not fuel_column:
-                    continue
-                
-                # Get municipality ID
-                municipality_id = None
-                for muni_key, muni_info in MUNICIPALITIES.items():
-                    if muni_info['display'] == alert['municipio']:
-                        municipality_id = muni_info['id']
-                        break
-                
-                if not municipality_id:
-                    continue
-                
-                # Find cheapest station for this fuel in this municipality
-                price_query = f"""
-                SELECT MIN({fuel_column}) as min_price, rotulo, direccion
-                FROM estaciones_servicio 
-                WHERE id_municipio = %s AND {fuel_column} IS NOT NULL AND {fuel_column} > 0
-                GROUP BY rotulo, direccion
-                ORDER BY min_price ASC
-                LIMIT 1
-                """
-                
-                cursor.execute(price_query, (municipality_id,))
-                result = cursor.fetchone()
-                
-                if result and result['min_price'] <= alert['price_threshold']:
-                    notifications.append({
-                        'user_id': alert['user_id'],
-                        'alert_id': alert['id'],
-                        'fuel_type': alert['fuel_type'],
-                        'current_price': result['min_price'],
-                        'threshold': alert['price_threshold'],
-                        'municipality': alert['municipio'],
-                        'station_name': result['rotulo'],
-                        'station_address': result['direccion']
-                    })
-            
-            return notifications
-            
-        except Error as e:
-            print(f"Error checking price alerts: {e}")
-            return []
-        finally:
-            cursor.close()
+        self.rearm_alerts(self._alerts_to_rearm(cheapest, station_rows))
+        return self._ready_notifications(
+            self._triggered_alerts(cheapest, self.alert_index.pairs()) + self._triggered_location_alerts(station_rows)
+        )
+
+    def _digest_statistics(self, cursor):
+        notifications = self.history.meta_counter(cursor, ALERT_DIGEST_NOTIFICATIONS, 0)
+        messages = self.history.meta_counter(cursor, ALERT_DIGEST_MESSAGES, 0)
+        return {'notifications': notifications, 'messages': messages, 'saved': notifications - messages}
 
     def get_alert_statistics(self):
         """Get statistics about price alerts for admin dashboard."""
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
+        with self._connection() as connection:
+            cursor = connection.cursor()
         
-        cursor = self.connection.cursor()
-        
-        try:
-            # Total active alerts
-            cursor.execute("SELECT COUNT(*) FROM user_subscriptions WHERE is_active = TRUE")
-            total_alerts = cursor.fetchone()[0]
-            
-            # Alerts by fuel type
-            cursor.execute("""
-                SELECT fuel_type, COUNT(*) as count
-                FROM user_subscriptions 
-                WHERE is_active = TRUE
-                GROUP BY fuel_type
-                ORDER BY count DESC
-            """)
-            alerts_by_fuel = cursor.fetchall()
-            
-            # Alerts by municipality
-            cursor.execute("""
-                SELECT municipio, COUNT(*) as count
-                FROM user_subscriptions 
-                WHERE is_active = TRUE
-                GROUP BY municipio
-                ORDER BY count DESC
-                LIMIT 10
-            """)
-            alerts_by_municipality = cursor.fetchall()
-            
-            return {
-                'total_alerts': total_alerts,
-                'alerts_by_fuel': alerts_by_fuel,
-                'alerts_by_municipality': alerts_by_municipality
-            }
-            
-        except Error as e:
-            print(f"Error getting alert statistics: {e}")
-            return {'error': str(e)}
-        finally:
-            cursor.close()
+            try:
+                # Total active alerts
+                cursor.execute("SELECT COUNT(*) FROM user_subscriptions WHERE is_active = TRUE")
+                total_alerts = cursor.fetchone()[0]
+            
+                # Alerts by fuel type
+                cursor.execute("""
+                    SELECT fuel_type, COUNT(*) as count
+                    FROM user_subscriptions 
+                    WHERE is_active = TRUE
+                    GROUP BY fuel_type
+                    ORDER BY count DESC
+                """)
+                alerts_by_fuel = cursor.fetchall()
+            
+                # Alerts by municipality
+                cursor.execute("""
+                    SELECT municipio, COUNT(*) as count
+                    FROM user_subscriptions 
+                    WHERE is_active = TRUE AND municipio IS NOT NULL
+                    GROUP BY municipio
+                    ORDER BY count DESC
+                    LIMIT 10
+                """)
+                alerts_by_municipality = cursor.fetchall()
+            
+                cursor.execute("SELECT COUNT(*) FROM user_subscriptions WHERE is_active = TRUE AND latitude IS NOT NULL")
+                location_alerts = cursor.fetchone()[0]
+            
+                cursor.execute("""
+                    SELECT COUNT(*), COALESCE(SUM(CASE WHEN (alert_state & %s) = %s THEN 1 ELSE 0 END), 0)
+                    FROM user_subscriptions
+                    WHERE is_active = TRUE AND (alert_state & %s) = %s
+                """, (ALERT_DISARMED, ALERT_DISARMED, ALERT_PERSISTENT, ALERT_PERSISTENT))
+                persistent_alerts, disarmed_alerts = cursor.fetchone()
+            
+                return {
+                    'total_alerts': total_alerts,
+                    'location_alerts': location_alerts,
+                    'persistent_alerts': persistent_alerts,
+                    'disarmed_alerts': int(disarmed_alerts),
+                    'alerts_by_fuel': alerts_by_fuel,
+                    'alerts_by_municipality': alerts_by_municipality,
+                    'outbox': self.outbox.statistics(cursor),
+                    'digests': self._digest_statistics(cursor)
+                }
+            
+            except DatabaseError as e:
+                print(f"Error getting alert statistics: {e}")
+                return {'error': str(e)}
+            finally:
+                cursor.close()
 
 # Create global instance
 tenerife_data_manager = TenerifeDataManager()
@@ -0,0 +1,104 @@
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from sqlalchemy import create_engine
+from sqlalchemy.engine import URL
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+class PoolMetrics:
+    """Thread-safe checkout counters and wait-time statistics for a connection pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checkouts = 0
+        self._checkout_errors = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def record_checkout(self, waited):
+        with self._lock:
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+
+        if waited > 1:
+            logger.warning(f"Waited {waited:.2f}s for a database connection")
+
+    def record_error(self):
+        with self._lock:
+            self._checkout_errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            checkouts = self._checkouts
+            avg_wait = self._total_wait / checkouts if checkouts else 0.0
+            return {
+                'checkouts': checkouts,
+                'checkout_errors': self._checkout_errors,
+                'avg_wait_ms': avg_wait * 1000,
+                'max_wait_ms': self._max_wait * 1000
+            }
+
+class TenerifeConnectionPool:
+    """Bounded MySQL connection pool shared by raw cursors and pandas."""
+
+    def __init__(self, db_config, pool_size=5, max_overflow=5, pool_timeout=10, pool_recycle=1800):
+        url = URL.create(
+            "mysql+mysqlconnector",
+            username=db_config['user'],
+            password=db_config['password'],
+            host=db_config['host'],
+            database=db_config.get('database')
+        )
+
+        # pool_pre_ping validates every connection on checkout, so connections
+        # dropped by the server are replaced transparently instead of failing
+        # the first query that uses them.
+        self.engine = create_engine(
+            url,
+            poolclass=QueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_recycle=pool_recycle,
+            pool_pre_ping=True
+        )
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.metrics = PoolMetrics()
+
+    @contextmanager
+    def connection(self):
+        """Check out a DB-API connection for one operation and return it afterwards."""
+        start = time.perf_counter()
+        try:
+            conn = self.engine.raw_connection()
+        except Exception:
+            self.metrics.record_error()
+            raise
+        self.metrics.record_checkout(time.perf_counter() - start)
+
+        try:
+            yield conn
+        finally:
+            # Returns the connection to the pool (rolling back anything uncommitted)
+            conn.close()
+
+    def get_statistics(self):
+        """Return pool occupancy and checkout wait metrics."""
+        pool = self.engine.pool
+        stats = {
+            'pool_size': self.pool_size,
+            'max_overflow': self.max_overflow,
+            'checked_out': pool.checkedout(),
+            'idle': pool.checkedin()
+        }
+        stats.update(self.metrics.snapshot())
+        return stats
+
+    def dispose(self):
+        """Close every pooled connection."""
+        self.engine.dispose()
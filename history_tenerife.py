@@ -0,0 +1,696 @@
+import datetime
+import decimal
+import threading
+import logging
+import numpy as np
+import pandas as pd
+from storage_tenerife import FUEL_PRICE_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Prices are stored as integers in tenths of a euro cent (1.459 EUR -> 1459)
+PRICE_SCALE = 1000
+
+# Station attributes tracked by the versioned station dimension
+STATION_ATTRIBUTES = ['rotulo', 'localidad', 'municipio', 'direccion', 'latitud', 'longitud_wgs84']
+
+# Municipality key of the island-wide rows in daily_price_stats
+ISLAND_WIDE = ''
+
+# Dimensions a comparison chart can split one chart into
+COMPARISON_DIMENSIONS = ['municipio', 'rotulo', 'fuel']
+
+# Columns of the daily_price_stats rollup, in insert order
+DAILY_STATS_COLUMNS = [
+    'date', 'fuel_id', 'municipio', 'station_count',
+    'avg_price', 'min_price', 'max_price', 'p10_price', 'p50_price', 'p90_price'
+]
+
+# Fuel columns of the legacy wide historical_prices table
+LEGACY_FUEL_COLUMNS = [
+    'precio_gasolina_95_e5', 'precio_gasoleo_a', 'precio_gasolina_98_e5',
+    'precio_gasoleo_premium', 'precio_gases_licuados_del_petroleo',
+    'precio_gasoleo_b', 'precio_adblue'
+]
+
+def to_price_units(price):
+    """Convert a euro price to the stored integer representation."""
+    return int(round(float(price) * PRICE_SCALE))
+
+def from_price_units(units):
+    """Convert a stored integer price back to euros."""
+    return float(units) / PRICE_SCALE
+
+def month_start(date):
+    """Return the first day of the date's month."""
+    return date.replace(day=1)
+
+def add_months(date, months):
+    """Return the first day of the month ``months`` away from the date's month."""
+    index = date.year * 12 + date.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+def _parse_date(value):
+    # SQLite returns aggregated dates as text
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value[:10])
+    return value
+
+def pivot_series(rows, members):
+    """Pivot [(date, member, price units)] rows into (dates, matrix in euros).
+
+    The matrix has one row per member, in the given order, and one column per
+    date; days without data for a member are NaN so they plot as gaps.
+    """
+    dates = sorted({_parse_date(row[0]) for row in rows})
+    matrix = np.full((len(members), len(dates)), np.nan)
+    if not rows:
+        return dates, matrix
+
+    date_index = {date: index for index, date in enumerate(dates)}
+    member_index = {member: index for index, member in enumerate(members)}
+    row_positions = np.fromiter((member_index[row[1]] for row in rows), dtype=np.intp, count=len(rows))
+    column_positions = np.fromiter((date_index[_parse_date(row[0])] for row in rows), dtype=np.intp, count=len(rows))
+    units = np.fromiter((float(row[2]) for row in rows), dtype=float, count=len(rows))
+    matrix[row_positions, column_positions] = units / PRICE_SCALE
+    return dates, matrix
+
+def _normalize_attributes(values):
+    # Coordinates come back as Decimal from MySQL and float from SQLite
+    return tuple(
+        round(float(value), 6) if isinstance(value, (float, decimal.Decimal)) else value
+        for value in values
+    )
+
+class PriceHistory:
+    """Normalized price history: fuel and versioned station dimensions plus a narrow fact table.
+
+    ``price_history`` holds one (date, station_id, fuel_id, price) row per
+    station and fuel, keyed by (fuel_id, date, station_id) so a chart reads a
+    single contiguous key range. Station names, addresses and coordinates live
+    in ``station_versions``, which only gets a new row when a station changes.
+
+    ``price_intervals`` keeps intraday prices as validity intervals that
+    are only written when a price actually changes.
+
+    ``daily_price_stats`` rolls the facts up per date, fuel and municipality
+    (plus island-wide rows) so charts read at most one row per day.
+
+    Daily facts older than the retention window are downsampled into
+    ``price_history_monthly`` and then removed a whole month at a time.
+
+    Methods taking a cursor run inside the caller's transaction.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._fuel_ids = None
+        self._fuel_lock = threading.Lock()
+
+    @property
+    def fuel_ids(self):
+        """{price_column: fuel_id}, loaded (and seeded) from the fuels table on first use."""
+        if self._fuel_ids is None:
+            with self._fuel_lock:
+                if self._fuel_ids is None:
+                    with self.backend.connection() as connection:
+                        cursor = connection.cursor()
+                        self.seed_fuels(cursor)
+                        connection.commit()
+                        cursor.close()
+        return self._fuel_ids
+
+    def seed_fuels(self, cursor):
+        """Register fuel columns missing from the fuels table and load the id map.
+
+        Ids are assigned once and never renumbered, so a new fuel column only
+        adds a row here; history stays keyed by fuel_id with no schema change.
+        """
+        cursor.execute("SELECT price_column, fuel_id FROM fuels")
+        fuel_ids = {column: int(fuel_id) for column, fuel_id in cursor.fetchall()}
+
+        next_id = max(fuel_ids.values(), default=0) + 1
+        new_fuels = []
+        for column in FUEL_PRICE_COLUMNS:
+            if column not in fuel_ids:
+                fuel_ids[column] = next_id
+                new_fuels.append((next_id, column))
+                next_id += 1
+
+        if new_fuels:
+            cursor.executemany("INSERT INTO fuels (fuel_id, price_column) VALUES (%s, %s)", new_fuels)
+        self._fuel_ids = fuel_ids
+
+    def fuel_id_for(self, fuel_config):
+        """Return the fuel dimension id for a FUEL_TYPES entry."""
+        return self.fuel_ids.get(fuel_config['column'].lower())
+
+    def column_for(self, fuel_id):
+        """Return the estaciones_servicio price column for a fuel id."""
+        for column, known_id in self.fuel_ids.items():
+            if known_id == fuel_id:
+                return column
+        return None
+
+    def _register_stations(self, cursor, source_table, source_column):
+        cursor.execute(f"""
+            INSERT INTO stations (ideess)
+            SELECT DISTINCT src.{source_column} FROM {source_table} src
+            LEFT JOIN stations s ON s.ideess = src.{source_column}
+            WHERE s.station_id IS NULL AND src.{source_column} IS NOT NULL
+        """)
+
+    def _station_ids(self, cursor):
+        cursor.execute("SELECT ideess, station_id FROM stations")
+        return dict(cursor.fetchall())
+
+    def sync_stations(self, cursor, effective_date):
+        """Register new stations and version any changed station attributes.
+
+        A station whose attributes differ from its open version gets that
+        version closed at ``effective_date`` and a new one opened.
+        Returns the number of versions written.
+        """
+        self._register_stations(cursor, 'estaciones_servicio', 'IDEESS')
+
+        attribute_list = ", ".join(f"e.{attribute}" for attribute in STATION_ATTRIBUTES)
+        cursor.execute(f"""
+            SELECT s.station_id, {attribute_list}
+            FROM estaciones_servicio e
+            JOIN stations s ON s.ideess = e.IDEESS
+        """)
+        current = {row[0]: _normalize_attributes(row[1:]) for row in cursor.fetchall()}
+
+        cursor.execute(f"""
+            SELECT station_id, valid_from, {', '.join(STATION_ATTRIBUTES)}
+            FROM station_versions WHERE valid_to IS NULL
+        """)
+        open_versions = {row[0]: (row[1], _normalize_attributes(row[2:])) for row in cursor.fetchall()}
+
+        closed = []
+        replaced = []
+        opened = []
+        for station_id, attributes in current.items():
+            open_version = open_versions.get(station_id)
+            if open_version is None:
+                opened.append((station_id, effective_date) + attributes)
+            elif open_version[1] != attributes:
+                if open_version[0] >= effective_date:
+                    # Changed again on the day the version started: update it in place
+                    replaced.append(attributes + (station_id, open_version[0]))
+                else:
+                    closed.append((effective_date, station_id))
+                    opened.append((station_id, effective_date) + attributes)
+
+        if closed:
+            cursor.executemany(
+                "UPDATE station_versions SET valid_to = %s WHERE station_id = %s AND valid_to IS NULL",
+                closed
+            )
+        if replaced:
+            assignments = ", ".join(f"{attribute} = %s" for attribute in STATION_ATTRIBUTES)
+            cursor.executemany(
+                f"UPDATE station_versions SET {assignments} WHERE station_id = %s AND valid_from = %s",
+                replaced
+            )
+        if opened:
+            columns = ['station_id', 'valid_from'] + STATION_ATTRIBUTES
+            cursor.executemany(
+                f"INSERT INTO station_versions ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+                opened
+            )
+
+        return len(opened) + len(replaced)
+
+    def _fuel_id_list(self):
+        # Listing every fuel_id lets date-only lookups use the (fuel_id, date, ...) key
+        return ", ".join(str(fuel_id) for fuel_id in sorted(self.fuel_ids.values()))
+
+    def has_snapshot(self, cursor, date):
+        """Return True if facts already exist for the given date."""
+        cursor.execute(
+            f"SELECT 1 FROM price_history WHERE fuel_id IN ({self._fuel_id_list()}) AND date = %s LIMIT 1",
+            (date,)
+        )
+        return cursor.fetchone() is not None
+
+    def _current_prices_select(self, date_param):
+        """UNION ALL query unpivoting estaciones_servicio into (station_id, fuel_id, price units).
+
+        With ``date_param`` every row starts with a ``%s`` date column.
+        Each branch takes the price scale factor as a ``%s`` parameter.
+        """
+        date_column = "%s, " if date_param else ""
+        return " UNION ALL ".join(
+            f"SELECT {date_column}s.station_id, {fuel_id}, ROUND(e.{column} * %s) "
+            f"FROM estaciones_servicio e JOIN stations s ON s.ideess = e.IDEESS "
+            f"WHERE e.{column} > 0"
+            for column, fuel_id in self._current_fuels()
+        )
+
+    def _current_fuels(self):
+        # Fuels that still have a price column in estaciones_servicio
+        return [(column, self.fuel_ids[column]) for column in FUEL_PRICE_COLUMNS]
+
+    def insert_snapshot(self, cursor, date, multiplier=1.0):
+        """Copy current station prices for every fuel into the fact table.
+
+        ``multiplier`` scales every price (used to simulate past data).
+        Returns the number of fact rows written.
+        """
+        cursor.execute(
+            "INSERT INTO price_history (date, station_id, fuel_id, price) " + self._current_prices_select(True),
+            [date, PRICE_SCALE * multiplier] * len(FUEL_PRICE_COLUMNS)
+        )
+        return cursor.rowcount
+
+    def record_changes(self, cursor, observed_at):
+        """Update price_intervals with the prices currently in estaciones_servicio.
+
+        Only (station, fuel) pairs whose price differs from their open interval
+        are touched: the open interval is closed at ``observed_at`` and a new
+        one opened. Prices that disappeared just get their interval closed.
+        Returns the changes as (station_id, fuel_id, old_price, new_price)
+        tuples in price units, with None for a missing side.
+        """
+        self._register_stations(cursor, 'estaciones_servicio', 'IDEESS')
+
+        cursor.execute(self._current_prices_select(False), [PRICE_SCALE] * len(FUEL_PRICE_COLUMNS))
+        current = {(row[0], row[1]): int(row[2]) for row in cursor.fetchall()}
+
+        cursor.execute("SELECT id, station_id, fuel_id, price FROM price_intervals WHERE valid_to IS NULL")
+        open_intervals = {(row[1], row[2]): (row[0], row[3]) for row in cursor.fetchall()}
+
+        changes = []
+        closed = []
+        opened = []
+        for key, price in current.items():
+            interval = open_intervals.get(key)
+            if interval is None:
+                changes.append(key + (None, price))
+                opened.append(key + (price, observed_at))
+            elif interval[1] != price:
+                changes.append(key + (interval[1], price))
+                closed.append((observed_at, interval[0]))
+                opened.append(key + (price, observed_at))
+
+        for key, (interval_id, price) in open_intervals.items():
+            if key not in current:
+                changes.append(key + (price, None))
+                closed.append((observed_at, interval_id))
+
+        if closed:
+            cursor.executemany("UPDATE price_intervals SET valid_to = %s WHERE id = %s", closed)
+        if opened:
+            cursor.executemany(
+                "INSERT INTO price_intervals (station_id, fuel_id, price, valid_from) VALUES (%s, %s, %s, %s)",
+                opened
+            )
+        return changes
+
+    def last_change_id(self, cursor):
+        """Return the id of the newest price interval (0 when there is none)."""
+        cursor.execute("SELECT MAX(id) FROM price_intervals")
+        return cursor.fetchone()[0] or 0
+
+    def change_events(self, cursor, after_id, limit=5000):
+        """Return price-change events recorded after interval id ``after_id``.
+
+        Every opened interval is one event; interval ids only grow, so they
+        double as the event sequence other processes resume from. Events are
+        dicts with id, ideess, id_municipio, fuel_id, old_price, new_price
+        (euros, old_price None for a new station) and changed_at.
+        """
+        cursor.execute("""
+            SELECT i.id, s.ideess, e.id_municipio, i.fuel_id, p.price, i.price, i.valid_from
+            FROM price_intervals i
+            JOIN stations s ON s.station_id = i.station_id
+            LEFT JOIN estaciones_servicio e ON e.IDEESS = s.ideess
+            LEFT JOIN price_intervals p ON p.station_id = i.station_id
+                AND p.fuel_id = i.fuel_id AND p.valid_to = i.valid_from
+            WHERE i.id > %s
+            ORDER BY i.id
+            LIMIT %s
+        """, (after_id, limit))
+        return [
+            {
+                'id': row[0],
+                'ideess': row[1],
+                'id_municipio': row[2],
+                'fuel_id': row[3],
+                'old_price': from_price_units(row[4]) if row[4] is not None else None,
+                'new_price': from_price_units(row[5]),
+                'changed_at': row[6],
+            }
+            for row in cursor.fetchall()
+        ]
+
+    def meta_counter(self, cursor, name, default=None):
+        """Return a named counter from history_meta."""
+        cursor.execute("SELECT counter FROM history_meta WHERE name = %s", (name,))
+        row = cursor.fetchone()
+        return row[0] if row else default
+
+    def set_meta_counter(self, cursor, name, value):
+        """Store a named counter in history_meta."""
+        cursor.execute(self.backend.upsert_query('history_meta', ['name', 'counter'], ['name']), (name, value))
+
+    def add_meta_counter(self, cursor, name, amount):
+        """Add ``amount`` to a named counter in history_meta, creating it at zero."""
+        cursor.execute("UPDATE history_meta SET counter = counter + %s WHERE name = %s", (amount, name))
+        if cursor.rowcount <= 0:
+            self.set_meta_counter(cursor, name, amount)
+
+    def prices_at(self, cursor, fuel_id, moment):
+        """Return {IDEESS: price in euros} for one fuel as it was at ``moment``."""
+        cursor.execute("""
+            SELECT s.ideess, i.price
+            FROM price_intervals i
+            JOIN stations s ON s.station_id = i.station_id
+            WHERE i.fuel_id = %s AND i.valid_from <= %s AND (i.valid_to IS NULL OR i.valid_to > %s)
+        """, (fuel_id, moment, moment))
+        return {row[0]: from_price_units(row[1]) for row in cursor.fetchall()}
+
+    def changes_between(self, cursor, start, end):
+        """Return intervals that started in [start, end), oldest first."""
+        cursor.execute("""
+            SELECT i.id, s.ideess, i.fuel_id, i.price, i.valid_from, i.valid_to
+            FROM price_intervals i
+            JOIN stations s ON s.station_id = i.station_id
+            WHERE i.valid_from >= %s AND i.valid_from < %s
+            ORDER BY i.valid_from, i.id
+        """, (start, end))
+        return [
+            {
+                'id': row[0],
+                'ideess': row[1],
+                'fuel_id': row[2],
+                'price': from_price_units(row[3]),
+                'valid_from': row[4],
+                'valid_to': row[5]
+            }
+            for row in cursor.fetchall()
+        ]
+
+    def rollup_range(self, cursor, start_date, end_date):
+        """Recompute daily_price_stats for every day in [start_date, end_date].
+
+        Facts are grouped by the station version valid on each day, so the
+        municipality breakdown follows stations that changed municipality.
+        Returns the number of rollup rows written.
+        """
+        cursor.execute(f"""
+            SELECT p.date, p.fuel_id, v.municipio, p.price
+            FROM price_history p
+            LEFT JOIN station_versions v ON v.station_id = p.station_id
+                AND v.valid_from <= p.date AND (v.valid_to IS NULL OR v.valid_to > p.date)
+            WHERE p.fuel_id IN ({self._fuel_id_list()}) AND p.date >= %s AND p.date <= %s
+        """, (start_date, end_date))
+        facts = pd.DataFrame(cursor.fetchall(), columns=['date', 'fuel_id', 'municipio', 'price'])
+
+        cursor.execute(
+            "DELETE FROM daily_price_stats WHERE date >= %s AND date <= %s",
+            (start_date, end_date)
+        )
+        if facts.empty:
+            return 0
+
+        facts['price'] = facts['price'].astype(int)
+        rows = []
+        # Island-wide rows include stations without a known municipality
+        for frame in (facts.assign(municipio=ISLAND_WIDE), facts.dropna(subset=['municipio'])):
+            grouped = frame.groupby(['date', 'fuel_id', 'municipio'])['price']
+            summary = grouped.agg(['count', 'mean', 'min', 'max']).join(
+                grouped.quantile([0.1, 0.5, 0.9]).unstack()
+            )
+            for (date, fuel_id, municipio), values in zip(summary.index, summary.itertuples(index=False)):
+                # Plain Python types: neither driver accepts numpy scalars
+                rows.append((date, int(fuel_id), municipio) + tuple(int(round(value)) for value in values))
+
+        columns = ", ".join(DAILY_STATS_COLUMNS)
+        placeholders = ", ".join(["%s"] * len(DAILY_STATS_COLUMNS))
+        cursor.executemany(f"INSERT INTO daily_price_stats ({columns}) VALUES ({placeholders})", rows)
+        self.bump_version(cursor)
+        return len(rows)
+
+    def bump_version(self, cursor):
+        """Increment the history statistics version (part of every chart cache key)."""
+        query = self.backend.upsert_query(
+            'history_meta', ['name', 'counter'], ['name'], updates={'counter': 'counter + 1'}
+        )
+        cursor.execute(query, ('stats_version', 1))
+
+    def version(self, cursor):
+        """Return the current history statistics version."""
+        return self.meta_counter(cursor, 'stats_version', 0)
+
+    def oldest_fact_date(self, cursor):
+        """Return the oldest date in price_history, or None when empty."""
+        oldest = None
+        # One MIN per fuel is a single index probe on the (fuel_id, date, ...) key
+        for fuel_id in sorted(self.fuel_ids.values()):
+            cursor.execute("SELECT MIN(date) FROM price_history WHERE fuel_id = %s", (fuel_id,))
+            value = _parse_date(cursor.fetchone()[0])
+            if value is not None and (oldest is None or value < oldest):
+                oldest = value
+        return oldest
+
+    def retire_month(self, cursor, month):
+        """Downsample one month of daily facts into price_history_monthly, then remove them.
+
+        The month is dropped as a partition where the backend supports it and
+        deleted otherwise. Returns the number of daily facts retired.
+        """
+        next_month = add_months(month, 1)
+        range_filter = f"fuel_id IN ({self._fuel_id_list()}) AND date >= %s AND date < %s"
+
+        cursor.execute("DELETE FROM price_history_monthly WHERE month = %s", (month,))
+        cursor.execute(f"""
+            INSERT INTO price_history_monthly (month, station_id, fuel_id, days, avg_price, min_price, max_price)
+            SELECT %s, station_id, fuel_id, COUNT(*), ROUND(AVG(price)), MIN(price), MAX(price)
+            FROM price_history
+            WHERE {range_filter}
+            GROUP BY station_id, fuel_id
+        """, (month, month, next_month))
+
+        cursor.execute("SELECT COALESCE(SUM(days), 0) FROM price_history_monthly WHERE month = %s", (month,))
+        facts = int(cursor.fetchone()[0])
+
+        if not self.backend.drop_month_partition(cursor, 'price_history', month):
+            cursor.execute(f"DELETE FROM price_history WHERE {range_filter}", (month, next_month))
+        return facts
+
+    def prune_intervals(self, cursor, cutoff):
+        """Delete price intervals that ended before the cutoff. Returns rows deleted."""
+        cursor.execute(
+            "DELETE FROM price_intervals WHERE valid_to IS NOT NULL AND valid_to < %s",
+            (cutoff,)
+        )
+        return cursor.rowcount
+
+    def history_date_range(self, cursor):
+        """Return (first_date, last_date) of the fact table, or (None, None)."""
+        cursor.execute("SELECT MIN(date), MAX(date) FROM price_history")
+        first_date, last_date = cursor.fetchone()
+        return _parse_date(first_date), _parse_date(last_date)
+
+    def days_with_data(self, cursor, start_date):
+        """Return {fuel_id: number of days with island-wide statistics since start_date}."""
+        cursor.execute("""
+            SELECT fuel_id, COUNT(*) FROM daily_price_stats
+            WHERE municipio = %s AND date >= %s
+            GROUP BY fuel_id
+        """, (ISLAND_WIDE, start_date))
+        return {int(fuel_id): count for fuel_id, count in cursor.fetchall()}
+
+    def daily_series(self, cursor, fuel_id, start_date, end_date, municipio=ISLAND_WIDE):
+        """Return [(date, avg, min, max)] in euros for one fuel over a date range."""
+        cursor.execute("""
+            SELECT date, avg_price, min_price, max_price
+            FROM daily_price_stats
+            WHERE fuel_id = %s AND municipio = %s AND date >= %s AND date <= %s
+            ORDER BY date
+        """, (fuel_id, municipio, start_date, end_date))
+        return [
+            (row[0], from_price_units(row[1]), from_price_units(row[2]), from_price_units(row[3]))
+            for row in cursor.fetchall()
+        ]
+
+    def top_members(self, cursor, dimension, limit):
+        """Return the municipalities or brands with the most current stations."""
+        if dimension not in ('municipio', 'rotulo'):
+            raise ValueError(f"Unknown station dimension: {dimension}")
+        cursor.execute(f"""
+            SELECT {dimension}, COUNT(*) AS stations
+            FROM station_versions
+            WHERE valid_to IS NULL AND {dimension} IS NOT NULL AND {dimension} <> ''
+            GROUP BY {dimension}
+            ORDER BY stations DESC, {dimension}
+            LIMIT %s
+        """, (limit,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def comparison_series(self, cursor, dimension, members, start_date, end_date, fuel_id=None):
+        """Return (dates, matrix) of daily average prices for several series.
+
+        ``dimension`` is 'municipio' or 'rotulo' (members are names, for one
+        ``fuel_id``) or 'fuel' (members are fuel ids, island-wide). Every
+        chart is a single aggregated query, pivoted by pivot_series.
+        """
+        if not members:
+            return [], np.empty((0, 0))
+        placeholders = ", ".join(["%s"] * len(members))
+
+        if dimension == 'municipio':
+            # Rollup primary key (fuel_id, municipio, date)
+            cursor.execute(f"""
+                SELECT date, municipio, avg_price
+                FROM daily_price_stats
+                WHERE fuel_id = %s AND municipio IN ({placeholders}) AND date >= %s AND date <= %s
+            """, (fuel_id, *members, start_date, end_date))
+        elif dimension == 'fuel':
+            cursor.execute(f"""
+                SELECT date, fuel_id, avg_price
+                FROM daily_price_stats
+                WHERE fuel_id IN ({placeholders}) AND municipio = %s AND date >= %s AND date <= %s
+            """, (*members, ISLAND_WIDE, start_date, end_date))
+        elif dimension == 'rotulo':
+            # Brands are not rolled up: range scan on the (fuel_id, date, station_id)
+            # fact key, joined to the station version valid on each day
+            cursor.execute(f"""
+                SELECT p.date, v.rotulo, AVG(p.price)
+                FROM price_history p
+                JOIN station_versions v ON v.station_id = p.station_id
+                    AND v.valid_from <= p.date AND (v.valid_to IS NULL OR v.valid_to > p.date)
+                WHERE p.fuel_id = %s AND p.date >= %s AND p.date <= %s
+                AND v.rotulo IN ({placeholders})
+                GROUP BY p.date, v.rotulo
+            """, (fuel_id, start_date, end_date, *members))
+        else:
+            raise ValueError(f"Unknown comparison dimension: {dimension}")
+
+        return pivot_series(cursor.fetchall(), members)
+
+    def latest_station_prices(self, cursor, fuel_id):
+        """Return (date, [(latitud, longitud, price)]) for the latest snapshot of one fuel."""
+        cursor.execute("SELECT MAX(date) FROM price_history WHERE fuel_id = %s", (fuel_id,))
+        date = _parse_date(cursor.fetchone()[0])
+        if date is None:
+            return None, []
+
+        cursor.execute("""
+            SELECT v.latitud, v.longitud_wgs84, p.price
+            FROM price_history p
+            JOIN station_versions v ON v.station_id = p.station_id
+                AND v.valid_from <= p.date AND (v.valid_to IS NULL OR v.valid_to > p.date)
+            WHERE p.fuel_id = %s AND p.date = %s
+            AND v.latitud IS NOT NULL AND v.longitud_wgs84 IS NOT NULL
+        """, (fuel_id, date))
+        return date, [
+            (float(latitud), float(longitud), from_price_units(price))
+            for latitud, longitud, price in cursor.fetchall()
+        ]
+
+    def migrate_legacy(self, connection, drop_legacy=False):
+        """Copy the wide historical_prices table into the normalized model.
+
+        Works one day at a time and commits after each, skipping days that
+        already have facts, so an interrupted migration can simply be rerun.
+        Station versions are rebuilt from the whole legacy table on every run
+        and only fill the period before the first version the live snapshot
+        job already wrote.
+        """
+        cursor = connection.cursor()
+        stats = {'days': 0, 'skipped_days': 0, 'facts': 0, 'versions': 0}
+
+        try:
+            if not self.backend.table_exists(cursor, 'historical_prices'):
+                print("No legacy historical_prices table found, nothing to migrate")
+                return stats
+
+            self.seed_fuels(cursor)
+            self._register_stations(cursor, 'historical_prices', 'ideess')
+            connection.commit()
+            station_ids = self._station_ids(cursor)
+
+            # First version already written by the live snapshot path, per station
+            cursor.execute("SELECT station_id, MIN(valid_from) FROM station_versions GROUP BY station_id")
+            first_live_version = {
+                station_id: _parse_date(valid_from) for station_id, valid_from in cursor.fetchall()
+            }
+
+            cursor.execute("SELECT DISTINCT date FROM historical_prices ORDER BY date")
+            dates = [row[0] for row in cursor.fetchall()]
+
+            legacy_versions = {}
+            select_columns = ['ideess'] + STATION_ATTRIBUTES + LEGACY_FUEL_COLUMNS
+            fuel_offset = 1 + len(STATION_ATTRIBUTES)
+
+            for date in dates:
+                cursor.execute(
+                    f"SELECT {', '.join(select_columns)} FROM historical_prices WHERE date = %s",
+                    (date,)
+                )
+                rows = cursor.fetchall()
+
+                facts = []
+                for row in rows:
+                    station_id = station_ids.get(row[0])
+                    if station_id is None:
+                        continue
+
+                    attributes = _normalize_attributes(row[1:fuel_offset])
+                    versions = legacy_versions.setdefault(station_id, [])
+                    if not versions or versions[-1][1] != attributes:
+                        versions.append((date, attributes))
+
+                    for column, price in zip(LEGACY_FUEL_COLUMNS, row[fuel_offset:]):
+                        if price is not None and price > 0:
+                            facts.append((date, station_id, self.fuel_ids[column], to_price_units(price)))
+
+                if self.has_snapshot(cursor, date):
+                    stats['skipped_days'] += 1
+                    continue
+
+                if facts:
+                    cursor.executemany(
+                        "INSERT INTO price_history (date, station_id, fuel_id, price) VALUES (%s, %s, %s, %s)",
+                        facts
+                    )
+                connection.commit()
+                stats['days'] += 1
+                stats['facts'] += len(facts)
+
+            stats['versions'] = self._write_legacy_versions(cursor, legacy_versions, first_live_version)
+            connection.commit()
+
+            if drop_legacy:
+                cursor.execute("DROP TABLE historical_prices")
+                connection.commit()
+                print("Legacy historical_prices table dropped")
+
+            return stats
+
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def _write_legacy_versions(self, cursor, legacy_versions, first_live_version):
+        columns = ['station_id', 'valid_from', 'valid_to'] + STATION_ATTRIBUTES
+        query = self.backend.upsert_query('station_versions', columns, ['station_id', 'valid_from'])
+
+        rows = []
+        for station_id, versions in legacy_versions.items():
+            cutoff = first_live_version.get(station_id)
+            if cutoff is not None:
+                versions = [version for version in versions if version[0] < cutoff]
+
+            for index, (valid_from, attributes) in enumerate(versions):
+                valid_to = versions[index + 1][0] if index + 1 < len(versions) else cutoff
+                rows.append((station_id, valid_from, valid_to) + attributes)
+
+        if rows:
+            cursor.executemany(query, rows)
+        return len(rows)
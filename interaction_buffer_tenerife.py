@@ -0,0 +1,129 @@
+import asyncio
+import datetime
+import logging
+from async_db_tenerife import async_data_manager
+
+logger = logging.getLogger(__name__)
+
+class InteractionBuffer:
+    """Write-behind buffer for bot_users tracking.
+
+    Updates are coalesced in memory per user_id (interaction count, latest
+    profile fields, last_seen) and flushed periodically with one multi-row
+    upsert, so handlers never wait for a tracking write.
+    """
+
+    def __init__(self, flush_interval=5, max_pending_users=10000):
+        self.flush_interval = flush_interval
+        self.max_pending_users = max_pending_users
+        self._pending = {}
+        self._task = None
+        self._flush_requested = None
+        self._flush_lock = None
+        self.stats = {
+            'recorded': 0,
+            'flushed_rows': 0,
+            'flushes': 0,
+            'failed_flushes': 0,
+            # Interactions (not users) lost to the size bound, like 'recorded'
+            'dropped': 0
+        }
+
+    def record(self, user_id, username=None, first_name=None, last_name=None, language_code=None):
+        """Record one interaction without touching the database."""
+        entry = self._pending.get(user_id)
+        if entry is None:
+            if len(self._pending) >= self.max_pending_users:
+                # Queue is full: drop this one interaction rather than grow without bound
+                self.stats['dropped'] += 1
+                self._request_flush()
+                return
+            entry = {'user_id': user_id, 'count': 0}
+            self._pending[user_id] = entry
+
+        entry.update({
+            'username': username,
+            'first_name': first_name,
+            'last_name': last_name,
+            'language_code': language_code,
+            'last_seen': datetime.datetime.now()
+        })
+        entry['count'] += 1
+        self.stats['recorded'] += 1
+
+        if len(self._pending) >= self.max_pending_users // 2:
+            self._request_flush()
+
+    def pending_count(self):
+        """Number of users waiting to be flushed."""
+        return len(self._pending)
+
+    def _request_flush(self):
+        if self._flush_requested is not None:
+            self._flush_requested.set()
+
+    def start(self):
+        """Start the periodic flush task on the running event loop."""
+        if self._task is None or self._task.done():
+            self._flush_requested = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush task and write out everything still buffered."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write all buffered interactions with a single batched upsert."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+
+            batch = self._pending
+            self._pending = {}
+
+            try:
+                written = await async_data_manager.track_user_interactions_batch(list(batch.values()))
+                self.stats['flushes'] += 1
+                self.stats['flushed_rows'] += written
+                return written
+            except Exception as e:
+                self.stats['failed_flushes'] += 1
+                logger.error(f"Error flushing {len(batch)} user interactions: {e}")
+                self._requeue(batch)
+                return 0
+
+    def _requeue(self, batch):
+        """Merge a failed batch back into the buffer, respecting the size bound."""
+        for user_id, entry in batch.items():
+            current = self._pending.get(user_id)
+            if current is not None:
+                # Newer profile data wins, counts add up
+                current['count'] += entry['count']
+            elif len(self._pending) < self.max_pending_users:
+                self._pending[user_id] = entry
+            else:
+                # Every interaction coalesced into the entry is lost
+                self.stats['dropped'] += entry['count']
+
+# Create global instance
+interaction_buffer = InteractionBuffer()
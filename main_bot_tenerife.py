@@ -4,7 +4,14 @@ from telegram.ext import (Application, CommandHandler, ConversationHandler, Call
 from telegram import (InlineKeyboardMarkup, InlineKeyboardButton, Update, InlineQueryResultArticle, 
                      InputTextMessageContent, KeyboardButton, ReplyKeyboardMarkup)
 from telegram.constants import ParseMode
-from data_manager_tenerife import tenerife_data_manager
+from data_manager_tenerife import tenerife_data_manager, MAP_DAYS
+from async_db_tenerife import async_data_manager, event_loop_monitor
+from interaction_buffer_tenerife import interaction_buffer
+from telegram_file_ids_tenerife import chart_file_ids
+from chart_renderer_tenerife import ChartRendererBusy
+from telegram_sender_tenerife import telegram_sender
+from alerts_tenerife import ALERT_PERSISTENT, ALERT_DISARMED
+from alert_delivery_tenerife import deliver_alert_outbox
 import logging
 import sys
 import secret
@@ -57,72 +64,34 @@ def escape_html(text):
         return "Unknown"
     return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
 
+async def process_price_events(application):
+    """Evaluate alerts on the price changes recorded since the last run and send the triggered ones."""
+    try:
+        # Triggered alerts are queued in the outbox by the event subscriber
+        event_count = await async_data_manager.consume_price_events()
+        if event_count:
+            logger.info(f"🔔 {event_count} price changes processed")
+        await deliver_alert_outbox(application.bot)
+        
+    except Exception as e:
+        logger.error(f"Error processing price change events: {e}")
+
 async def check_and_send_alerts(application):
-    """Periodic function to check for price alerts and send notifications."""
+    """Safety net: check every active alert, in case a price-change event was missed."""
     try:
         logger.info("🔔 Checking for price alerts...")
         
-        # Get notifications that need to be sent
-        notifications = tenerife_data_manager.check_price_alerts()
+        # Pick up alerts created or deleted outside this process first
+        await async_data_manager.refresh_alert_index()
+        notifications = await async_data_manager.check_price_alerts()
         
-        if not notifications:
+        queued = await async_data_manager.enqueue_alert_notifications(notifications)
+        if notifications:
+            logger.info(f"🚨 Found {len(notifications)} triggered price alerts ({queued} newly queued)")
+        else:
             logger.info("✅ No price alerts triggered at this time.")
-            return
-        
-        logger.info(f"🚨 Found {len(notifications)} price alerts to send!")
         
-        sent_count = 0
-        error_count = 0
-        
-        for notification in notifications:
-            try:
-                # Format the alert message
-                fuel_display = FUEL_TYPES.get(notification['fuel_type'], {}).get('display', notification['fuel_type'])
-                
-                alert_message = f"🚨 **¡ALERTA DE PRECIO!**\n\n"
-                alert_message += f"⛽ **{fuel_display}:** {notification['current_price']}€\n"
-                alert_message += f"💰 **Tu límite:** ≤ {notification['threshold']}€\n"
-                alert_message += f"📍 **Ubicación:** {notification['municipality']}\n\n"
-                alert_message += f"🏪 **Estación:** {notification['station_name']}\n"
-                if notification['station_address']:
-                    alert_message += f"📍 {notification['station_address']}\n\n"
-                alert_message += f"💡 ¡Precio por debajo de tu alerta!"
-                
-                # Create navigation keyboard
-                alert_keyboard = InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🏠 Menú Principal", callback_data=str(INICI))],
-                    [InlineKeyboardButton("📋 Mis Alertas", callback_data=str(ALERTS))]
-                ])
-                
-                # Send the notification with navigation buttons
-                await application.bot.send_message(
-                    chat_id=notification['user_id'],
-                    text=alert_message,
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=alert_keyboard
-                )
-                
-                # Successfully sent notification - now delete the alert to prevent spam
-                alert_deleted = tenerife_data_manager.delete_alert(
-                    notification['user_id'], 
-                    notification['alert_id']
-                )
-                
-                if alert_deleted:
-                    logger.info(f"   ✅ Sent alert to user {notification['user_id']} - {fuel_display}: {notification['current_price']}€ (alert deleted)")
-                else:
-                    logger.warning(f"   ⚠️ Alert sent but failed to delete alert ID {notification['alert_id']}")
-                
-                sent_count += 1
-                
-                # Small delay to avoid rate limiting
-                await asyncio.sleep(0.1)
-                
-            except Exception as e:
-                error_count += 1
-                logger.error(f"Failed to send alert to user {notification['user_id']}: {e}")
-        
-        logger.info(f"📊 Alert Summary - Sent: {sent_count}, Failed: {error_count}, Total: {len(notifications)}")
+        await deliver_alert_outbox(application.bot)
         
     except Exception as e:
         logger.error(f"Error in periodic alert checking: {e}")
@@ -131,7 +100,7 @@ def error_handler(func):
     @wraps(func)
     async def wrapper(update: Update, context: CallbackContext, *args, **kwargs):
         try:
-            # Track user interaction
+            # Track user interaction (buffered, flushed in the background)
             track_user_from_update(update)
             return await func(update, context, *args, **kwargs)
         except Exception as e:
@@ -147,7 +116,7 @@ def error_handler(func):
     return wrapper
 
 def track_user_from_update(update: Update):
-    """Extract user info from update and track interaction."""
+    """Extract user info from update and buffer the interaction."""
     try:
         user = None
         if update.message:
@@ -158,7 +127,7 @@ def track_user_from_update(update: Update):
             user = update.inline_query.from_user
             
         if user:
-            tenerife_data_manager.track_user_interaction(
+            interaction_buffer.record(
                 user_id=user.id,
                 username=user.username,
                 first_name=user.first_name,
@@ -257,9 +226,9 @@ def get_municipality_buttons(page=1):
     
     return buttons
 
-def get_fuel_buttons(page=1, per_page=10):
+async def get_fuel_buttons(page=1, per_page=10):
     """Get fuel type buttons ordered by popularity."""
-    available_fuels = tenerife_data_manager.get_available_fuel_types()
+    available_fuels = await async_data_manager.get_available_fuel_types()
     
     start_idx = (page - 1) * per_page
     end_idx = start_idx + per_page
@@ -408,7 +377,7 @@ async def cheapest_stations(update: Update, context: CallbackContext):
     await query.answer()
     
     # Get 5 cheapest stations for Gasolina 95 E5
-    cheap_stations = tenerife_data_manager.get_stations_by_fuel_ascending('GASOLINA_95_E5', limit=5)
+    cheap_stations = await async_data_manager.get_stations_by_fuel_ascending('GASOLINA_95_E5', limit=5)
     
     if cheap_stations.empty:
         message = M_NO_RESULTS
@@ -435,7 +404,7 @@ async def most_expensive_stations(update: Update, context: CallbackContext):
     await query.answer()
     
     # Get 5 most expensive stations for Gasolina 95 E5
-    expensive_stations = tenerife_data_manager.get_stations_by_fuel_descending('GASOLINA_95_E5', limit=5)
+    expensive_stations = await async_data_manager.get_stations_by_fuel_descending('GASOLINA_95_E5', limit=5)
     
     if expensive_stations.empty:
         message = M_NO_RESULTS
@@ -461,7 +430,7 @@ async def fuel_type_menu(update: Update, context: CallbackContext):
     query = update.callback_query
     await query.answer()
     
-    fuel_buttons = get_fuel_buttons(page=1)
+    fuel_buttons = await get_fuel_buttons(page=1)
     
     await query.edit_message_text(
         text=M_FUEL_SELECT, parse_mode=ParseMode.MARKDOWN,
@@ -477,7 +446,7 @@ async def fuel_page_handler(update: Update, context: CallbackContext):
     # Extract page number from callback data (fuelpage_X)
     page = int(query.data.split('_')[1])
     
-    fuel_buttons = get_fuel_buttons(page=page)
+    fuel_buttons = await get_fuel_buttons(page=page)
     
     await query.edit_message_text(
         text=M_FUEL_SELECT, parse_mode=ParseMode.MARKDOWN,
@@ -628,7 +597,7 @@ async def municipality_info(update: Update, context: CallbackContext):
     context.user_data['result_page'] = 0
     
     # Get first page of results
-    stations_data, total_count = tenerife_data_manager.get_stations_by_municipality(
+    stations_data, total_count = await async_data_manager.get_stations_by_municipality(
         municipality_key, offset=0, limit=RESULTS_PER_PAGE
     )
     
@@ -703,7 +672,7 @@ async def result_pagination_handler(update: Update, context: CallbackContext):
     offset = new_page * RESULTS_PER_PAGE
     
     # Get stations for new page
-    stations_data, total_count = tenerife_data_manager.get_stations_by_municipality(
+    stations_data, total_count = await async_data_manager.get_stations_by_municipality(
         municipality_key, offset=offset, limit=RESULTS_PER_PAGE
     )
     
@@ -755,7 +724,7 @@ async def fuel_info(update: Update, context: CallbackContext):
     fuel_type = query.data.replace(f'{FUEL_PREFIX}', '')
     
     # Get 5 cheapest stations for this fuel type
-    cheap_stations = tenerife_data_manager.get_stations_by_fuel_ascending(fuel_type, limit=5)
+    cheap_stations = await async_data_manager.get_stations_by_fuel_ascending(fuel_type, limit=5)
     
     if cheap_stations.empty:
         message = f"No hay datos disponibles para {FUEL_TYPES.get(fuel_type, {}).get('display', fuel_type)}"
@@ -786,11 +755,12 @@ async def info(update: Update, context: CallbackContext):
     query = update.callback_query
     await query.answer()
     
+    last_update = await async_data_manager.get_last_update_time()
     info_message = (
         "Datos extraídos del *Ministerio de Industria, Comercio y Turismo*.\n\n"
         "Se ha comprobado que algunas ubicaciones pueden no ser completamente precisas.\n"
         "Los errores han sido notificados.\n\n"
-        f"*Última actualización:* {tenerife_data_manager.get_last_update_time()}\n\n"
+        f"*Última actualización:* {last_update}\n\n"
         "Bot desarrollado para Tenerife.\n"
         "Código disponible en [GitHub](https://github.com/Damiasroca/Bot_Tenerife_EESS)"
     )
@@ -832,6 +802,8 @@ async def location_search(update: Update, context: CallbackContext):
 @error_handler
 async def handle_location(update: Update, context: CallbackContext):
     user_location = update.message.location
+    # Kept so a location alert can be created around it
+    context.user_data['alert_location'] = [user_location.latitude, user_location.longitude]
     
     # Remove keyboard and show searching message with navigation
     await update.message.reply_text(
@@ -843,7 +815,7 @@ async def handle_location(update: Update, context: CallbackContext):
     
     # Find nearby stations within a 10km radius.
     # The data manager sorts them by price ascending.
-    nearby_stations = tenerife_data_manager.find_stations_near_location(
+    nearby_stations = await async_data_manager.find_stations_near_location(
         user_location.latitude, user_location.longitude, radius_km=10
     )
     
@@ -863,7 +835,10 @@ async def handle_location(update: Update, context: CallbackContext):
             messages.append(station_msg)
         
         message = "\n\n".join(messages)
-        buttons = [[InlineKeyboardButton(B5, callback_data=str(INICI))]]
+        buttons = [
+            [InlineKeyboardButton(B_ALERT_LOCATION, callback_data=ALERT_LOCATION)],
+            [InlineKeyboardButton(B5, callback_data=str(INICI))]
+        ]
     
     await update.message.reply_text(
         message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True,
@@ -927,99 +902,126 @@ async def charts_menu(update: Update, context: CallbackContext):
     query = update.callback_query
     await query.answer()
     
-    # Get top fuel types for charts
-    fuel_buttons = []
-    top_fuels = [
-        ('GASOLINA_95_E5', '🟢 Gasolina 95 E5'),
-        ('GASOLEO_A', '⚫️ Gasóleo A'),
-        ('GASOLINA_98_E5', '🔵 Gasolina 98 E5'),
-        ('GASOLEO_PREMIUM', '🟠 Gasóleo Premium'),
-        ('GLP', '⚪️ GLP'),
-        ('GASOLEO_B', '🟤 Gasóleo B')
-    ]
+    # Offer every fuel type that has enough history to draw a chart
+    chart_fuels = await async_data_manager.get_chart_fuel_types()
     
-    for fuel_key, fuel_display in top_fuels:
+    fuel_buttons = []
+    for fuel in chart_fuels:
         # Create buttons for different time periods
         fuel_buttons.append([
             InlineKeyboardButton(
-                f"{fuel_display} (7 días)",
-                callback_data=f"{CHART_PREFIX}{fuel_key}_7"
+                f"{fuel['button']} (7 días)",
+                callback_data=f"{CHART_PREFIX}{fuel['key']}_7"
             ),
             InlineKeyboardButton(
-                f"{fuel_display} (30 días)",
-                callback_data=f"{CHART_PREFIX}{fuel_key}_30"
-            )
+                f"{fuel['button']} (30 días)",
+                callback_data=f"{CHART_PREFIX}{fuel['key']}_30"
+            ),
+            InlineKeyboardButton("🗺️ Mapa", callback_data=f"{MAP_PREFIX}{fuel['key']}")
         ])
     
+    # All chartable fuels overlaid in one chart
+    if len(chart_fuels) >= 2:
+        fuel_buttons.append([InlineKeyboardButton(
+            "⛽ Comparar combustibles (30 días)",
+            callback_data=f"{COMPARE_PREFIX}fuel_ALL_30"
+        )])
+    
     # Add back button
     fuel_buttons.append([InlineKeyboardButton(B5, callback_data=str(INICI))])
     
+    chart_text = M_CHART_SELECT
+    if not chart_fuels:
+        chart_text += f"\n\n{M_CHART_NO_HISTORY}"
+    
     await query.edit_message_text(
-        text=M_CHART_SELECT,
+        text=chart_text,
         parse_mode=ParseMode.MARKDOWN,
         reply_markup=InlineKeyboardMarkup(fuel_buttons)
     )
     return NIVELL2
 
-@error_handler
-async def generate_chart(update: Update, context: CallbackContext):
-    """Generate and send price evolution chart."""
+async def deliver_chart(update: Update, context: CallbackContext, chart_key, days, caption, fetch_image, reply_markup, no_data_text):
+    """Send a chart as a photo, reusing Telegram's file_id when it was uploaded before.
+
+    `fetch_image(version)` returns the image bytes (from the chart cache, or
+    rendered on a miss) and is only awaited when no file_id is known. When the
+    button was on a previous chart photo, that photo is kept and any status
+    text is sent as a new message.
+    """
     query = update.callback_query
-    await query.answer()
+    from_photo = bool(query.message.photo)
     
-    # Parse callback data: chart_FUEL_TYPE_DAYS
-    callback_parts = query.data.split('_')
-    if len(callback_parts) < 3:
-        await query.answer("Error en los datos del gráfico.")
-        return NIVELL1
-    
-    fuel_type = '_'.join(callback_parts[1:-1])  # Handle fuel types with underscores
-    days = int(callback_parts[-1])
+    async def show_status(text, reply_markup):
+        if from_photo:
+            await context.bot.send_message(chat_id=query.message.chat_id, text=text, reply_markup=reply_markup)
+        else:
+            await query.edit_message_text(text, reply_markup=reply_markup)
     
     # Show loading message with navigation
-    await query.edit_message_text(
-        "📊 Generando gráfico... Por favor espera.",
-        reply_markup=InlineKeyboardMarkup([[
-            InlineKeyboardButton(B5, callback_data=str(CHARTS))
-        ]])
-    )
+    if not from_photo:
+        await query.edit_message_text(
+            "📊 Generando gráfico... Por favor espera.",
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton(B5, callback_data=str(CHARTS))
+            ]])
+        )
     
     try:
-        # Generate chart using data manager
-        chart_path = tenerife_data_manager.generate_price_chart(fuel_type, days)
+        version = await async_data_manager.get_chart_version()
         
-        if chart_path and os.path.exists(chart_path):
-            # Send chart as photo with navigation buttons
-            chart_buttons = InlineKeyboardMarkup([
-                [InlineKeyboardButton("🏠 Menú Principal", callback_data=str(INICI))]
-            ])
-            
-            with open(chart_path, 'rb') as chart_file:
+        # Resend an already uploaded chart by its Telegram file_id
+        file_id = chart_file_ids.get(chart_key, days, version)
+        if file_id:
+            try:
                 await context.bot.send_photo(
                     chat_id=query.message.chat_id,
-                    photo=chart_file,
-                    caption=f"📊 Evolución de precios - {FUEL_TYPES.get(fuel_type, {}).get('display', fuel_type)} ({days} días)",
-                    reply_markup=chart_buttons
+                    photo=file_id,
+                    caption=caption,
+                    reply_markup=reply_markup
                 )
+                chart_file_ids.record_reuse()
+                if not from_photo:
+                    await query.delete_message()
+                return NIVELL2
+            except telegram.error.BadRequest as e:
+                logger.warning(f"Stored file_id rejected for {chart_key} {days}d, uploading again: {e}")
+                chart_file_ids.invalidate(chart_key, days, version)
+        
+        chart_image = await fetch_image(version)
+        
+        if chart_image:
+            # Send chart as photo with navigation buttons
+            message = await context.bot.send_photo(
+                chat_id=query.message.chat_id,
+                photo=chart_image,
+                caption=caption,
+                reply_markup=reply_markup
+            )
+            if message.photo:
+                chart_file_ids.set(chart_key, days, version, message.photo[-1].file_id)
             
-            # Clean up chart file
-            try:
-                os.remove(chart_path)
-            except:
-                pass
-            
-            await query.delete_message()
+            if not from_photo:
+                await query.delete_message()
         else:
-            await query.edit_message_text(
-                "❌ No hay suficientes datos históricos para generar el gráfico.",
+            await show_status(
+                no_data_text,
                 reply_markup=InlineKeyboardMarkup([[
                     InlineKeyboardButton("🏠 Menú Principal", callback_data=str(INICI))
                 ]])
             )
     
+    except ChartRendererBusy:
+        await show_status(
+            M_CHART_BUSY,
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton(B5, callback_data=str(CHARTS))
+            ]])
+        )
+    
     except Exception as e:
         logger.error(f"Error generating chart: {e}")
-        await query.edit_message_text(
+        await show_status(
             "❌ Error al generar el gráfico. Inténtalo más tarde.",
             reply_markup=InlineKeyboardMarkup([[
                 InlineKeyboardButton("🏠 Menú Principal", callback_data=str(INICI))
@@ -1028,6 +1030,95 @@ async def generate_chart(update: Update, context: CallbackContext):
     
     return NIVELL2
 
+@error_handler
+async def generate_chart(update: Update, context: CallbackContext):
+    """Generate and send price evolution chart."""
+    query = update.callback_query
+    await query.answer()
+    
+    # Parse callback data: chart_FUEL_TYPE_DAYS
+    callback_parts = query.data.split('_')
+    if len(callback_parts) < 3:
+        await query.answer("Error en los datos del gráfico.")
+        return NIVELL1
+    
+    fuel_type = '_'.join(callback_parts[1:-1])  # Handle fuel types with underscores
+    days = int(callback_parts[-1])
+    
+    chart_buttons = InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("🏙️ Por municipio", callback_data=f"{COMPARE_PREFIX}municipio_{fuel_type}_{days}"),
+            InlineKeyboardButton("🏷️ Por marca", callback_data=f"{COMPARE_PREFIX}rotulo_{fuel_type}_{days}")
+        ],
+        [InlineKeyboardButton("🏠 Menú Principal", callback_data=str(INICI))]
+    ])
+    
+    return await deliver_chart(
+        update, context, fuel_type, days,
+        caption=f"📊 Evolución de precios - {FUEL_TYPES.get(fuel_type, {}).get('display', fuel_type)} ({days} días)",
+        fetch_image=lambda version: async_data_manager.get_price_chart(fuel_type, days, version),
+        reply_markup=chart_buttons,
+        no_data_text="❌ No hay suficientes datos históricos para generar el gráfico."
+    )
+
+@error_handler
+async def generate_comparison_chart(update: Update, context: CallbackContext):
+    """Generate and send a chart comparing municipalities, brands or fuels."""
+    query = update.callback_query
+    await query.answer()
+    
+    # Parse callback data: cmp_DIMENSION_FUEL_TYPE_DAYS (FUEL_TYPE is ALL for fuels)
+    callback_parts = query.data.split('_')
+    if len(callback_parts) < 4:
+        await query.answer("Error en los datos del gráfico.")
+        return NIVELL1
+    
+    dimension = callback_parts[1]
+    fuel_type = '_'.join(callback_parts[2:-1])
+    fuel_type = None if fuel_type == 'ALL' else fuel_type
+    days = int(callback_parts[-1])
+    
+    fuel_display = FUEL_TYPES.get(fuel_type, {}).get('display', fuel_type)
+    captions = {
+        'municipio': f"🏙️ {fuel_display} por municipio ({days} días)",
+        'rotulo': f"🏷️ {fuel_display} por marca ({days} días)",
+        'fuel': f"⛽ Comparativa de combustibles ({days} días)",
+    }
+    if dimension not in captions:
+        await query.answer("Error en los datos del gráfico.")
+        return NIVELL1
+    
+    return await deliver_chart(
+        update, context, tenerife_data_manager.comparison_chart_key(dimension, fuel_type), days,
+        caption=captions[dimension],
+        fetch_image=lambda version: async_data_manager.get_comparison_chart(dimension, fuel_type, days, version),
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🏠 Menú Principal", callback_data=str(INICI))]
+        ]),
+        no_data_text=M_CHART_NO_COMPARISON
+    )
+
+@error_handler
+async def show_price_map(update: Update, context: CallbackContext):
+    """Send the pre-rendered price map of the island for a fuel type."""
+    query = update.callback_query
+    await query.answer()
+    
+    # Parse callback data: map_FUEL_TYPE
+    fuel_type = query.data[len(MAP_PREFIX):]
+    fuel_display = FUEL_TYPES.get(fuel_type, {}).get('display', fuel_type)
+    
+    return await deliver_chart(
+        update, context, tenerife_data_manager.map_chart_key(fuel_type), MAP_DAYS,
+        caption=f"🗺️ Mapa de precios - {fuel_display}",
+        # Cache only: maps are drawn by the background pre-warm
+        fetch_image=lambda version: async_data_manager.get_price_map(fuel_type, version),
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🏠 Menú Principal", callback_data=str(INICI))]
+        ]),
+        no_data_text=M_MAP_NOT_READY
+    )
+
 # Admin Commands System
 ADMIN_USER_IDS = secret.secret.get('admin_user_ids', [])  # Read admin IDs from secret.py
 
@@ -1054,7 +1145,7 @@ def admin_required(func):
 async def admin_stats(update: Update, context: CallbackContext):
     """Admin command to show bot usage statistics."""
     try:
-        stats = tenerife_data_manager.get_admin_statistics()
+        stats = await async_data_manager.get_admin_statistics()
         
         stats_msg = "📊 **Admin Dashboard - Bot Statistics**\n\n"
         stats_msg += f"👥 **Users:**\n"
@@ -1099,7 +1190,7 @@ async def admin_users(update: Update, context: CallbackContext):
         limit = int(args[0]) if args and args[0].isdigit() else 20
         limit = min(limit, 100)  # Max 100 users
         
-        users = tenerife_data_manager.get_recent_users(limit=limit)
+        users = await async_data_manager.get_recent_users(limit=limit)
         
         users_msg = f"👥 <b>Recent Users (last {limit})</b>\n\n"
         
@@ -1143,7 +1234,7 @@ async def admin_user_info(update: Update, context: CallbackContext):
             return
         
         user_id = int(args[0])
-        user_info = tenerife_data_manager.get_user_details(user_id)
+        user_info = await async_data_manager.get_user_details(user_id)
         
         if not user_info:
             await update.message.reply_text(
@@ -1228,7 +1319,7 @@ async def admin_broadcast(update: Update, context: CallbackContext):
 async def admin_data_status(update: Update, context: CallbackContext):
     """Admin command to check data and system status."""
     try:
-        status = tenerife_data_manager.check_historical_data_status()
+        status = await async_data_manager.check_historical_data_status()
         
         status_msg = f"🔧 **System Status**\n\n"
         status_msg += f"**Database:**\n"
@@ -1251,6 +1342,50 @@ async def admin_data_status(update: Update, context: CallbackContext):
             status_msg += f"❌ Charts need more data (minimum 2 days)\n"
             status_msg += f"💡 Use: `/admin_create_historical` to fix\n"
         
+        pool_stats = tenerife_data_manager.get_pool_statistics()
+        if pool_stats:
+            status_msg += f"\n**Connection pool:**\n"
+            status_msg += f"• In use: {pool_stats['checked_out']} / {pool_stats['pool_size'] + pool_stats['max_overflow']}\n"
+            status_msg += f"• Checkouts: {pool_stats['checkouts']} ({pool_stats['checkout_errors']} errors)\n"
+            status_msg += f"• Wait: avg {pool_stats['avg_wait_ms']:.1f} ms, max {pool_stats['max_wait_ms']:.1f} ms\n"
+        
+        buffer_stats = interaction_buffer.stats
+        status_msg += f"\n**User tracking buffer:**\n"
+        status_msg += f"• Pending users: {interaction_buffer.pending_count()}\n"
+        status_msg += f"• Flushed: {buffer_stats['flushed_rows']} rows in {buffer_stats['flushes']} batches ({buffer_stats['recorded']} interactions)\n"
+        status_msg += f"• Failed flushes: {buffer_stats['failed_flushes']}, dropped interactions: {buffer_stats['dropped']}\n"
+        
+        lag_stats = event_loop_monitor.get_statistics()
+        if lag_stats:
+            status_msg += f"\n**Event loop lag:**\n"
+            status_msg += f"• Avg: {lag_stats['avg_ms']:.1f} ms, p95: {lag_stats['p95_ms']:.1f} ms\n"
+            status_msg += f"• Max (window): {lag_stats['max_window_ms']:.1f} ms, max (since start): {lag_stats['max_ms']:.1f} ms\n"
+
+        cache_stats = tenerife_data_manager.chart_cache.get_statistics()
+        status_msg += f"\n**Chart cache:**\n"
+        status_msg += f"• Hits: {cache_stats['memory_hits']} memory, {cache_stats['disk_hits']} disk\n"
+        status_msg += f"• Misses: {cache_stats['misses']}, stored: {cache_stats['stores']}, in memory: {cache_stats['memory_items']}\n"
+        file_id_stats = chart_file_ids.stats
+        status_msg += f"• Telegram file_ids: {file_id_stats['reused']} reused, {file_id_stats['uploaded']} uploaded, {file_id_stats['invalidated']} invalidated\n"
+        render_stats = tenerife_data_manager.chart_renderer.get_statistics()
+        status_msg += f"• Renderer: {render_stats['rendered']} rendered, {render_stats['rejected']} rejected (queue full), {render_stats['failed']} failed\n"
+
+        sender_stats = telegram_sender.get_statistics()
+        status_msg += f"\n**Message delivery:**\n"
+        status_msg += f"• Sent: {sender_stats['sent']}, failed: {sender_stats['failed']}, retries: {sender_stats['retries']}\n"
+        status_msg += f"• Flood waits: {sender_stats['flood_waits']} ({sender_stats['flood_wait_seconds']:.0f}s)\n"
+        last_run = sender_stats['last_run']
+        if last_run:
+            status_msg += f"• Last batch: {last_run['sent']}/{last_run['total']} in {last_run['seconds']:.1f}s ({last_run['per_second']:.1f} msg/s)\n"
+
+        maintenance = tenerife_data_manager.last_maintenance
+        if maintenance:
+            status_msg += f"\n**History maintenance:**\n"
+            status_msg += f"• Last run: {maintenance['started_at'].strftime('%d/%m/%Y %H:%M')}\n"
+            status_msg += f"• {maintenance['total_rows']} rows in {maintenance['total_seconds']:.2f}s ({len(maintenance['steps'])} steps)\n"
+            if 'error' in maintenance:
+                status_msg += f"• ❌ Error: {maintenance['error']}\n"
+
         # System info
         import sys
         status_msg += f"\n**System:**\n"
@@ -1280,10 +1415,10 @@ async def admin_create_historical(update: Update, context: CallbackContext):
         )
         
         # Create 30 days of historical data
-        tenerife_data_manager.create_historical_backfill(days_back=30)
+        await async_data_manager.create_historical_backfill(days_back=30)
         
         # Check status after creation
-        status = tenerife_data_manager.check_historical_data_status()
+        status = await async_data_manager.check_historical_data_status()
         
         result_msg = f"✅ **Historical Data Created**\n\n"
         result_msg += f"• Created records for 30 days\n"
@@ -1303,6 +1438,38 @@ async def admin_create_historical(update: Update, context: CallbackContext):
             reply_markup=create_back_to_main_keyboard()
         )
 
+@admin_required
+async def admin_rebuild_stats(update: Update, context: CallbackContext):
+    """Admin command to rebuild the daily price statistics used by charts."""
+    try:
+        # Optional number of days, default is the whole history
+        args = context.args
+        days = int(args[0]) if args and args[0].isdigit() else None
+        
+        await update.message.reply_text(
+            "⏳ Rebuilding daily price statistics... This may take a moment.",
+            reply_markup=create_back_to_main_keyboard()
+        )
+        
+        rows = await async_data_manager.rebuild_daily_stats(days=days)
+        
+        result_msg = f"✅ **Daily Statistics Rebuilt**\n\n"
+        result_msg += f"• Range: {'last ' + str(days) + ' days' if days else 'full history'}\n"
+        result_msg += f"• Rollup rows written: {rows}\n"
+        
+        await update.message.reply_text(
+            result_msg, 
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=create_back_to_main_keyboard()
+        )
+        
+    except Exception as e:
+        logger.error(f"Error in admin_rebuild_stats: {e}")
+        await update.message.reply_text(
+            f"❌ Error rebuilding statistics: {e}",
+            reply_markup=create_back_to_main_keyboard()
+        )
+
 @admin_required
 async def admin_help(update: Update, context: CallbackContext):
     """Admin command to show available admin commands."""
@@ -1318,7 +1485,10 @@ async def admin_help(update: Update, context: CallbackContext):
     
     help_msg += f"🔧 **System:**\n"
     help_msg += f"• `/admin_broadcast [message]` - Broadcast to all users\n"
+    help_msg += f"• `/admin_broadcasts` - Progress of recent broadcasts\n"
+    help_msg += f"• `/admin_broadcast_cancel [id]` - Stop a running broadcast\n"
     help_msg += f"• `/admin_create_historical` - Create chart data\n"
+    help_msg += f"• `/admin_rebuild_stats [days]` - Rebuild chart statistics\n"
     help_msg += f"• `/admin_test_alerts` - Manually test alert system\n\n"
     
     help_msg += f"ℹ️ **Info:**\n"
@@ -1336,11 +1506,13 @@ async def admin_help(update: Update, context: CallbackContext):
 async def admin_alerts(update: Update, context: CallbackContext):
     """Admin command to show alert system statistics."""
     try:
-        alert_stats = tenerife_data_manager.get_alert_statistics()
+        alert_stats = await async_data_manager.get_alert_statistics()
         
         alert_msg = "🔔 **Alert System Statistics**\n\n"
         alert_msg += f"📊 **Overview:**\n"
-        alert_msg += f"• Total active alerts: {alert_stats['total_alerts']}\n\n"
+        alert_msg += f"• Total active alerts: {alert_stats['total_alerts']}\n"
+        alert_msg += f"• Location (radius) alerts: {alert_stats.get('location_alerts', 0)}\n"
+        alert_msg += f"• Persistent alerts: {alert_stats.get('persistent_alerts', 0)} ({alert_stats.get('disarmed_alerts', 0)} waiting to re-arm)\n\n"
         
         if alert_stats['alerts_by_fuel']:
             alert_msg += f"⛽ **Most Popular Fuel Types:**\n"
@@ -1354,6 +1526,16 @@ async def admin_alerts(update: Update, context: CallbackContext):
             for municipality, count in alert_stats['alerts_by_municipality'][:5]:
                 alert_msg += f"• {municipality}: {count} alerts\n"
         
+        digests = alert_stats.get('digests')
+        if digests and digests['notifications']:
+            alert_msg += f"\n📨 **Digests:** {digests['notifications']} alerts in {digests['messages']} messages ({digests['saved']} saved)\n"
+        
+        outbox = alert_stats.get('outbox') or {}
+        if outbox:
+            alert_msg += f"\n📬 **Outbox:**\n"
+            for status in ('pending', 'sending', 'delivered', 'failed', 'cancelled'):
+                alert_msg += f"• {status}: {outbox.get(status, 0)}\n"
+        
         await update.message.reply_text(
             alert_msg, 
             parse_mode=ParseMode.MARKDOWN,
@@ -1372,7 +1554,7 @@ async def admin_test_alerts(update: Update, context: CallbackContext):
     """Admin command to manually test the alert system."""
     try:
         await update.message.reply_text(
-            "🔔 Checking for price alerts manually...\n\n💡 Note: Triggered alerts will be automatically deleted to prevent spam.",
+            "🔔 Checking for price alerts manually...\n\n💡 Note: Triggered alerts will be automatically deleted (persistent ones paused) to prevent spam.",
             reply_markup=create_back_to_main_keyboard()
         )
         
@@ -1383,7 +1565,7 @@ async def admin_test_alerts(update: Update, context: CallbackContext):
         await check_and_send_alerts(application)
         
         await update.message.reply_text(
-            "✅ Manual alert check completed. Check logs for details.\n\n📊 Any triggered alerts have been sent and automatically deleted.",
+            "✅ Manual alert check completed. Check logs for details.\n\n📊 Any triggered alerts have been sent and automatically deleted or paused.",
             reply_markup=create_back_to_main_keyboard()
         )
         
@@ -1394,53 +1576,195 @@ async def admin_test_alerts(update: Update, context: CallbackContext):
             reply_markup=create_back_to_main_keyboard()
         )
 
-async def handle_broadcast_confirmation(update: Update, context: CallbackContext):
-    """Handle broadcast confirmation from admin."""
-    if not is_admin(update.message.from_user.id):
+# Broadcast job id -> asyncio task sending it
+_broadcast_tasks = {}
+
+BROADCAST_BATCH_SIZE = 100
+BROADCAST_PROGRESS_INTERVAL = 5  # Seconds between progress message edits
+
+def format_broadcast_progress(job):
+    """Return the admin progress text of a broadcast job."""
+    done = job['sent'] + job['failed'] + job['blocked']
+    titles = {'running': '📡 **Broadcast in progress**', 'completed': '✅ **Broadcast Complete**', 'cancelled': '🛑 **Broadcast Cancelled**'}
+    progress_msg = f"{titles.get(job['status'], '📡 **Broadcast**')} (#{job['id']})\n\n"
+    progress_msg += f"• Progress: {done}/{job['total']}\n"
+    progress_msg += f"• Sent to: {job['sent']} users\n"
+    progress_msg += f"• Failed: {job['failed']} users\n"
+    progress_msg += f"• Blocked the bot (deactivated): {job['blocked']} users\n"
+    return progress_msg
+
+async def update_broadcast_progress(application, job):
+    """Edit the admin's progress message of a job, if it has one."""
+    if not job.get('progress_message_id'):
         return
+    try:
+        await application.bot.edit_message_text(
+            chat_id=job['admin_id'],
+            message_id=job['progress_message_id'],
+            text=format_broadcast_progress(job),
+            parse_mode=ParseMode.MARKDOWN
+        )
+    except telegram.error.BadRequest as e:
+        # "Message is not modified" and deleted progress messages are harmless
+        logger.debug(f"Could not update broadcast progress: {e}")
+    except Exception as e:
+        logger.warning(f"Could not update broadcast progress: {e}")
+
+async def run_broadcast_job(application, job_id):
+    """Send a broadcast job to its pending recipients in batches.
+
+    Results are stored after every batch, so after a restart at most one
+    batch can be sent twice. Users who blocked the bot are deactivated.
+    The job stops early when it is cancelled.
+    """
+    broadcast_keyboard = InlineKeyboardMarkup([[
+        InlineKeyboardButton("🏠 Menú Principal", callback_data=str(INICI))
+    ]])
+    last_progress = 0.0
     
-    if update.message.text == "CONFIRM" and 'pending_broadcast' in context.user_data:
-        try:
-            broadcast_message = context.user_data.pop('pending_broadcast')
+    try:
+        while True:
+            job = await async_data_manager.get_broadcast_job(job_id)
+            if job is None or job['status'] != 'running':
+                break
             
-            await update.message.reply_text(
-                "📡 Starting broadcast...",
-                reply_markup=create_back_to_main_keyboard()
-            )
+            if time.monotonic() - last_progress >= BROADCAST_PROGRESS_INTERVAL:
+                await update_broadcast_progress(application, job)
+                last_progress = time.monotonic()
             
-            # Get all active users
-            users = tenerife_data_manager.get_all_active_users()
-            success_count = 0
-            error_count = 0
+            user_ids = await async_data_manager.next_broadcast_recipients(job_id, BROADCAST_BATCH_SIZE)
+            if not user_ids:
+                await async_data_manager.finish_broadcast_job(job_id)
+                break
             
-            # Create navigation keyboard for broadcast messages
-            broadcast_keyboard = InlineKeyboardMarkup([[
-                InlineKeyboardButton("🏠 Menú Principal", callback_data=str(INICI))
-            ]])
+            def build_broadcast(user_id):
+                return {
+                    'chat_id': user_id,
+                    'text': f"📢 **Mensaje del administrador:**\n\n{job['message']}",
+                    'parse_mode': ParseMode.MARKDOWN,
+                    'reply_markup': broadcast_keyboard
+                }
+            
+            results = []
             
-            for user in users:
-                try:
-                    await context.bot.send_message(
-                        chat_id=user['user_id'], 
-                        text=f"📢 **Mensaje del administrador:**\n\n{broadcast_message}",
-                        parse_mode=ParseMode.MARKDOWN,
-                        reply_markup=broadcast_keyboard
-                    )
-                    success_count += 1
-                except Exception as e:
-                    error_count += 1
-                    logger.warning(f"Failed to send broadcast to {user['user_id']}: {e}")
+            async def on_sent(user_id, message):
+                results.append((user_id, 'sent', None))
             
-            result_msg = f"✅ **Broadcast Complete**\n\n"
-            result_msg += f"• Sent to: {success_count} users\n"
-            result_msg += f"• Failed: {error_count} users\n"
-            result_msg += f"• Total attempts: {success_count + error_count}\n"
+            async def on_failed(user_id, error):
+                status = 'blocked' if isinstance(error, telegram.error.Forbidden) else 'failed'
+                if status == 'failed':
+                    logger.warning(f"Failed to send broadcast to {user_id}: {error}")
+                results.append((user_id, status, error))
             
+            # Concurrent, but paced under Telegram's flood limits
+            await telegram_sender.send_many(application.bot, user_ids, build_broadcast, on_sent, on_failed)
+            if await async_data_manager.record_broadcast_results(job_id, results) is None:
+                # Results could not be stored; stop instead of resending the batch forever
+                logger.error(f"Broadcast #{job_id} paused: results could not be stored")
+                break
+        
+        job = await async_data_manager.get_broadcast_job(job_id)
+        if job:
+            await update_broadcast_progress(application, job)
+            logger.info(f"📡 Broadcast #{job_id} {job['status']}: {job['sent']} sent, {job['failed']} failed, {job['blocked']} blocked")
+    
+    except asyncio.CancelledError:
+        # Shutdown: the job stays running and resumes on the next start
+        raise
+    except Exception as e:
+        logger.error(f"Error in broadcast #{job_id}: {e}")
+    finally:
+        _broadcast_tasks.pop(job_id, None)
+
+def start_broadcast_job(application, job):
+    """Run a broadcast job in the background unless it is already running."""
+    task = _broadcast_tasks.get(job['id'])
+    if task is None or task.done():
+        _broadcast_tasks[job['id']] = asyncio.get_running_loop().create_task(run_broadcast_job(application, job['id']))
+
+async def resume_broadcast_jobs(application):
+    """Restart the broadcast jobs a previous run left unfinished."""
+    jobs = await async_data_manager.get_broadcast_jobs(status='running')
+    for job in jobs:
+        logger.info(f"📡 Resuming broadcast #{job['id']} ({job['sent'] + job['failed'] + job['blocked']}/{job['total']} done)")
+        start_broadcast_job(application, job)
+
+@admin_required
+async def admin_broadcasts(update: Update, context: CallbackContext):
+    """Admin command to show recent broadcast jobs."""
+    try:
+        jobs = await async_data_manager.get_broadcast_jobs(limit=5)
+        if not jobs:
+            await update.message.reply_text("📡 No broadcasts yet.", reply_markup=create_back_to_main_keyboard())
+            return
+        
+        status_msg = "📡 **Recent Broadcasts**\n\n"
+        for job in jobs:
+            done = job['sent'] + job['failed'] + job['blocked']
+            status_msg += f"**#{job['id']}** {job['status']} - {done}/{job['total']} "
+            status_msg += f"({job['sent']} sent, {job['failed']} failed, {job['blocked']} blocked)\n"
+        status_msg += "\n💡 Cancel a running one with `/admin_broadcast_cancel [id]`"
+        
+        await update.message.reply_text(
+            status_msg,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=create_back_to_main_keyboard()
+        )
+    
+    except Exception as e:
+        logger.error(f"Error in admin_broadcasts: {e}")
+        await update.message.reply_text(
+            f"❌ Error retrieving broadcasts: {e}",
+            reply_markup=create_back_to_main_keyboard()
+        )
+
+@admin_required
+async def admin_broadcast_cancel(update: Update, context: CallbackContext):
+    """Admin command to cancel a running broadcast job."""
+    try:
+        if not context.args or not context.args[0].isdigit():
             await update.message.reply_text(
-                result_msg, 
+                "📝 Usage: `/admin_broadcast_cancel [id]`",
                 parse_mode=ParseMode.MARKDOWN,
                 reply_markup=create_back_to_main_keyboard()
             )
+            return
+        
+        job_id = int(context.args[0])
+        # The runner sees the new status before its next batch
+        if await async_data_manager.finish_broadcast_job(job_id, 'cancelled'):
+            await update.message.reply_text(f"🛑 Broadcast #{job_id} cancelled.", reply_markup=create_back_to_main_keyboard())
+        else:
+            await update.message.reply_text(f"❌ Broadcast #{job_id} is not running.", reply_markup=create_back_to_main_keyboard())
+    
+    except Exception as e:
+        logger.error(f"Error in admin_broadcast_cancel: {e}")
+        await update.message.reply_text(
+            f"❌ Error cancelling broadcast: {e}",
+            reply_markup=create_back_to_main_keyboard()
+        )
+
+async def handle_broadcast_confirmation(update: Update, context: CallbackContext):
+    """Handle broadcast confirmation from admin."""
+    if not is_admin(update.message.from_user.id):
+        return
+    
+    if update.message.text == "CONFIRM" and 'pending_broadcast' in context.user_data:
+        try:
+            broadcast_message = context.user_data.pop('pending_broadcast')
+            
+            # The job and its recipient list are stored first, so a restart resumes it
+            job = await async_data_manager.create_broadcast_job(update.message.from_user.id, broadcast_message)
+            if job is None:
+                raise RuntimeError("could not create the broadcast job")
+            
+            progress = await update.message.reply_text(
+                format_broadcast_progress(job),
+                parse_mode=ParseMode.MARKDOWN
+            )
+            await async_data_manager.set_broadcast_progress_message(job['id'], progress.message_id)
+            job['progress_message_id'] = progress.message_id
+            start_broadcast_job(context.application, job)
             
         except Exception as e:
             logger.error(f"Error in broadcast: {e}")
@@ -1457,6 +1781,25 @@ async def handle_broadcast_confirmation(update: Update, context: CallbackContext
         )
 
 # Alert Management Handlers
+# Fuel types alerts can be created for, with their button labels
+ALERT_FUEL_CHOICES = [
+    ('GASOLINA_95_E5', '🟢 Gasolina 95 E5'),
+    ('GASOLEO_A', '⚫️ Gasóleo A'),
+    ('GASOLINA_98_E5', '🔵 Gasolina 98 E5'),
+    ('GASOLEO_PREMIUM', '🟠 Gasóleo Premium'),
+    ('GLP', '⚪️ GLP'),
+    ('GASOLEO_B', '🟤 Gasóleo B'),
+    ('ADBLUE', '🔴 AdBlue'),
+    ('GAS_NATURAL_COMPRIMIDO', '🟣 Gas Natural Comprimido'),
+]
+
+def station_price(station, fuel_column):
+    """Return a station dict's price for a fuel, or None when it has none (missing, NaN or 0)."""
+    value = station.get(fuel_column)
+    if value is None or value != value or float(value) <= 0:
+        return None
+    return float(value)
+
 @error_handler
 async def alert_create_start(update: Update, context: CallbackContext):
     """Start alert creation process for a specific municipality."""
@@ -1473,12 +1816,14 @@ async def alert_create_start(update: Update, context: CallbackContext):
     
     # Store municipality for alert creation
     context.user_data['alert_municipality'] = municipality_key
+    context.user_data.pop('alert_location', None)
+    context.user_data.pop('alert_radius', None)
     
     municipality_display = MUNICIPALITIES[municipality_key]['display']
     
     try:
         # Get stations for this municipality to check available fuel types
-        stations_data, _ = tenerife_data_manager.get_stations_by_municipality(municipality_key, offset=0, limit=1000)
+        stations_data, _ = await async_data_manager.get_stations_by_municipality(municipality_key, offset=0, limit=1000)
         
         if stations_data.empty:
             await query.edit_message_text(
@@ -1491,18 +1836,7 @@ async def alert_create_start(update: Update, context: CallbackContext):
         
         # Check which fuel types are available in this municipality
         available_fuels = []
-        all_fuel_types = [
-            ('GASOLINA_95_E5', '🟢 Gasolina 95 E5'),
-            ('GASOLEO_A', '⚫️ Gasóleo A'),
-            ('GASOLINA_98_E5', '🔵 Gasolina 98 E5'),
-            ('GASOLEO_PREMIUM', '🟠 Gasóleo Premium'),
-            ('GLP', '⚪️ GLP'),
-            ('GASOLEO_B', '🟤 Gasóleo B'),
-            ('ADBLUE', '🔴 AdBlue'),
-            ('GAS_NATURAL_COMPRIMIDO', '🟣 Gas Natural Comprimido'),
-        ]
-        
-        for fuel_key, fuel_display in all_fuel_types:
+        for fuel_key, fuel_display in ALERT_FUEL_CHOICES:
             fuel_column = FUEL_TYPES[fuel_key]['column'].lower()
             
             # Check if any station in this municipality has this fuel type with valid price
@@ -1553,6 +1887,79 @@ async def alert_create_start(update: Update, context: CallbackContext):
         )
         return NIVELL1
 
+@error_handler
+async def alert_location_start(update: Update, context: CallbackContext):
+    """Start creating a location alert around the last shared location."""
+    query = update.callback_query
+    await query.answer()
+    
+    if not context.user_data.get('alert_location'):
+        await query.edit_message_text(M_LOCATION_REQUEST, parse_mode=ParseMode.MARKDOWN,
+                                      reply_markup=create_back_to_main_keyboard())
+        return NIVELL1
+    
+    radius_buttons = [[
+        InlineKeyboardButton(f"📏 {radius} km", callback_data=f"{ALERT_RADIUS}_{radius}")
+        for radius in ALERT_RADII_KM
+    ]]
+    radius_buttons.append([InlineKeyboardButton("🏠 Menú Principal", callback_data=str(INICI))])
+    
+    await query.edit_message_text(
+        text=M_ALERT_LOCATION_RADIUS,
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=InlineKeyboardMarkup(radius_buttons)
+    )
+    return NIVELL1
+
+@error_handler
+async def alert_radius_selected(update: Update, context: CallbackContext):
+    """Handle the radius choice of a location alert and ask for the fuel."""
+    query = update.callback_query
+    await query.answer()
+    
+    location = context.user_data.get('alert_location')
+    try:
+        radius = int(query.data.replace(f'{ALERT_RADIUS}_', ''))
+    except ValueError:
+        radius = None
+    if not location or radius not in ALERT_RADII_KM:
+        await query.answer("Error en los datos de la alerta.")
+        return NIVELL1
+    
+    context.user_data['alert_radius'] = radius
+    context.user_data.pop('alert_municipality', None)
+    
+    # Offer only the fuels sold within the radius
+    nearby_stations = await async_data_manager.find_stations_near_location(location[0], location[1], radius_km=radius)
+    available_fuels = []
+    for fuel_key, fuel_display in ALERT_FUEL_CHOICES:
+        fuel_column = FUEL_TYPES[fuel_key]['column'].lower()
+        if any(station_price(station, fuel_column) is not None for station in nearby_stations):
+            available_fuels.append((fuel_key, fuel_display))
+    
+    if not available_fuels:
+        await query.edit_message_text(
+            text=f"❌ No hay estaciones con precios a menos de {radius} km de tu ubicación",
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton(B5, callback_data=ALERT_LOCATION)
+            ]])
+        )
+        return NIVELL1
+    
+    fuel_buttons = [
+        [InlineKeyboardButton(fuel_display, callback_data=f"{ALERT_FUEL_SELECT}_{fuel_key}")]
+        for fuel_key, fuel_display in available_fuels
+    ]
+    fuel_buttons.append([InlineKeyboardButton(B5, callback_data=ALERT_LOCATION)])
+    
+    message = f"{M_ALERT_CREATE_START}\n\n📍 *Zona:* {radius} km alrededor de tu ubicación ({len(nearby_stations)} estaciones)"
+    await query.edit_message_text(
+        text=message,
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=InlineKeyboardMarkup(fuel_buttons)
+    )
+    return ALERT_FUEL_SELECT
+
 @error_handler
 async def alert_fuel_selected(update: Update, context: CallbackContext):
     """Handle fuel type selection for alert."""
@@ -1565,6 +1972,27 @@ async def alert_fuel_selected(update: Update, context: CallbackContext):
     # Store fuel type for alert creation
     context.user_data['alert_fuel_type'] = fuel_type
     
+    location = context.user_data.get('alert_location')
+    radius = context.user_data.get('alert_radius')
+    if location and radius and not context.user_data.get('alert_municipality'):
+        fuel_display = FUEL_TYPES[fuel_type]['display']
+        fuel_column = FUEL_TYPES[fuel_type]['column'].lower()
+        nearby_stations = await async_data_manager.find_stations_near_location(location[0], location[1], radius_km=radius)
+        prices = [station_price(station, fuel_column) for station in nearby_stations]
+        prices = [price for price in prices if price is not None]
+        if prices:
+            price_hint = f"\n💡 *Precio mínimo actual en la zona:* {min(prices)}€"
+        else:
+            price_hint = f"\n💡 *No hay precios disponibles para {fuel_display} en la zona*"
+        
+        message = f"{M_ALERT_PRICE_INPUT}\n\n📍 *Zona:* {radius} km alrededor de tu ubicación\n⛽ *Combustible:* {fuel_display}{price_hint}"
+        await query.edit_message_text(
+            text=message,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(B5, callback_data=str(INICI))]])
+        )
+        return ALERT_PRICE_INPUT
+    
     municipality_key = context.user_data.get('alert_municipality')
     if not municipality_key:
         await query.answer("Error: no se encontró el municipio.")
@@ -1576,7 +2004,7 @@ async def alert_fuel_selected(update: Update, context: CallbackContext):
     # Get current minimum price for this specific municipality and fuel type
     try:
         # Get stations for this municipality
-        stations_data, _ = tenerife_data_manager.get_stations_by_municipality(municipality_key, offset=0, limit=1000)
+        stations_data, _ = await async_data_manager.get_stations_by_municipality(municipality_key, offset=0, limit=1000)
         
         if not stations_data.empty:
             fuel_column = FUEL_TYPES[fuel_type]['column'].lower()
@@ -1630,6 +2058,37 @@ async def alert_price_input(update: Update, context: CallbackContext):
     # Get stored alert data
     municipality_key = context.user_data.get('alert_municipality')
     fuel_type = context.user_data.get('alert_fuel_type')
+    location = context.user_data.get('alert_location')
+    radius = context.user_data.get('alert_radius')
+    
+    if fuel_type and location and radius and not municipality_key:
+        user = update.message.from_user
+        success, result = await async_data_manager.create_location_alert(
+            user_id=user.id,
+            username=user.username,
+            fuel_type=fuel_type,
+            price_threshold=price,
+            latitude=location[0],
+            longitude=location[1],
+            radius_km=radius
+        )
+        if success:
+            message = M_ALERT_LOCATION_CREATED.format(price=price, radius=radius)
+        else:
+            message = f"❌ Error al crear la alerta: {result}"
+        
+        context.user_data.pop('alert_fuel_type', None)
+        context.user_data.pop('alert_radius', None)
+        
+        await update.message.reply_text(
+            message,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton(B_ALERT_LIST, callback_data=ALERT_LIST)],
+                [InlineKeyboardButton("🏠 Menú Principal", callback_data=str(INICI))]
+            ])
+        )
+        return NIVELL1
     
     if not municipality_key or not fuel_type:
         await update.message.reply_text(
@@ -1642,7 +2101,7 @@ async def alert_price_input(update: Update, context: CallbackContext):
     user = update.message.from_user
     municipality_display = MUNICIPALITIES[municipality_key]['display']
     
-    success, result = tenerife_data_manager.create_price_alert(
+    success, result = await async_data_manager.create_price_alert(
         user_id=user.id,
         username=user.username,
         fuel_type=fuel_type,
@@ -1652,7 +2111,7 @@ async def alert_price_input(update: Update, context: CallbackContext):
     
     if success:
         if result == "updated":
-            message = f"✅ *Alerta actualizada*\n\nTe notificaremos cuando *{FUEL_TYPES[fuel_type]['display']}* esté por debajo de *{price}€* en *{municipality_display}*.\n\n💡 *Nota:* La alerta se eliminará automáticamente después de enviarte la notificación."
+            message = f"✅ *Alerta actualizada*\n\nTe notificaremos cuando *{FUEL_TYPES[fuel_type]['display']}* esté por debajo de *{price}€* en *{municipality_display}*.\n\n💡 *Nota:* La alerta se eliminará automáticamente después de enviarte la notificación. Desde 📋 *Ver mis alertas* puedes hacer que se repita."
         else:
             message = M_ALERT_CREATED.format(price=price, municipality=municipality_display)
     else:
@@ -1682,7 +2141,7 @@ async def alert_list(update: Update, context: CallbackContext):
     await query.answer()
     
     user = update.message.from_user if update.message else query.from_user
-    alerts = tenerife_data_manager.get_user_alerts(user.id)
+    alerts = await async_data_manager.get_user_alerts(user.id)
     
     if not alerts:
         message = M_ALERT_LIST_EMPTY
@@ -1696,17 +2155,30 @@ async def alert_list(update: Update, context: CallbackContext):
             created_date = alert['created_at'].strftime('%d/%m/%Y')
             
             message += f"{i}. *{fuel_display}* ≤ {alert['price_threshold']}€\n"
-            message += f"   📍 {alert['municipio']}\n"
+            if alert.get('latitude') is not None:
+                message += f"   📍 {float(alert['radius_km']):g} km alrededor de ({float(alert['latitude']):.4f}, {float(alert['longitude']):.4f})\n"
+            else:
+                message += f"   📍 {alert['municipio']}\n"
+            persistent = bool(alert['alert_state'] & ALERT_PERSISTENT)
+            if alert['alert_state'] & ALERT_DISARMED:
+                rearm_price = float(alert['price_threshold']) + tenerife_data_manager.alert_rearm_margin
+                message += f"   🔁 En pausa hasta que el precio supere {rearm_price:.3f}€\n"
+            elif persistent:
+                message += f"   🔁 Se repite\n"
             message += f"   📅 {created_date}\n\n"
             
-            # Add delete button for each alert
+            # Add delete and repeat buttons for each alert
             delete_callback = f"{ALERT_DELETE}_{alert['id']}"
             logger.info(f"Creating delete button with callback: {delete_callback}")
             delete_button = InlineKeyboardButton(
                 f"🗑️ Eliminar #{i}",
                 callback_data=delete_callback
             )
-            buttons.append([delete_button])
+            repeat_button = InlineKeyboardButton(
+                (B_ALERT_REPEAT_OFF if persistent else B_ALERT_REPEAT_ON).format(number=i),
+                callback_data=f"{ALERT_REPEAT}_{alert['id']}_{0 if persistent else 1}"
+            )
+            buttons.append([delete_button, repeat_button])
         
         # Add navigation buttons
         buttons.append([InlineKeyboardButton("🏠 Menú Principal", callback_data=str(INICI))])
@@ -1736,7 +2208,7 @@ async def alert_delete(update: Update, context: CallbackContext):
         return NIVELL1
     
     user = query.from_user
-    success = tenerife_data_manager.delete_alert(user.id, alert_id)
+    success = await async_data_manager.delete_alert(user.id, alert_id)
     
     if success:
         await query.answer("✅ Alerta eliminada correctamente", show_alert=True)
@@ -1747,6 +2219,26 @@ async def alert_delete(update: Update, context: CallbackContext):
     
     return NIVELL1
 
+@error_handler
+async def alert_repeat_toggle(update: Update, context: CallbackContext):
+    """Switch an alert between one-shot and persistent."""
+    query = update.callback_query
+    
+    try:
+        _, alert_id, persistent = query.data.rsplit('_', 2)
+        alert_id, persistent = int(alert_id), persistent == '1'
+    except ValueError:
+        await query.answer("❌ Error en los datos de la alerta", show_alert=True)
+        return NIVELL1
+    
+    if await async_data_manager.set_alert_persistent(query.from_user.id, alert_id, persistent):
+        await query.answer("🔁 La alerta se repetirá" if persistent else "✅ La alerta se enviará una sola vez")
+        await alert_list(update, context)
+    else:
+        await query.answer("❌ Error al actualizar la alerta", show_alert=True)
+    
+    return NIVELL1
+
 @error_handler
 async def global_navigation_handler(update: Update, context: CallbackContext):
     """Global handler for navigation buttons from alert messages or any orphaned callbacks."""
@@ -1841,7 +2333,7 @@ async def get_cheapest_stations_message(municipality_key, municipality_display):
     """Get the message with the 5 cheapest stations for a municipality."""
     try:
         # Get all stations in this municipality
-        stations_data, total_count = tenerife_data_manager.get_stations_by_municipality(
+        stations_data, total_count = await async_data_manager.get_stations_by_municipality(
             municipality_key, offset=0, limit=100  # Get more to find cheapest
         )
         
@@ -1901,9 +2393,14 @@ def get_conversation_handler():
                 CallbackQueryHandler(result_pagination_handler, pattern=f'^{RESULT_PREFIX}'),
                 CallbackQueryHandler(fuel_page_handler, pattern='^fuelpage_'),
                 CallbackQueryHandler(generate_chart, pattern=f'^{CHART_PREFIX}'),
+                CallbackQueryHandler(generate_comparison_chart, pattern=f'^{COMPARE_PREFIX}'),
+                CallbackQueryHandler(show_price_map, pattern=f'^{MAP_PREFIX}'),
                 CallbackQueryHandler(alert_create_start, pattern=f'^{ALERT_PREFIX}CREATE_'),
+                CallbackQueryHandler(alert_location_start, pattern=f'^{ALERT_LOCATION}$'),
+                CallbackQueryHandler(alert_radius_selected, pattern=f'^{ALERT_RADIUS}_'),
                 CallbackQueryHandler(alert_list, pattern=f'^{ALERT_LIST}$'),
                 CallbackQueryHandler(alert_delete, pattern=alert_delete_pattern),
+                CallbackQueryHandler(alert_repeat_toggle, pattern=f'^{ALERT_REPEAT}_'),
             ],
             NIVELL2: [
                 CallbackQueryHandler(start_over, pattern=f'^{INICI}$'),
@@ -1921,7 +2418,12 @@ def get_conversation_handler():
                 CallbackQueryHandler(fuel_page_handler, pattern='^fuelpage_'),
                 CallbackQueryHandler(search_municipality_start, pattern=f'^{SEARCH_MUN}$'),
                 CallbackQueryHandler(generate_chart, pattern=f'^{CHART_PREFIX}'),
+                CallbackQueryHandler(generate_comparison_chart, pattern=f'^{COMPARE_PREFIX}'),
+                CallbackQueryHandler(show_price_map, pattern=f'^{MAP_PREFIX}'),
                 CallbackQueryHandler(alert_delete, pattern=alert_delete_pattern),
+                CallbackQueryHandler(alert_repeat_toggle, pattern=f'^{ALERT_REPEAT}_'),
+                CallbackQueryHandler(alert_location_start, pattern=f'^{ALERT_LOCATION}$'),
+                CallbackQueryHandler(alert_radius_selected, pattern=f'^{ALERT_RADIUS}_'),
                 MessageHandler(filters.LOCATION, handle_location),
             ],
             NIVELL3: [
@@ -1938,6 +2440,7 @@ def get_conversation_handler():
                 CallbackQueryHandler(start_over, pattern=f'^{INICI}$'),
                 CallbackQueryHandler(municipality_info, pattern=f'^{TOWN_PREFIX}'),
                 CallbackQueryHandler(alert_fuel_selected, pattern=f'^{ALERT_FUEL_SELECT}_'),
+                CallbackQueryHandler(alert_location_start, pattern=f'^{ALERT_LOCATION}$'),
                 CallbackQueryHandler(info, pattern=f'^{INFO}$'),
             ],
             ALERT_PRICE_INPUT: [
@@ -1954,6 +2457,31 @@ def get_conversation_handler():
     
     return conv_handler
 
+async def run_history_maintenance():
+    """Nightly job applying history retention, downsampling and partition upkeep."""
+    try:
+        metrics = await async_data_manager.run_history_maintenance()
+        if 'error' in metrics:
+            logger.error(f"History maintenance finished with errors: {metrics['error']}")
+        else:
+            logger.info(f"🧹 History maintenance: {metrics['total_rows']} rows in {metrics['total_seconds']:.2f}s")
+    except Exception as e:
+        logger.error(f"Error in history maintenance: {e}")
+
+async def post_init(application: Application):
+    """Start background services once the event loop is running."""
+    event_loop_monitor.start()
+    interaction_buffer.start()
+    await resume_broadcast_jobs(application)
+
+async def post_shutdown(application: Application):
+    """Stop background services and release the database worker threads."""
+    await event_loop_monitor.stop()
+    # Flush buffered user tracking before the DB threads go away
+    await interaction_buffer.stop()
+    async_data_manager.shutdown()
+    tenerife_data_manager.chart_renderer.shutdown()
+
 def main():
     # Initialize data manager
     try:
@@ -1983,6 +2511,8 @@ def main():
     # Set timeouts to handle potential DNS resolution issues
     builder.connect_timeout(20)
     builder.read_timeout(20)
+    builder.post_init(post_init)
+    builder.post_shutdown(post_shutdown)
 
     if persistence:
         builder.persistence(persistence)
@@ -2015,8 +2545,11 @@ def main():
     application.add_handler(CommandHandler('admin_users', admin_users))
     application.add_handler(CommandHandler('admin_user', admin_user_info))
     application.add_handler(CommandHandler('admin_broadcast', admin_broadcast))
+    application.add_handler(CommandHandler('admin_broadcasts', admin_broadcasts))
+    application.add_handler(CommandHandler('admin_broadcast_cancel', admin_broadcast_cancel))
     application.add_handler(CommandHandler('admin_data_status', admin_data_status))
     application.add_handler(CommandHandler('admin_create_historical', admin_create_historical))
+    application.add_handler(CommandHandler('admin_rebuild_stats', admin_rebuild_stats))
     application.add_handler(CommandHandler('admin_alerts', admin_alerts))
     application.add_handler(CommandHandler('admin_test_alerts', admin_test_alerts))
     
@@ -2035,19 +2568,42 @@ def main():
     # Set up periodic alert checking
     scheduler = AsyncIOScheduler(timezone=pytz.UTC)
     
-    # Schedule alert checking every 10 minutes
+    # Evaluate alerts on new price-change events every 30 seconds
+    scheduler.add_job(
+        process_price_events,
+        'interval',
+        seconds=30,
+        args=[application],
+        id='price_event_consumer',
+        name='Price Change Event Consumer',
+        max_instances=1
+    )
+    
+    # Full alert check as a safety net for missed events
     scheduler.add_job(
         check_and_send_alerts,
         'interval',
-        minutes=10,
+        hours=1,
         args=[application],
         id='alert_checker',
         name='Price Alert Checker'
     )
     
+    # Nightly history retention and partition maintenance (quiet hours in the Canaries)
+    scheduler.add_job(
+        run_history_maintenance,
+        'cron',
+        hour=3,
+        minute=30,
+        id='history_maintenance',
+        name='History Maintenance'
+    )
+    
     # Start the scheduler
     scheduler.start()
-    print("⏰ Alert checker scheduled to run every 10 minutes")
+    print("⏰ Price change events processed every 30 seconds")
+    print("⏰ Full alert check scheduled every hour")
+    print("⏰ History maintenance scheduled daily at 03:30 UTC")
     
     print("🚀 Starting Tenerife Bot...")
     application.run_polling()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+History Migration for Tenerife Bot
+Moves the wide historical_prices table into the normalized history model
+(fuels, stations, station_versions, price_history) and reports storage size
+and chart query latency before and after.
+
+Usage:
+    python migrate_history_tenerife.py                 # migrate, keep the legacy table
+    python migrate_history_tenerife.py --drop-legacy   # migrate, then drop historical_prices
+
+The migration is resumable: days already present in price_history are skipped.
+"""
+
+import datetime
+import statistics
+import sys
+import time
+from constants_tenerife import FUEL_TYPES
+from data_manager_tenerife import tenerife_data_manager
+
+LEGACY_TABLES = ['historical_prices']
+NORMALIZED_TABLES = ['fuels', 'stations', 'station_versions', 'price_history']
+CHART_FUEL = 'GASOLINA_95_E5'
+CHART_DAYS = [7, 30, 90, 365]
+REPEAT = 20
+
+def _legacy_chart_query(cursor, start_date, end_date):
+    # The chart query as it ran against the wide table
+    column = FUEL_TYPES[CHART_FUEL]['column'].lower()
+    cursor.execute(f"""
+        SELECT date, AVG({column}), MIN({column}), MAX({column})
+        FROM historical_prices
+        WHERE date >= %s AND date <= %s
+        AND {column} IS NOT NULL AND {column} > 0
+        GROUP BY date
+        ORDER BY date
+    """, (start_date, end_date))
+    return cursor.fetchall()
+
+def _normalized_chart_query(cursor, start_date, end_date):
+    fuel_id = tenerife_data_manager.history.fuel_id_for(FUEL_TYPES[CHART_FUEL])
+    return tenerife_data_manager.history.daily_series(cursor, fuel_id, start_date, end_date)
+
+def time_chart_queries(query):
+    """Return {days: median ms} for the chart query over several ranges."""
+    results = {}
+    end_date = datetime.date.today()
+    with tenerife_data_manager._connection() as connection:
+        cursor = connection.cursor()
+        for days in CHART_DAYS:
+            start_date = end_date - datetime.timedelta(days=days)
+            timings = []
+            for _ in range(REPEAT):
+                start = time.perf_counter()
+                query(cursor, start_date, end_date)
+                timings.append((time.perf_counter() - start) * 1000)
+            results[days] = statistics.median(timings)
+        cursor.close()
+    return results
+
+def table_report(tables):
+    """Return ({table: rows}, {table: bytes} or None) for existing tables."""
+    backend = tenerife_data_manager.backend
+    with tenerife_data_manager._connection() as connection:
+        cursor = connection.cursor()
+        existing = [table for table in tables if backend.table_exists(cursor, table)]
+        rows = {}
+        for table in existing:
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            rows[table] = cursor.fetchone()[0]
+        sizes = backend.table_sizes(cursor, existing)
+        cursor.close()
+    return rows, sizes
+
+def _format_bytes(size):
+    if size is None:
+        return "n/a"
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+def print_tables(title, rows, sizes):
+    print(title)
+    for table, count in rows.items():
+        size = sizes.get(table) if sizes else None
+        print(f"  {table:<20} {count:>10} rows  {_format_bytes(size):>10}")
+    if sizes:
+        print(f"  {'total':<20} {'':>10}       {_format_bytes(sum(sizes.values())):>10}")
+
+def main():
+    drop_legacy = '--drop-legacy' in sys.argv
+
+    tenerife_data_manager.create_database_and_tables()
+
+    legacy_rows, legacy_sizes = table_report(LEGACY_TABLES)
+    if not legacy_rows:
+        print("No legacy historical_prices table found, nothing to migrate")
+        return
+    legacy_timings = time_chart_queries(_legacy_chart_query)
+
+    tenerife_data_manager.migrate_legacy_history()
+
+    normalized_rows, normalized_sizes = table_report(NORMALIZED_TABLES)
+    normalized_timings = time_chart_queries(_normalized_chart_query)
+
+    print()
+    print(f"📦 Storage ({tenerife_data_manager.backend.name})")
+    print_tables("Before:", legacy_rows, legacy_sizes)
+    print_tables("After:", normalized_rows, normalized_sizes)
+    if legacy_sizes and normalized_sizes:
+        before = sum(legacy_sizes.values())
+        after = sum(normalized_sizes.values())
+        if after:
+            print(f"  Ratio: {before / after:.1f}x smaller")
+
+    print()
+    print(f"📈 Chart query ({CHART_FUEL}, median of {REPEAT} runs)")
+    print(f"  {'days':>6} {'before':>12} {'after':>12}")
+    for days in CHART_DAYS:
+        print(f"  {days:>6} {legacy_timings[days]:>10.2f}ms {normalized_timings[days]:>10.2f}ms")
+
+    if drop_legacy:
+        with tenerife_data_manager._connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("DROP TABLE historical_prices")
+            connection.commit()
+            cursor.close()
+        print("\nLegacy historical_prices table dropped")
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,14 @@
 Price Alert Notification Sender for Tenerife Bot
 This script checks for price alerts and sends actual Telegram notifications.
 Run this periodically (e.g., every 10 minutes) to monitor and send alerts.
+Notifications go through the alert outbox shared with the bot, so running
+both never sends an alert twice.
 """
 
 import asyncio
-from telegram import Bot, InlineKeyboardMarkup, InlineKeyboardButton
-from data_manager_tenerife import tenerife_data_manager
-from constants_tenerife import FUEL_TYPES, INICI, ALERTS
+from telegram import Bot
+from async_db_tenerife import async_data_manager
+from alert_delivery_tenerife import deliver_alert_outbox, create_alert_keyboard
 import secret
 import logging
 
@@ -16,69 +18,26 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def create_alert_navigation_keyboard():
-    """Create navigation keyboard for alert messages."""
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🏠 Menú Principal", callback_data=str(INICI))],
-        [InlineKeyboardButton("📋 Mis Alertas", callback_data=str(ALERTS))]
-    ])
-
 async def send_price_notifications():
-    """Check for price alerts and send Telegram notifications."""
+    """Check for price alerts, queue them in the outbox and send the queued notifications."""
     print("🔔 Checking for price alerts...")
     
     try:
         # Initialize bot
         bot = Bot(token=secret.secret['token'])
         
-        # Get notifications that need to be sent
-        notifications = tenerife_data_manager.check_price_alerts()
-        
-        if not notifications:
-            print("✅ No price alerts triggered at this time.")
-            return
-        
-        print(f"🚨 Found {len(notifications)} price alerts to send!")
-        
-        sent_count = 0
-        error_count = 0
+        # Queue triggered alerts; ones the bot already queued are skipped
+        notifications = await async_data_manager.check_price_alerts()
+        queued = await async_data_manager.enqueue_alert_notifications(notifications)
+        print(f"🚨 Found {len(notifications)} triggered price alerts ({queued} newly queued)")
         
-        for notification in notifications:
-            try:
-                # Format the alert message
-                fuel_display = FUEL_TYPES.get(notification['fuel_type'], {}).get('display', notification['fuel_type'])
-                
-                alert_message = f"🚨 **¡ALERTA DE PRECIO!**\n\n"
-                alert_message += f"⛽ **{fuel_display}:** {notification['current_price']}€\n"
-                alert_message += f"💰 **Tu límite:** ≤ {notification['threshold']}€\n"
-                alert_message += f"📍 **Ubicación:** {notification['municipality']}\n\n"
-                alert_message += f"🏪 **Estación:** {notification['station_name']}\n"
-                if notification['station_address']:
-                    alert_message += f"📍 {notification['station_address']}\n\n"
-                alert_message += f"💡 ¡Precio por debajo de tu alerta!"
-                
-                # Send the notification with navigation buttons
-                await bot.send_message(
-                    chat_id=notification['user_id'],
-                    text=alert_message,
-                    parse_mode='Markdown',
-                    reply_markup=create_alert_navigation_keyboard()
-                )
-                
-                sent_count += 1
-                print(f"   ✅ Sent alert to user {notification['user_id']} - {fuel_display}: {notification['current_price']}€")
-                
-                # Small delay to avoid rate limiting
-                await asyncio.sleep(0.1)
-                
-            except Exception as e:
-                error_count += 1
-                logger.error(f"Failed to send alert to user {notification['user_id']}: {e}")
+        # Same delivery as the bot: claimed rows are locked, so both can run without double-sending
+        run = await deliver_alert_outbox(bot)
         
-        print(f"\n📊 **Notification Summary:**")
-        print(f"   ✅ Sent: {sent_count} alerts")
-        print(f"   ❌ Failed: {error_count} alerts")
-        print(f"   📱 Total processed: {len(notifications)} alerts")
+        print("\n📊 **Notification Summary:**")
+        print(f"   ✅ Sent: {run['messages']} messages ({run['alerts']} alerts, {run['alerts'] - run['messages']} messages saved)")
+        print(f"   ❌ Failed: {run['failed']} messages")
+        print(f"   📱 Total processed: {run['messages'] + run['failed']} messages")
         
     except Exception as e:
         logger.error(f"Error in notification system: {e}")
@@ -94,17 +53,17 @@ async def test_single_notification():
         # Get your user ID (replace with your actual Telegram ID)
         test_user_id = 306657494  # Your user ID from the test
         
-        test_message = f"🧪 **Prueba del Sistema de Alertas**\n\n"
-        test_message += f"✅ El sistema de notificaciones funciona correctamente.\n"
-        test_message += f"🔔 Recibirás alertas cuando los precios bajen de tus límites.\n\n"
-        test_message += f"💡 Para crear alertas reales, usa el bot normalmente."
+        test_message = "🧪 **Prueba del Sistema de Alertas**\n\n"
+        test_message += "✅ El sistema de notificaciones funciona correctamente.\n"
+        test_message += "🔔 Recibirás alertas cuando los precios bajen de tus límites.\n\n"
+        test_message += "💡 Para crear alertas reales, usa el bot normalmente."
         
         # Send test message with navigation buttons
         await bot.send_message(
             chat_id=test_user_id,
             text=test_message,
             parse_mode='Markdown',
-            reply_markup=create_alert_navigation_keyboard()
+            reply_markup=create_alert_keyboard()
         )
         
         print(f"✅ Test notification sent to user {test_user_id}")
@@ -121,4 +80,5 @@ if __name__ == "__main__":
         asyncio.run(test_single_notification())
     else:
         # Run real notification check
-        asyncio.run(send_price_notifications()) 
\ No newline at end of file
+        asyncio.run(send_price_notifications())
+    async_data_manager.shutdown()
\ No newline at end of file
@@ -0,0 +1,210 @@
+import datetime
+import uuid
+import logging
+from alerts_tenerife import ALERT_PERSISTENT, ALERT_DISARMED
+
+logger = logging.getLogger(__name__)
+
+# Notification fields stored with every outbox row, in insert order
+OUTBOX_COLUMNS = [
+    'alert_id', 'user_id', 'event_key', 'fuel_type', 'current_price', 'threshold',
+    'municipality', 'station_name', 'station_address'
+]
+
+# Rows inserted per INSERT statement
+ENQUEUE_CHUNK = 500
+
+# Rows in one of these states are never sent again
+FINAL_STATUSES = ('delivered', 'failed', 'cancelled')
+
+class AlertOutbox:
+    """Triggered alert notifications waiting to be sent, kept in alert_outbox.
+
+    Evaluation only enqueues: a notification is unique per (alert, event_key),
+    so evaluating the same price again, from the bot or from
+    notification_sender.py, never adds a second row. Senders claim batches
+    under row locks, send them and then mark each row delivered in the same
+    transaction that deactivates its alert (or disarms it, when it is
+    persistent). A sender that dies after sending
+    leaves its rows in 'sending'; they are claimed again once the claim goes
+    stale, so delivery is at-least-once with that window as the only gap.
+    A failed send is retried after a growing delay (``retry_delay`` seconds,
+    doubled on every attempt) and every row is tried ``max_attempts`` times
+    at most, whether its sends failed or its senders died.
+
+    Every method works on a cursor; the caller owns the transaction.
+    """
+
+    def __init__(self, backend, claim_timeout=300, max_attempts=5, retry_delay=60):
+        self.backend = backend
+        self.claim_timeout = claim_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def enqueue(self, cursor, notifications):
+        """Insert notifications as pending rows, skipping ones already queued.
+
+        Returns the number of rows actually added.
+        """
+        added = 0
+        for start in range(0, len(notifications), ENQUEUE_CHUNK):
+            chunk = notifications[start:start + ENQUEUE_CHUNK]
+            query = self.backend.insert_ignore_query('alert_outbox', OUTBOX_COLUMNS, rows=len(chunk))
+            cursor.execute(query, [notification[column] for notification in chunk for column in OUTBOX_COLUMNS])
+            added += max(cursor.rowcount, 0)
+        return added
+
+    def claim(self, cursor, limit=50, now=None):
+        """Claim up to ``limit`` pending notifications for one sender.
+
+        Rows are picked under row locks that other senders skip, and at most
+        one row per alert is claimed while another claim on that alert is
+        still in flight. The other claimable rows of every user picked join
+        the claim (it may exceed ``limit``), so a user's notifications can be
+        sent as one digest. Returns notification dicts carrying ``outbox_id``
+        and ``claim_token``; the caller must commit before sending.
+        """
+        now = now or datetime.datetime.now()
+        stale = now - datetime.timedelta(seconds=self.claim_timeout)
+        # Pending rows past their retry time, and stale claims with attempts left
+        claimable = """(
+            (status = 'pending' AND (next_attempt_at IS NULL OR next_attempt_at <= %s))
+            OR (status = 'sending' AND claimed_at < %s AND attempts < %s)
+        )"""
+        claimable_params = [now, stale, self.max_attempts]
+
+        # Alerts deleted or disarmed since they were queued are not sent
+        cursor.execute("""
+            UPDATE alert_outbox SET status = 'cancelled', claim_token = NULL
+            WHERE (status = 'pending' OR (status = 'sending' AND claimed_at < %s))
+              AND alert_id IN (
+                  SELECT id FROM user_subscriptions WHERE is_active = FALSE OR (alert_state & %s) = %s
+              )
+        """, (stale, ALERT_DISARMED, ALERT_DISARMED))
+
+        # A row whose sender died on every attempt is given up
+        cursor.execute("""
+            UPDATE alert_outbox SET status = 'failed', claim_token = NULL, last_error = %s
+            WHERE status = 'sending' AND claimed_at < %s AND attempts >= %s
+        """, ('Sender stopped before finishing every attempt', stale, self.max_attempts))
+
+        candidates = f"""
+            SELECT o.id, o.alert_id, o.user_id
+            FROM alert_outbox o
+            WHERE {claimable}
+              AND NOT EXISTS (
+                  SELECT 1 FROM alert_outbox f
+                  WHERE f.alert_id = o.alert_id AND f.status = 'sending' AND f.claimed_at >= %s
+              )
+        """
+        cursor.execute(f"""
+            {candidates}
+            ORDER BY o.id
+            LIMIT %s
+            {self.backend.skip_locked_clause()}
+        """, claimable_params + [stale, limit])
+        rows = cursor.fetchall()
+
+        user_ids = sorted({row[2] for row in rows})
+        if user_ids:
+            placeholders = ", ".join(["%s"] * len(user_ids))
+            cursor.execute(f"""
+                {candidates}
+                  AND o.user_id IN ({placeholders})
+                ORDER BY o.id
+                {self.backend.skip_locked_clause()}
+            """, claimable_params + [stale] + user_ids)
+            rows += cursor.fetchall()
+
+        ids = []
+        seen_ids = set()
+        seen_alerts = set()
+        for outbox_id, alert_id, _ in rows:
+            if outbox_id not in seen_ids and alert_id not in seen_alerts:
+                seen_ids.add(outbox_id)
+                seen_alerts.add(alert_id)
+                ids.append(outbox_id)
+        if not ids:
+            return []
+
+        token = uuid.uuid4().hex
+        placeholders = ", ".join(["%s"] * len(ids))
+        # Re-check the state so engines without row locks can't claim a row twice
+        cursor.execute(f"""
+            UPDATE alert_outbox
+            SET status = 'sending', claim_token = %s, claimed_at = %s, attempts = attempts + 1
+            WHERE id IN ({placeholders}) AND {claimable}
+        """, [token, now] + ids + claimable_params)
+
+        cursor.execute(f"""
+            SELECT id, attempts, {', '.join(OUTBOX_COLUMNS)}
+            FROM alert_outbox
+            WHERE claim_token = %s AND status = 'sending'
+            ORDER BY id
+        """, (token,))
+        claimed = []
+        for row in cursor.fetchall():
+            notification = dict(zip(OUTBOX_COLUMNS, row[2:]))
+            notification['current_price'] = float(notification['current_price'])
+            notification['outbox_id'] = row[0]
+            notification['attempts'] = row[1]
+            notification['claim_token'] = token
+            claimed.append(notification)
+        return claimed
+
+    def mark_delivered(self, cursor, notification, now=None):
+        """Mark a claimed notification delivered and deactivate its alert.
+
+        A persistent alert stays active: it is disarmed and its notification
+        time recorded, which starts its cooldown. Returns False when the
+        claim was lost (it went stale and another sender took the row over).
+        """
+        now = now or datetime.datetime.now()
+        cursor.execute("""
+            UPDATE alert_outbox SET status = 'delivered', delivered_at = %s, last_error = NULL
+            WHERE id = %s AND claim_token = %s AND status = 'sending'
+        """, (now, notification['outbox_id'], notification['claim_token']))
+        if cursor.rowcount <= 0:
+            return False
+
+        cursor.execute("""
+            UPDATE user_subscriptions
+            SET is_active = CASE WHEN (alert_state & %s) = %s THEN is_active ELSE FALSE END,
+                alert_state = alert_state | %s,
+                last_notified_at = %s
+            WHERE id = %s AND is_active = TRUE
+        """, (ALERT_PERSISTENT, ALERT_PERSISTENT, ALERT_DISARMED, now, notification['alert_id']))
+        return True
+
+    def mark_failed(self, cursor, notification, error, retry=True, now=None):
+        """Release a claimed notification after a failed send.
+
+        It goes back to pending, claimable again after the retry delay, until
+        it has been tried ``max_attempts`` times; with ``retry`` False (e.g.
+        the user blocked the bot) it fails at once.
+        """
+        now = now or datetime.datetime.now()
+        attempts_left = self.max_attempts if retry else 0
+        delay = self.retry_delay * 2 ** max(notification.get('attempts', 1) - 1, 0)
+        cursor.execute("""
+            UPDATE alert_outbox
+            SET status = CASE WHEN attempts < %s THEN 'pending' ELSE 'failed' END,
+                claim_token = NULL, next_attempt_at = %s, last_error = %s
+            WHERE id = %s AND claim_token = %s AND status = 'sending'
+        """, (attempts_left, now + datetime.timedelta(seconds=delay), str(error)[:255],
+              notification['outbox_id'], notification['claim_token']))
+        return cursor.rowcount > 0
+
+    def statistics(self, cursor):
+        """Return {status: row count}."""
+        cursor.execute("SELECT status, COUNT(*) FROM alert_outbox GROUP BY status")
+        return {status: count for status, count in cursor.fetchall()}
+
+    def purge(self, cursor, before):
+        """Delete finished rows created before ``before``; returns the number removed."""
+        placeholders = ", ".join(["%s"] * len(FINAL_STATUSES))
+        cursor.execute(
+            f"DELETE FROM alert_outbox WHERE status IN ({placeholders}) AND created_at < %s",
+            list(FINAL_STATUSES) + [before]
+        )
+        return cursor.rowcount
@@ -2,10 +2,25 @@
 
 secret = {
     "token": "YOUR_TELEGRAM_BOT_TOKEN_HERE",
+    "db_backend": "mysql",       # "mysql" or "sqlite" (embedded, no server needed)
+    "sqlite_path": "data/tenerife.db",
     "db_host": "localhost",
     "db_user": "YOUR_DB_USER",
     "db_password": "YOUR_DB_PASSWORD",
     "db_name": "tenerife",
+    "db_pool_size": 5,           # Persistent pooled connections
+    "db_pool_max_overflow": 5,   # Extra connections allowed under load
+    "db_pool_timeout": 10,       # Seconds to wait for a free connection
+    "history_detail_months": 13, # Months of per-station daily prices before monthly downsampling
+    "price_interval_retention_days": 90,  # Days to keep closed intraday price intervals
+    "chart_render_workers": 2,   # Worker processes drawing charts
+    "chart_render_queue": 8,     # Charts queued or rendering before new requests are refused
+    "chart_format": "png",       # "png", "png-palette" (quantized, smaller) or "webp"
+    "alert_outbox_retention_days": 30,  # Days to keep sent/failed alert notifications
+    "alert_cooldown_hours": 12,  # Minimum hours between two notifications of a persistent alert
+    "alert_rearm_margin": 0.02,  # Euros the price must rise above the threshold to re-arm a persistent alert
+    "telegram_send_rate": 30,    # Messages per second across all chats (Telegram's flood limit)
+    "telegram_send_concurrency": 16,  # Messages in flight at once
 
     "admin_user_ids": [
         # 123456789,  # Replace with your actual User ID
@@ -0,0 +1,1020 @@
+import datetime
+import decimal
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+import pandas as pd
+import mysql.connector as msql
+from db_pool_tenerife import TenerifeConnectionPool, PoolMetrics
+
+logger = logging.getLogger(__name__)
+
+# Errors raised by any of the supported database drivers
+DatabaseError = (msql.Error, sqlite3.Error)
+
+class StorageBackend:
+    """Storage engine used by TenerifeDataManager.
+
+    A backend owns the connections and the schema for stations, price
+    history, user subscriptions and bot users, and renders the few SQL
+    fragments that differ between engines. Queries are written with
+    ``%s`` placeholders and ``cursor(dictionary=True)`` works on every
+    backend, so the data manager keeps a single copy of each query.
+    """
+
+    name = None
+    pool_size = 1
+
+    def connection(self):
+        """Context manager yielding a connection for one operation."""
+        raise NotImplementedError
+
+    def create_schema(self):
+        """Create every table and index if they don't exist."""
+        raise NotImplementedError
+
+    def read_dataframe(self, query, params=None):
+        """Run a SELECT and return the result as a pandas DataFrame."""
+        raise NotImplementedError
+
+    def get_statistics(self):
+        """Return connection pool metrics."""
+        raise NotImplementedError
+
+    def dispose(self):
+        """Close every open connection."""
+        raise NotImplementedError
+
+    def new_value(self, column):
+        """SQL expression for the incoming value of a column inside an upsert."""
+        raise NotImplementedError
+
+    def greatest(self, *expressions):
+        """SQL expression returning the largest of several values."""
+        raise NotImplementedError
+
+    def _conflict_clause(self, key_columns, assignments):
+        raise NotImplementedError
+
+    def _insert_ignore_verb(self):
+        raise NotImplementedError
+
+    def skip_locked_clause(self):
+        """Clause appended to a SELECT to lock its rows, skipping rows other transactions hold."""
+        raise NotImplementedError
+
+    def table_exists(self, cursor, table):
+        """Return True if the table exists in the current database."""
+        raise NotImplementedError
+
+    def table_sizes(self, cursor, tables):
+        """Return {table: bytes on disk (data + indexes)}, or None if unavailable."""
+        raise NotImplementedError
+
+    def column_names(self, cursor, table):
+        """Return the set of (lower-case) column names of a table."""
+        raise NotImplementedError
+
+    def add_missing_columns(self, cursor):
+        """Add the ADDED_COLUMNS an older database was created without; returns their names."""
+        added = []
+        for table, columns in ADDED_COLUMNS.items():
+            existing = self.column_names(cursor, table)
+            for column, definition in columns:
+                if column not in existing:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                    added.append(f"{table}.{column}")
+        return added
+
+    def estimated_row_count(self, cursor, table):
+        """Return the table's row count, estimated where an exact count is expensive."""
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        return cursor.fetchone()[0]
+
+    def ensure_monthly_partitions(self, cursor, table, first_month, last_month):
+        """Make sure a (date) range-partitioned table has one partition per month.
+
+        Returns the number of partitions added; engines without partitioning
+        return 0.
+        """
+        return 0
+
+    def drop_month_partition(self, cursor, table, month_start):
+        """Drop the partition holding exactly one month, if there is one.
+
+        Returns True when the month was removed this way, False when the
+        caller has to delete the rows instead.
+        """
+        return False
+
+    def upsert_query(self, table, columns, key_columns, updates=None, rows=1):
+        """Build a (multi-row) INSERT that updates existing rows on key conflicts.
+
+        ``updates`` maps column -> SQL expression; by default every non-key
+        column takes the incoming value.
+        """
+        if updates is None:
+            updates = {column: self.new_value(column) for column in columns if column not in key_columns}
+
+        row_placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        values = ", ".join([row_placeholders] * rows)
+        assignments = ", ".join(f"{column} = {expression}" for column, expression in updates.items())
+
+        return (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES {values} "
+            f"{self._conflict_clause(key_columns, assignments)}"
+        )
+
+    def insert_ignore_query(self, table, columns, rows=1):
+        """Build a (multi-row) INSERT that silently skips rows violating a unique key."""
+        row_placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        values = ", ".join([row_placeholders] * rows)
+        return f"{self._insert_ignore_verb()} INTO {table} ({', '.join(columns)}) VALUES {values}"
+
+class MySQLBackend(StorageBackend):
+    """MySQL storage through a bounded SQLAlchemy connection pool."""
+
+    name = 'mysql'
+
+    def __init__(self, db_config, pool_size=5, max_overflow=5, pool_timeout=10):
+        self.db_config = db_config
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        # Created lazily so importing the data manager never touches the network
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = TenerifeConnectionPool(
+                        self.db_config,
+                        pool_size=self.pool_size,
+                        max_overflow=self.max_overflow,
+                        pool_timeout=self.pool_timeout
+                    )
+                    print("Connected to Tenerife MySQL database (connection pool ready)")
+        return self._pool
+
+    def connection(self):
+        return self.pool.connection()
+
+    def read_dataframe(self, query, params=None):
+        return pd.read_sql(query, self.pool.engine, params=params)
+
+    def get_statistics(self):
+        if self._pool is None:
+            return None
+        return self._pool.get_statistics()
+
+    def dispose(self):
+        if self._pool is not None:
+            self._pool.dispose()
+
+    def new_value(self, column):
+        return f"VALUES({column})"
+
+    def greatest(self, *expressions):
+        return f"GREATEST({', '.join(expressions)})"
+
+    def _conflict_clause(self, key_columns, assignments):
+        return f"ON DUPLICATE KEY UPDATE {assignments}"
+
+    def _insert_ignore_verb(self):
+        return "INSERT IGNORE"
+
+    def skip_locked_clause(self):
+        return "FOR UPDATE SKIP LOCKED"
+
+    def table_exists(self, cursor, table):
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+            (table,)
+        )
+        return cursor.fetchone()[0] > 0
+
+    def column_names(self, cursor, table):
+        cursor.execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s",
+            (table,)
+        )
+        return {row[0].lower() for row in cursor.fetchall()}
+
+    def table_sizes(self, cursor, tables):
+        sizes = {}
+        for table in tables:
+            # Refresh InnoDB statistics so information_schema reports current sizes
+            cursor.execute(f"ANALYZE TABLE {table}")
+            cursor.fetchall()
+            cursor.execute(
+                "SELECT data_length + index_length FROM information_schema.tables "
+                "WHERE table_schema = DATABASE() AND table_name = %s",
+                (table,)
+            )
+            row = cursor.fetchone()
+            sizes[table] = int(row[0]) if row else 0
+        return sizes
+
+    def estimated_row_count(self, cursor, table):
+        # InnoDB statistics instead of a full COUNT(*) scan
+        cursor.execute(
+            "SELECT SUM(table_rows) FROM information_schema.partitions "
+            "WHERE table_schema = DATABASE() AND table_name = %s",
+            (table,)
+        )
+        row = cursor.fetchone()
+        return int(row[0] or 0) if row else 0
+
+    @staticmethod
+    def _partition_name(month_start):
+        return f"p{month_start:%Y%m}"
+
+    def _partition_names(self, cursor, table):
+        cursor.execute(
+            "SELECT partition_name FROM information_schema.partitions "
+            "WHERE table_schema = DATABASE() AND table_name = %s AND partition_name IS NOT NULL "
+            "ORDER BY partition_ordinal_position",
+            (table,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def ensure_monthly_partitions(self, cursor, table, first_month, last_month):
+        partitions = self._partition_names(cursor, table)
+        if not partitions:
+            # Tables created before partitioning: convert once (rebuilds the table)
+            cursor.execute(
+                f"ALTER TABLE {table} PARTITION BY RANGE COLUMNS(date) "
+                f"(PARTITION p_future VALUES LESS THAN (MAXVALUE))"
+            )
+            partitions = ['p_future']
+
+        # New partitions can only be split off the catch-all p_future, after the newest month
+        monthly = [name for name in partitions if name != 'p_future']
+        month = first_month
+        if monthly:
+            newest = datetime.date(int(monthly[-1][1:5]), int(monthly[-1][5:7]), 1)
+            month = max(month, _next_month(newest))
+
+        definitions = []
+        while month <= last_month:
+            definitions.append(
+                f"PARTITION {self._partition_name(month)} VALUES LESS THAN ('{_next_month(month).isoformat()}')"
+            )
+            month = _next_month(month)
+
+        if definitions:
+            definitions.append("PARTITION p_future VALUES LESS THAN (MAXVALUE)")
+            cursor.execute(f"ALTER TABLE {table} REORGANIZE PARTITION p_future INTO ({', '.join(definitions)})")
+        return len(definitions) - 1 if definitions else 0
+
+    def drop_month_partition(self, cursor, table, month_start):
+        name = self._partition_name(month_start)
+        if name not in self._partition_names(cursor, table):
+            return False
+        cursor.execute(f"ALTER TABLE {table} DROP PARTITION {name}")
+        return True
+
+    def create_schema(self):
+        # First connect without specifying database
+        temp_config = self.db_config.copy()
+        database = temp_config.pop('database')
+        temp_conn = msql.connect(**temp_config)
+        cursor = temp_conn.cursor()
+
+        # Create database if it doesn't exist
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {database}")
+        print("Tenerife database created/verified")
+
+        cursor.close()
+        temp_conn.close()
+
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            for statement in MYSQL_SCHEMA:
+                cursor.execute(statement)
+            for column in self.add_missing_columns(cursor):
+                print(f"Added column {column}")
+            connection.commit()
+            cursor.close()
+
+class SQLiteConnection:
+    """Minimal mysql.connector-style wrapper around a sqlite3 connection."""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def cursor(self, dictionary=False):
+        return SQLiteCursor(self._connection.cursor(), dictionary)
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+class SQLiteCursor:
+    """Cursor accepting ``%s`` placeholders and optionally returning dict rows."""
+
+    def __init__(self, cursor, dictionary=False):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    @staticmethod
+    def _translate(query):
+        return query.replace('%s', '?')
+
+    def execute(self, query, params=None):
+        self._cursor.execute(self._translate(query), tuple(params) if params else ())
+        return self
+
+    def executemany(self, query, seq_of_params):
+        self._cursor.executemany(self._translate(query), seq_of_params)
+        return self
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        columns = [column[0] for column in self._cursor.description]
+        return dict(zip(columns, row))
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        if not self._dictionary:
+            return rows
+        columns = [column[0] for column in self._cursor.description]
+        return [dict(zip(columns, row)) for row in rows]
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+def _next_month(month_start):
+    return (month_start.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+def _parse_sqlite_date(value):
+    return datetime.date.fromisoformat(value.decode()[:10])
+
+def _parse_sqlite_timestamp(value):
+    return datetime.datetime.fromisoformat(value.decode())
+
+# Store dates/timestamps in the same text format SQLite's CURRENT_TIMESTAMP uses,
+# and read them back as Python objects like mysql.connector does.
+sqlite3.register_adapter(datetime.datetime, lambda value: value.strftime("%Y-%m-%d %H:%M:%S"))
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_adapter(decimal.Decimal, float)
+sqlite3.register_converter("DATE", _parse_sqlite_date)
+sqlite3.register_converter("TIMESTAMP", _parse_sqlite_timestamp)
+sqlite3.register_converter("DATETIME", _parse_sqlite_timestamp)
+
+class SQLiteBackend(StorageBackend):
+    """Embedded SQLite storage in WAL mode for small deployments and benchmarks."""
+
+    name = 'sqlite'
+
+    def __init__(self, path, pool_size=4, pool_timeout=10):
+        self.path = path
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.metrics = PoolMetrics()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _new_connection(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = sqlite3.connect(
+            self.path,
+            timeout=self.pool_timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False
+        )
+        # WAL lets readers run concurrently with the single writer
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                try:
+                    return self._new_connection()
+                except Exception:
+                    self._created -= 1
+                    raise
+
+        # Pool is at capacity: wait for a connection to be returned
+        try:
+            return self._idle.get(timeout=self.pool_timeout)
+        except queue.Empty:
+            # A DatabaseError, so callers handle it like any other database failure
+            raise sqlite3.OperationalError(
+                f"SQLite connection pool timeout: all {self.pool_size} connections in use for {self.pool_timeout}s"
+            ) from None
+
+    @contextmanager
+    def connection(self):
+        start = time.perf_counter()
+        try:
+            connection = self._acquire()
+        except Exception:
+            self.metrics.record_error()
+            raise
+        self.metrics.record_checkout(time.perf_counter() - start)
+
+        try:
+            yield SQLiteConnection(connection)
+        finally:
+            # Discard anything left uncommitted before returning it to the pool
+            connection.rollback()
+            self._idle.put(connection)
+
+    def read_dataframe(self, query, params=None):
+        with self.connection() as connection:
+            return pd.read_sql(SQLiteCursor._translate(query), connection._connection, params=params)
+
+    def get_statistics(self):
+        stats = {
+            'pool_size': self.pool_size,
+            'max_overflow': 0,
+            'checked_out': self._created - self._idle.qsize(),
+            'idle': self._idle.qsize()
+        }
+        stats.update(self.metrics.snapshot())
+        return stats
+
+    def dispose(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+            with self._lock:
+                self._created -= 1
+
+    def new_value(self, column):
+        return f"excluded.{column}"
+
+    def greatest(self, *expressions):
+        return f"MAX({', '.join(expressions)})"
+
+    def _conflict_clause(self, key_columns, assignments):
+        return f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {assignments}"
+
+    def _insert_ignore_verb(self):
+        return "INSERT OR IGNORE"
+
+    def skip_locked_clause(self):
+        # No row locks: SQLite runs one writer at a time, so claims are re-checked in the UPDATE
+        return ""
+
+    def table_exists(self, cursor, table):
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = %s", (table,))
+        return cursor.fetchone()[0] > 0
+
+    def column_names(self, cursor, table):
+        cursor.execute(f"PRAGMA table_info({table})")
+        return {row[1].lower() for row in cursor.fetchall()}
+
+    def table_sizes(self, cursor, tables):
+        sizes = {}
+        try:
+            for table in tables:
+                # dbstat reports pages per b-tree; include the table's indexes
+                cursor.execute(
+                    "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat "
+                    "WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name = %s)",
+                    (table,)
+                )
+                sizes[table] = cursor.fetchone()[0]
+        except sqlite3.Error:
+            # SQLite built without the dbstat virtual table
+            return None
+        return sizes
+
+    def create_schema(self):
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            for statement in SQLITE_SCHEMA:
+                cursor.execute(statement)
+            for column in self.add_missing_columns(cursor):
+                print(f"Added column {column}")
+            connection.commit()
+            cursor.close()
+        print(f"Tenerife SQLite database ready at {self.path}")
+
+def create_backend(config):
+    """Build the storage backend selected in secret.py (``db_backend``)."""
+    backend = config.get('db_backend', 'mysql')
+
+    if backend == 'sqlite':
+        return SQLiteBackend(
+            config.get('sqlite_path', os.path.join('data', 'tenerife.db')),
+            pool_size=config.get('db_pool_size', 4),
+            pool_timeout=config.get('db_pool_timeout', 10)
+        )
+
+    if backend == 'mysql':
+        return MySQLBackend(
+            {
+                'host': config['db_host'],
+                'user': config['db_user'],
+                'password': config['db_password'],
+                'database': config.get('db_name', 'tenerife')
+            },
+            pool_size=config.get('db_pool_size', 5),
+            max_overflow=config.get('db_pool_max_overflow', 5),
+            pool_timeout=config.get('db_pool_timeout', 10)
+        )
+
+    raise ValueError(f"Unknown db_backend '{backend}' (expected 'mysql' or 'sqlite')")
+
+# Fuel price columns shared by the station tables of both engines
+FUEL_PRICE_COLUMNS = [
+    'precio_adblue', 'precio_amoniaco', 'precio_biodiesel', 'precio_bioetanol',
+    'precio_biogas_natural_comprimido', 'precio_biogas_natural_licuado',
+    'precio_diesel_renovable', 'precio_gas_natural_comprimido',
+    'precio_gas_natural_licuado', 'precio_gases_licuados_del_petroleo',
+    'precio_gasoleo_a', 'precio_gasoleo_b', 'precio_gasoleo_premium',
+    'precio_gasolina_95_e10', 'precio_gasolina_95_e25', 'precio_gasolina_95_e5',
+    'precio_gasolina_95_e5_premium', 'precio_gasolina_95_e85',
+    'precio_gasolina_98_e10', 'precio_gasolina_98_e5', 'precio_gasolina_renovable',
+    'precio_hidrogeno', 'precio_metanol'
+]
+
+# Columns added to tables after they first shipped: {table: [(column, definition)]}.
+# CREATE TABLE IF NOT EXISTS leaves existing tables alone, so create_schema adds them.
+ADDED_COLUMNS = {
+    'user_subscriptions': [
+        ('latitude', 'DECIMAL(10, 8)'),
+        ('longitude', 'DECIMAL(11, 8)'),
+        ('radius_km', 'DECIMAL(5, 2)'),
+        ('alert_state', 'TINYINT NOT NULL DEFAULT 0'),
+        ('last_notified_at', 'DATETIME'),
+    ],
+    'alert_outbox': [
+        ('next_attempt_at', 'DATETIME'),
+    ],
+}
+
+_FUEL_PRICE_DDL = ",\n    ".join(f"{column} DECIMAL(5, 3)" for column in FUEL_PRICE_COLUMNS)
+
+MYSQL_SCHEMA = [
+    f"""
+    CREATE TABLE IF NOT EXISTS estaciones_servicio (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        IDEESS VARCHAR(20) UNIQUE,
+        cp VARCHAR(10),
+        direccion TEXT,
+        horario TEXT,
+        latitud DECIMAL(10, 8),
+        localidad VARCHAR(100),
+        longitud_wgs84 DECIMAL(11, 8),
+        margen VARCHAR(5),
+        municipio VARCHAR(100),
+        provincia VARCHAR(100),
+        remision VARCHAR(10),
+        rotulo VARCHAR(100),
+        tipo_venta VARCHAR(5),
+        bio_etanol VARCHAR(10),
+        ester_metilico VARCHAR(10),
+        id_municipio VARCHAR(10),
+        id_provincia VARCHAR(10),
+        id_ccaa VARCHAR(10),
+
+        -- All fuel types from Tenerife data
+        {_FUEL_PRICE_DDL},
+
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+        INDEX idx_municipio (municipio),
+        INDEX idx_localidad (localidad),
+        INDEX idx_rotulo (rotulo),
+        INDEX idx_gasolina_95_e5 (precio_gasolina_95_e5),
+        INDEX idx_gasoleo_a (precio_gasoleo_a),
+        INDEX idx_ideess (IDEESS),
+        INDEX idx_location (latitud, longitud_wgs84)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS fuels (
+        fuel_id TINYINT UNSIGNED PRIMARY KEY,
+        price_column VARCHAR(64) NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stations (
+        station_id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+        ideess VARCHAR(20) NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS station_versions (
+        station_id SMALLINT UNSIGNED NOT NULL,
+        valid_from DATE NOT NULL,
+        valid_to DATE,
+        rotulo VARCHAR(100),
+        localidad VARCHAR(100),
+        municipio VARCHAR(100),
+        direccion TEXT,
+        latitud DECIMAL(10, 8),
+        longitud_wgs84 DECIMAL(11, 8),
+        PRIMARY KEY (station_id, valid_from),
+        INDEX idx_valid_to (valid_to)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS price_history (
+        date DATE NOT NULL,
+        station_id SMALLINT UNSIGNED NOT NULL,
+        fuel_id TINYINT UNSIGNED NOT NULL,
+        -- Price in tenths of a euro cent (1.459 EUR -> 1459)
+        price SMALLINT UNSIGNED NOT NULL,
+        PRIMARY KEY (fuel_id, date, station_id)
+    )
+    -- Monthly partitions are added (and expired ones dropped) by the maintenance job
+    PARTITION BY RANGE COLUMNS(date) (PARTITION p_future VALUES LESS THAN (MAXVALUE))
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS price_history_monthly (
+        month DATE NOT NULL,
+        station_id SMALLINT UNSIGNED NOT NULL,
+        fuel_id TINYINT UNSIGNED NOT NULL,
+        days TINYINT UNSIGNED NOT NULL,
+        avg_price SMALLINT UNSIGNED NOT NULL,
+        min_price SMALLINT UNSIGNED NOT NULL,
+        max_price SMALLINT UNSIGNED NOT NULL,
+        PRIMARY KEY (fuel_id, month, station_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS price_intervals (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        station_id SMALLINT UNSIGNED NOT NULL,
+        fuel_id TINYINT UNSIGNED NOT NULL,
+        price SMALLINT UNSIGNED NOT NULL,
+        valid_from DATETIME NOT NULL,
+        -- NULL while the price is still current
+        valid_to DATETIME,
+        INDEX idx_station_fuel_from (station_id, fuel_id, valid_from),
+        INDEX idx_fuel_from (fuel_id, valid_from),
+        INDEX idx_valid_from (valid_from),
+        INDEX idx_valid_to (valid_to)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS daily_price_stats (
+        date DATE NOT NULL,
+        fuel_id TINYINT UNSIGNED NOT NULL,
+        -- Empty string holds the island-wide figures
+        municipio VARCHAR(100) NOT NULL,
+        station_count SMALLINT UNSIGNED NOT NULL,
+        avg_price SMALLINT UNSIGNED NOT NULL,
+        min_price SMALLINT UNSIGNED NOT NULL,
+        max_price SMALLINT UNSIGNED NOT NULL,
+        p10_price SMALLINT UNSIGNED NOT NULL,
+        p50_price SMALLINT UNSIGNED NOT NULL,
+        p90_price SMALLINT UNSIGNED NOT NULL,
+        PRIMARY KEY (fuel_id, municipio, date),
+        INDEX idx_date (date)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS history_meta (
+        name VARCHAR(50) PRIMARY KEY,
+        counter BIGINT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_subscriptions (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        username VARCHAR(255),
+        fuel_type VARCHAR(50) NOT NULL,
+        price_threshold DECIMAL(5, 3) NOT NULL,
+        municipio VARCHAR(100),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_active BOOLEAN DEFAULT TRUE,
+        -- Location alerts have a centre and radius instead of a municipio
+        latitude DECIMAL(10, 8),
+        longitude DECIMAL(11, 8),
+        radius_km DECIMAL(5, 2),
+        -- Bit flags (see alerts_tenerife): 1 = persistent, 2 = disarmed until the price rises
+        alert_state TINYINT NOT NULL DEFAULT 0,
+        last_notified_at DATETIME,
+        INDEX idx_user_id (user_id),
+        INDEX idx_fuel_type (fuel_type),
+        INDEX idx_active (is_active),
+        INDEX idx_municipio (municipio)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS alert_outbox (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        alert_id INT NOT NULL,
+        user_id BIGINT NOT NULL,
+        -- Identifies the price that triggered the alert ("<IDEESS>:<price>")
+        event_key VARCHAR(64) NOT NULL,
+        fuel_type VARCHAR(50) NOT NULL,
+        current_price DECIMAL(5, 3) NOT NULL,
+        threshold DECIMAL(5, 3) NOT NULL,
+        municipality VARCHAR(100),
+        station_name VARCHAR(100),
+        station_address TEXT,
+        -- pending -> sending -> delivered, or failed / cancelled
+        status VARCHAR(10) NOT NULL DEFAULT 'pending',
+        attempts SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+        claim_token VARCHAR(32),
+        claimed_at DATETIME,
+        -- A failed send is retried no earlier than this
+        next_attempt_at DATETIME,
+        delivered_at DATETIME,
+        last_error VARCHAR(255),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_alert_event (alert_id, event_key),
+        INDEX idx_status (status, id),
+        INDEX idx_claim_token (claim_token)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS broadcast_jobs (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        admin_id BIGINT NOT NULL,
+        message TEXT NOT NULL,
+        -- running -> completed or cancelled
+        status VARCHAR(10) NOT NULL DEFAULT 'running',
+        total INT NOT NULL DEFAULT 0,
+        sent INT NOT NULL DEFAULT 0,
+        failed INT NOT NULL DEFAULT 0,
+        blocked INT NOT NULL DEFAULT 0,
+        progress_message_id BIGINT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at DATETIME,
+        INDEX idx_status (status)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS broadcast_recipients (
+        job_id INT NOT NULL,
+        user_id BIGINT NOT NULL,
+        -- pending, sent, failed or blocked (the user blocked the bot)
+        status VARCHAR(10) NOT NULL DEFAULT 'pending',
+        error VARCHAR(255),
+        sent_at DATETIME,
+        PRIMARY KEY (job_id, user_id),
+        INDEX idx_job_status (job_id, status)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS bot_users (
+        user_id BIGINT PRIMARY KEY,
+        username VARCHAR(255),
+        first_name VARCHAR(255),
+        last_name VARCHAR(255),
+        language_code VARCHAR(10),
+        first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        interaction_count INT DEFAULT 1,
+        is_active BOOLEAN DEFAULT TRUE,
+        INDEX idx_username (username),
+        INDEX idx_last_seen (last_seen),
+        INDEX idx_is_active (is_active)
+    )
+    """
+]
+
+# SQLite index names are database-wide, so they are prefixed with the table name.
+# Timestamp defaults use local time to match MySQL's CURRENT_TIMESTAMP.
+SQLITE_SCHEMA = [
+    f"""
+    CREATE TABLE IF NOT EXISTS estaciones_servicio (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        IDEESS VARCHAR(20) UNIQUE,
+        cp VARCHAR(10),
+        direccion TEXT,
+        horario TEXT,
+        latitud DECIMAL(10, 8),
+        localidad VARCHAR(100),
+        longitud_wgs84 DECIMAL(11, 8),
+        margen VARCHAR(5),
+        municipio VARCHAR(100),
+        provincia VARCHAR(100),
+        remision VARCHAR(10),
+        rotulo VARCHAR(100),
+        tipo_venta VARCHAR(5),
+        bio_etanol VARCHAR(10),
+        ester_metilico VARCHAR(10),
+        id_municipio VARCHAR(10),
+        id_provincia VARCHAR(10),
+        id_ccaa VARCHAR(10),
+        {_FUEL_PRICE_DDL},
+        last_updated TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_estaciones_municipio ON estaciones_servicio (municipio)",
+    "CREATE INDEX IF NOT EXISTS idx_estaciones_id_municipio ON estaciones_servicio (id_municipio)",
+    "CREATE INDEX IF NOT EXISTS idx_estaciones_rotulo ON estaciones_servicio (rotulo)",
+    "CREATE INDEX IF NOT EXISTS idx_estaciones_location ON estaciones_servicio (latitud, longitud_wgs84)",
+    """
+    CREATE TABLE IF NOT EXISTS fuels (
+        fuel_id TINYINT PRIMARY KEY,
+        price_column VARCHAR(64) NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stations (
+        station_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ideess VARCHAR(20) NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS station_versions (
+        station_id SMALLINT NOT NULL,
+        valid_from DATE NOT NULL,
+        valid_to DATE,
+        rotulo VARCHAR(100),
+        localidad VARCHAR(100),
+        municipio VARCHAR(100),
+        direccion TEXT,
+        latitud DECIMAL(10, 8),
+        longitud_wgs84 DECIMAL(11, 8),
+        PRIMARY KEY (station_id, valid_from)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_station_versions_valid_to ON station_versions (valid_to)",
+    """
+    CREATE TABLE IF NOT EXISTS price_history (
+        date DATE NOT NULL,
+        station_id SMALLINT NOT NULL,
+        fuel_id TINYINT NOT NULL,
+        price SMALLINT NOT NULL,
+        PRIMARY KEY (fuel_id, date, station_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS price_history_monthly (
+        month DATE NOT NULL,
+        station_id SMALLINT NOT NULL,
+        fuel_id TINYINT NOT NULL,
+        days TINYINT NOT NULL,
+        avg_price SMALLINT NOT NULL,
+        min_price SMALLINT NOT NULL,
+        max_price SMALLINT NOT NULL,
+        PRIMARY KEY (fuel_id, month, station_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS price_intervals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        station_id SMALLINT NOT NULL,
+        fuel_id TINYINT NOT NULL,
+        price SMALLINT NOT NULL,
+        valid_from DATETIME NOT NULL,
+        valid_to DATETIME
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_price_intervals_station_fuel_from ON price_intervals (station_id, fuel_id, valid_from)",
+    "CREATE INDEX IF NOT EXISTS idx_price_intervals_fuel_from ON price_intervals (fuel_id, valid_from)",
+    "CREATE INDEX IF NOT EXISTS idx_price_intervals_valid_from ON price_intervals (valid_from)",
+    "CREATE INDEX IF NOT EXISTS idx_price_intervals_valid_to ON price_intervals (valid_to)",
+    """
+    CREATE TABLE IF NOT EXISTS daily_price_stats (
+        date DATE NOT NULL,
+        fuel_id TINYINT NOT NULL,
+        municipio VARCHAR(100) NOT NULL,
+        station_count SMALLINT NOT NULL,
+        avg_price SMALLINT NOT NULL,
+        min_price SMALLINT NOT NULL,
+        max_price SMALLINT NOT NULL,
+        p10_price SMALLINT NOT NULL,
+        p50_price SMALLINT NOT NULL,
+        p90_price SMALLINT NOT NULL,
+        PRIMARY KEY (fuel_id, municipio, date)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_daily_price_stats_date ON daily_price_stats (date)",
+    """
+    CREATE TABLE IF NOT EXISTS history_meta (
+        name VARCHAR(50) PRIMARY KEY,
+        counter BIGINT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_subscriptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id BIGINT NOT NULL,
+        username VARCHAR(255),
+        fuel_type VARCHAR(50) NOT NULL,
+        price_threshold DECIMAL(5, 3) NOT NULL,
+        municipio VARCHAR(100),
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        is_active BOOLEAN DEFAULT TRUE,
+        latitude DECIMAL(10, 8),
+        longitude DECIMAL(11, 8),
+        radius_km DECIMAL(5, 2),
+        alert_state TINYINT NOT NULL DEFAULT 0,
+        last_notified_at DATETIME
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_subscriptions_user_id ON user_subscriptions (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_subscriptions_active ON user_subscriptions (is_active, fuel_type, municipio)",
+    """
+    CREATE TABLE IF NOT EXISTS alert_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        alert_id INT NOT NULL,
+        user_id BIGINT NOT NULL,
+        event_key VARCHAR(64) NOT NULL,
+        fuel_type VARCHAR(50) NOT NULL,
+        current_price DECIMAL(5, 3) NOT NULL,
+        threshold DECIMAL(5, 3) NOT NULL,
+        municipality VARCHAR(100),
+        station_name VARCHAR(100),
+        station_address TEXT,
+        status VARCHAR(10) NOT NULL DEFAULT 'pending',
+        attempts SMALLINT NOT NULL DEFAULT 0,
+        claim_token VARCHAR(32),
+        claimed_at DATETIME,
+        next_attempt_at DATETIME,
+        delivered_at DATETIME,
+        last_error VARCHAR(255),
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        UNIQUE (alert_id, event_key)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_alert_outbox_status ON alert_outbox (status, id)",
+    "CREATE INDEX IF NOT EXISTS idx_alert_outbox_claim_token ON alert_outbox (claim_token)",
+    """
+    CREATE TABLE IF NOT EXISTS broadcast_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_id BIGINT NOT NULL,
+        message TEXT NOT NULL,
+        status VARCHAR(10) NOT NULL DEFAULT 'running',
+        total INT NOT NULL DEFAULT 0,
+        sent INT NOT NULL DEFAULT 0,
+        failed INT NOT NULL DEFAULT 0,
+        blocked INT NOT NULL DEFAULT 0,
+        progress_message_id BIGINT,
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        finished_at DATETIME
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status)",
+    """
+    CREATE TABLE IF NOT EXISTS broadcast_recipients (
+        job_id INT NOT NULL,
+        user_id BIGINT NOT NULL,
+        status VARCHAR(10) NOT NULL DEFAULT 'pending',
+        error VARCHAR(255),
+        sent_at DATETIME,
+        PRIMARY KEY (job_id, user_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_job_status ON broadcast_recipients (job_id, status)",
+    """
+    CREATE TABLE IF NOT EXISTS bot_users (
+        user_id BIGINT PRIMARY KEY,
+        username VARCHAR(255),
+        first_name VARCHAR(255),
+        last_name VARCHAR(255),
+        language_code VARCHAR(10),
+        first_seen TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        last_seen TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        interaction_count INT DEFAULT 1,
+        is_active BOOLEAN DEFAULT TRUE
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_bot_users_username ON bot_users (username)",
+    "CREATE INDEX IF NOT EXISTS idx_bot_users_last_seen ON bot_users (last_seen)",
+    "CREATE INDEX IF NOT EXISTS idx_bot_users_is_active ON bot_users (is_active)"
+]
@@ -0,0 +1,81 @@
+import os
+import json
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class TelegramFileIdStore:
+    """Persistent map of (chart key, history version) -> Telegram file_id.
+
+    Once a chart has been uploaded, Telegram's file_id lets the bot resend the
+    same photo without uploading the bytes again. Only the newest history
+    version is kept, since older charts are never requested again.
+    """
+
+    def __init__(self, path=os.path.join('data', 'chart_file_ids.json')):
+        self.path = path
+        self._lock = threading.Lock()
+        self._version = None
+        self._file_ids = {}
+        self.stats = {'reused': 0, 'uploaded': 0, 'invalidated': 0}
+        self._load()
+
+    @staticmethod
+    def _key(fuel_type, days):
+        return f"{fuel_type}:{int(days)}"
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._version = data.get('version')
+            self._file_ids = data.get('file_ids', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load chart file_id map: {e}")
+
+    def _save(self):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': self._version, 'file_ids': self._file_ids}, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.error(f"Could not save chart file_id map: {e}")
+
+    def get(self, fuel_type, days, version):
+        """Return the file_id of an already uploaded chart, or None."""
+        with self._lock:
+            if version != self._version:
+                return None
+            return self._file_ids.get(self._key(fuel_type, days))
+
+    def set(self, fuel_type, days, version, file_id):
+        """Remember the file_id Telegram returned for an uploaded chart."""
+        with self._lock:
+            if version != self._version:
+                # New history version: every previous chart is stale
+                self._version = version
+                self._file_ids = {}
+            self._file_ids[self._key(fuel_type, days)] = file_id
+            self.stats['uploaded'] += 1
+            self._save()
+
+    def invalidate(self, fuel_type, days, version):
+        """Forget a file_id Telegram no longer accepts."""
+        with self._lock:
+            if version == self._version and self._file_ids.pop(self._key(fuel_type, days), None):
+                self.stats['invalidated'] += 1
+                self._save()
+
+    def record_reuse(self):
+        with self._lock:
+            self.stats['reused'] += 1
+
+# Create global instance
+chart_file_ids = TelegramFileIdStore()
@@ -0,0 +1,166 @@
+import asyncio
+import random
+import time
+import logging
+from telegram.error import RetryAfter, NetworkError, BadRequest
+import secret
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Asyncio token bucket: ``rate`` tokens per second, bursts up to ``capacity``."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def pause(self, seconds):
+        """Hand out no tokens for ``seconds`` (Telegram asked us to back off)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        # Refill from the end of the pause, not from the last token taken
+        self._updated = self._paused_until
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class TelegramSender:
+    """Concurrent Telegram delivery that stays under the flood limits.
+
+    Messages go out from up to ``concurrency`` tasks at once, all drawing from
+    one global token bucket (Telegram allows about 30 messages per second per
+    bot) while messages to the same chat are spaced ``chat_interval`` seconds
+    apart. A RetryAfter pauses every sender for the time Telegram asks for;
+    timeouts and other network errors are retried with exponential backoff.
+    Bad requests and blocked users fail at once.
+    """
+
+    def __init__(self, rate=30, chat_interval=1.0, concurrency=16, max_retries=3, backoff=1.0):
+        self.bucket = TokenBucket(rate)
+        self.chat_interval = chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._chat_next = {}
+        self.stats = {
+            'sent': 0,
+            'failed': 0,
+            'retries': 0,
+            'flood_waits': 0,
+            'flood_wait_seconds': 0.0,
+        }
+        self.last_run = None
+
+    async def _wait_for_chat(self, chat_id):
+        # Reserve the chat's next slot before sleeping so concurrent sends queue up
+        now = time.monotonic()
+        slot = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = slot + self.chat_interval
+        if len(self._chat_next) > 10000:
+            self._chat_next = {chat: next_slot for chat, next_slot in self._chat_next.items() if next_slot > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def send_message(self, bot, chat_id, **kwargs):
+        """Send one message under the rate limits, retrying transient failures."""
+        attempt = 0
+        while True:
+            await self._wait_for_chat(chat_id)
+            await self.bucket.acquire()
+            try:
+                message = await bot.send_message(chat_id=chat_id, **kwargs)
+                self.stats['sent'] += 1
+                return message
+            except RetryAfter as e:
+                delay = e.retry_after
+                delay = delay.total_seconds() if hasattr(delay, 'total_seconds') else float(delay)
+                self.stats['flood_waits'] += 1
+                self.stats['flood_wait_seconds'] += delay
+                logger.warning(f"Telegram flood limit hit, pausing sends for {delay:.0f}s")
+                self.bucket.pause(delay)
+            except BadRequest:
+                self.stats['failed'] += 1
+                raise
+            except NetworkError as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    self.stats['failed'] += 1
+                    raise
+                delay = self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                logger.warning(f"Send to {chat_id} failed ({e}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            except Exception:
+                self.stats['failed'] += 1
+                raise
+            self.stats['retries'] += 1
+
+    async def send_many(self, bot, items, build, on_sent=None, on_failed=None):
+        """Send one message per item concurrently and return the run's metrics.
+
+        ``build(item)`` returns the send_message keyword arguments (including
+        chat_id). The optional coroutines ``on_sent(item, message)`` and
+        ``on_failed(item, error)`` run as each send finishes.
+        """
+        queue = asyncio.Queue()
+        for item in items:
+            queue.put_nowait(item)
+        run = {'total': queue.qsize(), 'sent': 0, 'failed': 0}
+        start = time.perf_counter()
+
+        async def worker():
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    message = await self.send_message(bot, **build(item))
+                except Exception as e:
+                    run['failed'] += 1
+                    callback, result = on_failed, e
+                else:
+                    run['sent'] += 1
+                    callback, result = on_sent, message
+                if callback:
+                    try:
+                        await callback(item, result)
+                    except Exception as e:
+                        logger.error(f"Delivery callback failed: {e}")
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, run['total']))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+        run['seconds'] = time.perf_counter() - start
+        run['per_second'] = run['sent'] / run['seconds'] if run['seconds'] > 0 else 0.0
+        self.last_run = run
+        return run
+
+    def get_statistics(self):
+        """Return lifetime counters plus the metrics of the last send_many run."""
+        stats = dict(self.stats)
+        stats['last_run'] = self.last_run
+        return stats
+
+# Create global instance
+telegram_sender = TelegramSender(
+    rate=secret.secret.get('telegram_send_rate', 30),
+    concurrency=secret.secret.get('telegram_send_concurrency', 16)
+)